@@ -0,0 +1,201 @@
+import argparse
+import itertools
+import json
+import multiprocessing
+import os
+import platform
+import tempfile
+import time
+import tracemalloc
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import rasterio
+from rasterio.transform import from_origin
+
+# imported up front so the spawned measuring process has loaded them before the clock starts
+from policy_analysis.fill_nodata import fill_nodata
+from policy_analysis.instrument import configure, peak_rss_mb
+from policy_analysis.merge_rasters import MergeMedianRasters
+from policy_analysis.reproject import destination_grid, reproject_file
+from policy_analysis.zonal_stats import ZoneLayer, zonal_stats_table
+
+STAGES = ["merge", "reproject", "fill", "zonal"]
+CRS = "EPSG:27700"
+PIXEL_SIZE = 30
+ORIGIN = (380000, 280000)
+
+
+def blobs(rng, shape, fraction, blob_size = 32):
+    """
+    Boolean mask covering about `fraction` of `shape` in blocky blobs of roughly `blob_size` pixels, like cloud cover.
+    """
+    if fraction <= 0:
+        return np.zeros(shape, dtype = bool)
+    coarse = rng.random((shape[0] // blob_size + 1, shape[1] // blob_size + 1))
+    field = np.kron(coarse, np.ones((blob_size, blob_size)))[:shape[0], :shape[1]]
+    field += rng.random(shape) * 0.2  # ragged edges
+    return field < np.quantile(field, fraction)
+
+
+def synthetic_stack(directory, year, scenes, height, width, nan_fraction = 0.1, cloud_fraction = 0.3, seed = 0):
+    """
+    Writes `scenes` float32 NDVI scenes into `<directory>/LANDSAT_7_<year>/` on a 30 m EPSG:27700 grid.
+    Each scene is a smooth NDVI surface plus noise, with scattered NoData (`nan_fraction`, like SLC-off gaps)
+    and blob-shaped cloud gaps (`cloud_fraction`). Returns the scene paths.
+    """
+    rng = np.random.default_rng(seed)
+    year_dir = os.path.join(directory, f"LANDSAT_7_{year}")
+    os.makedirs(year_dir, exist_ok = True)
+    rows, cols = np.mgrid[0:height, 0:width]
+    surface = 0.35 + 0.3 * np.sin(rows / 97.0) * np.cos(cols / 131.0)
+    profile = {"driver": "GTiff", "count": 1, "dtype": "float32", "nodata": np.nan, "crs": CRS,
+               "transform": from_origin(*ORIGIN, PIXEL_SIZE, PIXEL_SIZE), "width": width, "height": height,
+               "tiled": True, "blockxsize": 256, "blockysize": 256, "compress": "lzw"}
+
+    paths = []
+    for scene in range(scenes):
+        ndvi = (surface + rng.normal(0, 0.05, (height, width))).clip(-1, 1).astype(np.float32)
+        ndvi[rng.random((height, width)) < nan_fraction] = np.nan
+        ndvi[blobs(rng, (height, width), cloud_fraction)] = np.nan
+        path = os.path.join(year_dir, f"NDVI_{year}_{scene:03d}.tif")
+        with rasterio.open(path, "w", **profile) as dst:
+            dst.write(ndvi, 1)
+        paths.append(path)
+    return paths
+
+
+def synthetic_zones(path, polygons, height, width, seed = 0):
+    """
+    Writes `polygons` overlapping circular zones over the synthetic grid to a GeoPackage layer `bdas`
+    with a `project_name` column, like interest_areas/bda.gpkg. Returns the path.
+    """
+    import geopandas as gpd
+    from shapely.geometry import Point
+
+    rng = np.random.default_rng(seed)
+    extent = min(height, width) * PIXEL_SIZE
+    centres_x = ORIGIN[0] + rng.uniform(0, width * PIXEL_SIZE, polygons)
+    centres_y = ORIGIN[1] - rng.uniform(0, height * PIXEL_SIZE, polygons)
+    radii = rng.uniform(0.02, 0.15, polygons) * extent
+    geometries = [Point(x, y).buffer(r) for x, y, r in zip(centres_x, centres_y, radii)]
+    gdf = gpd.GeoDataFrame({"project_name": [f"zone_{i}" for i in range(polygons)]}, geometry = geometries, crs = CRS)
+    gdf.to_file(path, layer = "bdas", driver = "GPKG")
+    return path
+
+
+def run_stage(stage, case_dir, rasters, zones_path):
+    composite = os.path.join(case_dir, "median.tif")
+    if stage == "merge":
+        MergeMedianRasters(case_dir).median_composite(rasters, composite)
+    elif stage == "reproject":
+        transform, width, height = destination_grid(rasters[0], "EPSG:4326")
+        reproject_file(rasters[0], os.path.join(case_dir, "reprojected.tif"), "EPSG:4326", transform, width, height)
+    elif stage == "fill":
+        fill_nodata(composite, os.path.join(case_dir, "filled.tif"), force = True)
+    elif stage == "zonal":
+        zones = ZoneLayer(zones_path, layer = "bdas", id_column = "project_name",
+                          cache_dir = tempfile.mkdtemp(dir = case_dir))  # cold cache, indexing included
+        zonal_stats_table(rasters, zones)
+
+
+def measure(stage, case_dir, rasters, zones_path):
+    """
+    Runs one stage and returns its wall time, peak traced Python/NumPy allocation, the process peak RSS and how much
+    the peak RSS grew during the stage (GDAL's own buffers only show up in RSS). Meant to run in a fresh process.
+    """
+    configure(quiet = True)
+    rss_before = peak_rss_mb()
+    tracemalloc.start()
+    start = time.perf_counter()
+    run_stage(stage, case_dir, rasters, zones_path)
+    seconds = time.perf_counter() - start
+    traced_peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    rss_after = peak_rss_mb()
+    return {"seconds": round(seconds, 4), "traced_peak_mb": round(traced_peak / 1024 ** 2, 2),
+            "max_rss_mb": None if rss_after is None else round(rss_after, 2),
+            "rss_growth_mb": None if rss_after is None else round(rss_after - rss_before, 2)}
+
+
+def environment():
+    return {"python": platform.python_version(), "platform": platform.platform(), "cpus": os.cpu_count(),
+            "numpy": np.__version__, "rasterio": rasterio.__version__, "gdal": rasterio.__gdal_version__}
+
+
+def run_benchmarks(workdir, sizes = (512, 1024), scenes = (5, 10), polygons = (5, 50), stages = STAGES,
+                   nan_fraction = 0.1, cloud_fraction = 0.3, repeats = 1, seed = 0):
+    """
+    Benchmarks `stages` on synthetic data for every combination of grid size (square, in pixels), scene count and
+    polygon count. Polygon counts only vary the zonal stage. Each measurement runs in its own spawned process.
+    Returns a dict with the environment and one result record per stage, case and repeat.
+    """
+    context = multiprocessing.get_context("spawn")
+    results = []
+    for size, n_scenes in itertools.product(sizes, scenes):
+        case_dir = os.path.join(workdir, f"{size}px_{n_scenes}scenes")
+        rasters = synthetic_stack(case_dir, 2020, n_scenes, size, size, nan_fraction = nan_fraction,
+                                  cloud_fraction = cloud_fraction, seed = seed)
+        if "fill" in stages and "merge" not in stages:
+            run_stage("merge", case_dir, rasters, None)  # fill reads the composite
+        for stage in [stage for stage in STAGES if stage in stages]:
+            for n_polygons in (polygons if stage == "zonal" else [None]):
+                zones_path = None
+                if n_polygons is not None:
+                    zones_path = synthetic_zones(os.path.join(case_dir, f"zones_{n_polygons}.gpkg"), n_polygons, size, size, seed = seed)
+                for repeat in range(repeats):
+                    with ProcessPoolExecutor(max_workers = 1, mp_context = context) as executor:
+                        metrics = executor.submit(measure, stage, case_dir, rasters, zones_path).result()
+                    record = {"stage": stage, "size": size, "scenes": n_scenes, "polygons": n_polygons,
+                              "repeat": repeat, **metrics}
+                    print(json.dumps(record))
+                    results.append(record)
+    return {"environment": environment(), "nan_fraction": nan_fraction, "cloud_fraction": cloud_fraction,
+            "results": results}
+
+
+def compare(baseline_path, current_path, threshold = 0.1):
+    """
+    Prints stages whose time or peak RSS grew by more than `threshold` (a fraction) between two result files.
+    Returns the regressions as a list of dicts.
+    """
+    def keyed(path):
+        with open(path) as f:
+            return {(r["stage"], r["size"], r["scenes"], r["polygons"], r["repeat"]): r for r in json.load(f)["results"]}
+
+    baseline, current = keyed(baseline_path), keyed(current_path)
+    regressions = []
+    for key in sorted(set(baseline) & set(current), key = str):
+        for metric in ("seconds", "traced_peak_mb", "max_rss_mb"):
+            before, after = baseline[key][metric], current[key][metric]
+            if before and after and (after - before) / before > threshold:
+                regressions.append({"case": key, "metric": metric, "before": before, "after": after})
+                print(f"{key}: {metric} {before} -> {after}")
+    print(f"{len(regressions)} regressions above {threshold:.0%}")
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "Benchmark the NDVI processing stages on synthetic rasters (offline).")
+    parser.add_argument("--sizes", type = int, nargs = "+", default = [512, 1024], help = "square grid sizes in pixels")
+    parser.add_argument("--scenes", type = int, nargs = "+", default = [5, 10])
+    parser.add_argument("--polygons", type = int, nargs = "+", default = [5, 50])
+    parser.add_argument("--stages", nargs = "+", default = STAGES, choices = STAGES)
+    parser.add_argument("--nan-fraction", type = float, default = 0.1)
+    parser.add_argument("--cloud-fraction", type = float, default = 0.3)
+    parser.add_argument("--repeats", type = int, default = 1)
+    parser.add_argument("--workdir", default = None, help = "where synthetic data is written (default: a temporary folder)")
+    parser.add_argument("--output", default = "benchmark_results.json")
+    parser.add_argument("--compare", default = None, help = "earlier results file to check the new results against")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        results = run_benchmarks(args.workdir or tmp, sizes = args.sizes, scenes = args.scenes, polygons = args.polygons,
+                                 stages = args.stages, nan_fraction = args.nan_fraction,
+                                 cloud_fraction = args.cloud_fraction, repeats = args.repeats)
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent = 2)
+    print(f"Benchmark results saved to {args.output}")
+    if args.compare:
+        compare(args.compare, args.output)
@@ -0,0 +1,171 @@
+import os
+
+import numpy as np
+import pandas as pd
+import rasterio
+
+from policy_analysis import ndvi_codec
+from policy_analysis.cog import read_overview, staging_path, tiled_profile, to_cog
+from policy_analysis.instrument import log, stage
+from policy_analysis.ndvi_cube import open_stack
+from policy_analysis.utils import iter_row_strips
+
+# Values of the classified change raster; 0 is NoData
+CHANGE_CLASSES = {"loss": 1, "stable": 2, "gain": 3}
+CLASS_NODATA = 0
+
+
+def classify_change(difference, gain_threshold = 0.1, loss_threshold = -0.1):
+    """
+    Classifies an NDVI difference array: >= `gain_threshold` is gain, <= `loss_threshold` is loss, anything
+    between is stable and NaN is NoData. Returns a uint8 array of CHANGE_CLASSES values.
+    """
+    classes = np.full(difference.shape, CLASS_NODATA, dtype = np.uint8)
+    valid = ~np.isnan(difference)
+    classes[valid] = CHANGE_CLASSES["stable"]
+    classes[valid & (difference >= gain_threshold)] = CHANGE_CLASSES["gain"]
+    classes[valid & (difference <= loss_threshold)] = CHANGE_CLASSES["loss"]
+    return classes
+
+
+def year_pairs(years, mode = "consecutive", year_from = None, year_to = None):
+    """
+    The (earlier, later) year pairs to compare: one explicit pair if `year_from` and `year_to` are given,
+    otherwise every consecutive pair (`mode="consecutive"`) or every year against the first (`mode="baseline"`).
+    """
+    if year_from is not None or year_to is not None:
+        year_from = years[0] if year_from is None else year_from
+        year_to = years[-1] if year_to is None else year_to
+        missing = {year_from, year_to} - set(years)
+        if missing:
+            raise ValueError(f"No NDVI raster for {sorted(missing)}, available years are {years}")
+        return [(year_from, year_to)]
+    if mode == "consecutive":
+        return list(zip(years[:-1], years[1:]))
+    if mode == "baseline":
+        return [(years[0], year) for year in years[1:]]
+    raise ValueError(f"Unknown mode {mode!r}, expected 'consecutive' or 'baseline'")
+
+
+def detect_change(source, output_dir, zone_layer = None, id_column = "project_name", year_from = None, year_to = None,
+                  mode = "consecutive", gain_threshold = 0.1, loss_threshold = None, block_rows = 256,
+                  compact = False, cog = False, block_size = 256):
+    """
+    Streams NDVI change between pairs of years of a yearly raster series or NDVICube (see `year_pairs`).
+
+    For each pair (a, b) it writes ndvi_change_<a>_<b>.tif (b - a) and ndvi_change_class_<a>_<b>.tif (loss/stable/gain,
+    see `classify_change`; `loss_threshold` defaults to -`gain_threshold`). The grid is processed in full-width strips
+    of `block_rows` rows and every year is read once per strip, however many pairs use it, so memory is
+    years x block_rows x width. If `zone_layer` (a `zonal_stats.ZoneLayer`, e.g. the BDAs) is given, per-zone
+    mean difference and loss/stable/gain areas in hectares (the grid must be in metres, e.g. EPSG:27700) are accumulated in the same pass and saved as
+    ndvi_change_summary.csv. The rasters are tiled in `block_size` tiles. Nothing is plotted, see `plot_change`.
+    Returns the summary DataFrame, or None without a zone layer.
+    """
+    loss_threshold = -gain_threshold if loss_threshold is None else loss_threshold
+    stack = open_stack(source)
+    pairs = year_pairs(stack.years, mode = mode, year_from = year_from, year_to = year_to)
+    years = sorted({year for pair in pairs for year in pair})
+    position = {year: i for i, year in enumerate(years)}
+    os.makedirs(output_dir, exist_ok = True)
+    height, width = stack.shape
+
+    base_profile = {"driver": "GTiff", "count": 1, "crs": stack.crs, "transform": stack.transform,
+                    "width": width, "height": height, "dtype": "float32", "nodata": np.nan}
+    difference_profile = tiled_profile(ndvi_codec.compact_profile(base_profile) if compact else base_profile, block_size)
+    class_profile = tiled_profile({**base_profile, "dtype": "uint8", "nodata": CLASS_NODATA}, block_size)
+    paths = {pair: (os.path.join(output_dir, f"ndvi_change_{pair[0]}_{pair[1]}.tif"),
+                    os.path.join(output_dir, f"ndvi_change_class_{pair[0]}_{pair[1]}.tif")) for pair in pairs}
+
+    index = zone_layer.index_for(stack.transform, stack.shape, stack.crs) if zone_layer is not None else None
+    if index is not None:
+        n_zones = index.n_zones
+        totals = {pair: {"pixels": np.zeros(n_zones), "difference": np.zeros(n_zones),
+                         **{name: np.zeros(n_zones) for name in CHANGE_CLASSES}} for pair in pairs}
+
+    destinations = {}
+    with stage("change", output_dir = output_dir, pairs = len(pairs)) as timing:
+        try:
+            for pair, (difference_path, class_path) in paths.items():
+                difference_dst = rasterio.open(staging_path(difference_path, cog), "w", **difference_profile)
+                class_dst = rasterio.open(staging_path(class_path, cog), "w", **class_profile)
+                if compact:
+                    ndvi_codec.set_scaling(difference_dst)
+                destinations[pair] = (difference_dst, class_dst)
+
+            for window in iter_row_strips(width, height, block_rows):
+                block = stack.read(window, years = years)
+                timing.read(block)
+                if index is not None:
+                    entries = index.rows_slice(window)
+                    local = index.pixel_index[entries] - int(window.row_off) * width
+                    zones = index.zone_ids[entries]
+
+                for pair, (difference_dst, class_dst) in destinations.items():
+                    difference = block[position[pair[1]]] - block[position[pair[0]]]
+                    classes = classify_change(difference, gain_threshold, loss_threshold)
+                    difference_dst.write(ndvi_codec.encode(difference) if compact else difference, 1, window = window)
+                    class_dst.write(classes, 1, window = window)
+                    timing.wrote(difference)
+
+                    if index is not None:
+                        zone_difference = difference.ravel()[local]
+                        zone_classes = classes.ravel()[local]
+                        valid = zone_classes != CLASS_NODATA
+                        total = totals[pair]
+                        total["pixels"] += np.bincount(zones, weights = valid, minlength = n_zones)
+                        total["difference"] += np.bincount(zones[valid], weights = zone_difference[valid], minlength = n_zones)
+                        for name, value in CHANGE_CLASSES.items():
+                            total[name] += np.bincount(zones, weights = zone_classes == value, minlength = n_zones)
+        finally:
+            for difference_dst, class_dst in destinations.values():
+                difference_dst.close()
+                class_dst.close()
+            stack.close()
+
+        if cog:
+            for difference_path, class_path in paths.values():
+                to_cog(staging_path(difference_path, cog), difference_path, block_size)
+                to_cog(staging_path(class_path, cog), class_path, block_size, resampling = "nearest")
+    log(f"Change rasters for {len(pairs)} year pair(s) written to {output_dir}", output_dir = output_dir, pairs = pairs)
+
+    if index is None:
+        return None
+
+    hectares_per_pixel = abs(stack.transform.a * stack.transform.e) / 10000
+    names = index.names if index.names is not None else np.arange(index.n_zones)
+    frames = []
+    for (first, last), total in totals.items():
+        frame = pd.DataFrame({id_column: names, "year_from": first, "year_to": last, "pixels": total["pixels"].astype(np.int64)})
+        with np.errstate(invalid = "ignore", divide = "ignore"):
+            frame["mean_difference"] = total["difference"] / total["pixels"]
+            for name in CHANGE_CLASSES:
+                frame[f"{name}_area_ha"] = total[name] * hectares_per_pixel
+                frame[f"{name}_fraction"] = total[name] / total["pixels"]
+        frames.append(frame)
+    summary = pd.concat(frames, ignore_index = True)
+
+    summary_path = os.path.join(output_dir, "ndvi_change_summary.csv")
+    summary.to_csv(summary_path, index = False)
+    log(f"Per-zone change summary saved to {summary_path}", output = summary_path)
+    return summary
+
+
+def plot_change(difference_path, output_path = None, max_size = 2048):
+    """
+    Renders a difference raster from `detect_change` at an overview level (longest side <= `max_size`).
+    Saves the figure to `output_path` if given, otherwise opens a window without blocking.
+    """
+    import matplotlib.pyplot as plt
+
+    with rasterio.open(difference_path) as src:
+        difference = read_overview(src, max_size)
+    figure, axis = plt.subplots(figsize = (10, 6))
+    image = axis.imshow(difference, cmap = "RdYlGn", vmin = -0.5, vmax = 0.5, interpolation = "none")
+    axis.set_title(os.path.basename(difference_path))
+    figure.colorbar(image, ax = axis, label = "NDVI Difference")
+    if output_path:
+        figure.savefig(output_path, dpi = 150, bbox_inches = "tight")
+        plt.close(figure)
+    else:
+        plt.show(block = False)
+    return figure
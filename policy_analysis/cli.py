@@ -0,0 +1,348 @@
+import argparse
+import os
+import sys
+
+# Only argparse and the instrument module are imported up front. Each subcommand imports the stage it runs when it
+# runs, so `policy-analysis zonal ...` never loads Earth Engine, matplotlib or scipy.
+from policy_analysis.instrument import Recorder, configure, recorder
+
+
+def stack_source(paths):
+    """
+    A single directory argument is an NDVICube, anything else a list of yearly rasters.
+    """
+    return paths[0] if len(paths) == 1 and os.path.isdir(paths[0]) else paths
+
+
+def zone_layer(args):
+    from policy_analysis.zonal_stats import ZoneLayer
+
+    return ZoneLayer(args.zones, layer = args.layer, id_column = args.id_column) if args.zones else None
+
+
+def export_landsat(args):
+    from policy_analysis.gee_ndvi_landsat_7 import LandsatNDVI
+
+    return LandsatNDVI().run_gee_task(args.years)
+
+
+def export_sentinel(args):
+    from policy_analysis.gee_ndvi import SentinelNDVI
+
+    return SentinelNDVI().run_gee_task(args.years)
+
+
+def local_ndvi(args):
+    from policy_analysis.local_ndvi import composite_years
+
+    return composite_years(args.directory, args.output_dir, args.sensor, block_size = args.block_size,
+                           workers = args.workers, compact = args.compact, cog = args.cog)
+
+
+def reproject(args):
+    from policy_analysis.reproject import batch_reproject_rasters
+    from policy_analysis.zonal_stats import ZoneLayer
+
+    clip_layer = ZoneLayer(args.clip, all_touched = True) if args.clip else None
+    return batch_reproject_rasters(args.input_dir, crs_ref = args.crs, clip_layer = clip_layer, workers = args.workers,
+                                   block_size = args.block_size, compact = args.compact, cog = args.cog)
+
+
+def merge(args):
+    from policy_analysis.merge_rasters import MergeMedianRasters
+
+    merger = MergeMedianRasters(args.directory, block_size = args.block_size, fill_workers = args.fill_workers,
+                                compact = args.compact, cog = args.cog)
+    return merger.merge_median_rasters(workers = args.workers)
+
+
+def fill(args):
+    from policy_analysis.fill_nodata import fill_nodata
+
+    return fill_nodata(args.input, args.output, max_distance = args.max_distance, workers = args.workers,
+                       force = args.force, cog = args.cog, block_size = args.block_size)
+
+
+def zonal(args):
+    from policy_analysis.zonal_stats import zonal_stats_table
+
+    table = zonal_stats_table(args.rasters, zone_layer(args), id_column = args.id_column)
+    table.to_csv(args.output, index = False)
+    return table
+
+
+def trend(args):
+    from policy_analysis.trend import trend_rasters
+
+    return trend_rasters(stack_source(args.source), args.output_dir, zone_layer = zone_layer(args),
+                         id_column = args.id_column, min_years = args.min_years, cog = args.cog,
+                         block_size = args.block_size)
+
+
+def change(args):
+    from policy_analysis.change_detection import detect_change
+
+    return detect_change(stack_source(args.source), args.output_dir, zone_layer = zone_layer(args),
+                         id_column = args.id_column, year_from = args.year_from, year_to = args.year_to,
+                         mode = args.mode, gain_threshold = args.gain_threshold, loss_threshold = args.loss_threshold,
+                         compact = args.compact, cog = args.cog, block_size = args.block_size)
+
+
+def temporal_fill(args):
+    from policy_analysis.temporal_fill import temporal_fill as fill_from_years
+
+    return fill_from_years(stack_source(args.source), args.output_dir, method = args.method, max_gap = args.max_gap,
+                           compact = args.compact, cog = args.cog, block_size = args.block_size)
+
+
+def land_cover(args):
+    from policy_analysis.land_cover import class_crosstab, value_category_table
+
+    table = class_crosstab(args.rasters, zone_layer(args), id_column = args.id_column)
+    table.to_csv(args.output, index = False)
+    if args.categories_output:
+        value_category_table(table, id_column = args.id_column).to_csv(args.categories_output, index = False)
+    return table
+
+
+def query(args):
+    import pandas as pd
+
+    from policy_analysis.query import NDVIQuery
+
+    ndvi = NDVIQuery(args.rasters)
+    try:
+        if args.point:
+            table = ndvi.point(*args.point, crs = args.crs).to_frame().T
+        elif args.points:
+            points = pd.read_csv(args.points)
+            ids = points[args.id_column] if args.id_column in points else None
+            table = ndvi.points(points[args.x_column], points[args.y_column], crs = args.crs, ids = ids)
+        else:
+            from policy_analysis.zonal_stats import load_zones
+
+            zones = load_zones(args.polygons, layer = args.layer)
+            crs = zones.crs.to_wkt() if zones.crs else args.crs
+            frames = []
+            for i, geometry in enumerate(zones.geometry):
+                frame = ndvi.polygon(geometry, crs = crs)
+                frame.insert(0, args.id_column, zones[args.id_column].iloc[i] if args.id_column in zones else i)
+                frames.append(frame)
+            table = pd.concat(frames, ignore_index = True)
+    finally:
+        ndvi.close()
+    if args.output:
+        table.to_csv(args.output, index = not args.polygons)
+    else:
+        print(table.to_string())
+    return table
+
+
+def regression(args):
+    from policy_analysis.regression_analysis import main as regression_main
+
+    return regression_main(args.input_dir, args.zones, output_path = args.plot)
+
+
+def pipeline(args):
+    from policy_analysis.pipeline import ndvi_pipeline
+
+    return ndvi_pipeline(args.directory, args.zones, zones_layer = args.layer, id_column = args.id_column,
+                         crs = args.crs, clip_path = args.clip, max_distance = args.max_distance, workers = args.workers,
+                         compact = args.compact, cog = args.cog, block_size = args.block_size).run(dry_run = args.dry_run)
+
+
+def tiles(args):
+    from policy_analysis.tiling import TiledJob, run_tiles
+
+    if args.action == "create":
+        params = {"cog": args.cog, "block_size": args.block_size}
+        if args.op == "composite":
+            params["compact"] = args.compact
+        elif args.op == "fill":
+            params["max_distance"] = args.max_distance
+        elif args.op == "zonal":
+            params.update(zones = args.zones, layer = args.layer, id_column = args.id_column)
+        return TiledJob.create(args.job_dir, args.op, args.inputs, args.output, tile_size = args.tile_size,
+                               halo = args.halo, **params)
+    if args.action == "work":
+        return TiledJob(args.job_dir).work(stale_after = args.stale_after)
+    if args.action == "run":
+        return run_tiles(args.job_dir, workers = args.workers, stale_after = args.stale_after)
+    if args.action == "finish":
+        return TiledJob(args.job_dir).finish()
+    progress = TiledJob(args.job_dir).progress()
+    print(", ".join(f"{state}: {count}" for state, count in progress.items()))
+    return progress
+
+
+def build_parser():
+    # the instrumentation options are accepted before or after the subcommand
+    instrumentation = argparse.ArgumentParser(add_help = False, argument_default = argparse.SUPPRESS)
+    instrumentation.add_argument("--metrics", help = "append per-stage metrics to this JSON-lines file")
+    instrumentation.add_argument("--quiet", action = "store_true", default = argparse.SUPPRESS, help = "no progress messages, only the closing summary")
+    instrumentation.add_argument("--profile", help = "cProfile every run of this stage, e.g. fill")
+
+    parser = argparse.ArgumentParser(prog = "policy-analysis", description = "NDVI and land-cover analysis of policy areas.",
+                                     parents = [instrumentation])
+    commands = parser.add_subparsers(dest = "command", required = True)
+
+    def command(name, handler, help, zones = False, output = None):
+        sub = commands.add_parser(name, help = help, description = help, parents = [instrumentation])
+        sub.set_defaults(handler = handler)
+        if zones:
+            sub.add_argument("--zones", default = zones if isinstance(zones, str) else None, help = "interest-area layer, e.g. interest_areas/bda.gpkg")
+            sub.add_argument("--layer", default = "bdas")
+            sub.add_argument("--id-column", default = "project_name")
+        if output:
+            sub.add_argument("--output", default = output, help = "CSV to write the table to")
+        return sub
+
+    def raster_options(sub, compact = True, block_size = 512):
+        sub.add_argument("--cog", action = "store_true", help = "write Cloud-Optimized GeoTIFFs with overviews")
+        if compact:
+            sub.add_argument("--compact", action = "store_true", help = "store rasters as scaled int16 instead of float32")
+        sub.add_argument("--block-size", type = int, default = block_size, help = "internal tile size of the written rasters")
+
+    sub = command("export-landsat", export_landsat, "Export Landsat 7 NDVI scenes from Earth Engine to Google Drive.")
+    sub.add_argument("years", type = int, nargs = "+")
+
+    sub = command("export-sentinel", export_sentinel, "Export Sentinel-2 median NDVI from Earth Engine to Google Drive.")
+    sub.add_argument("years", type = int, nargs = "+")
+
+    sub = command("local-ndvi", local_ndvi, "Median NDVI composites per year from band GeoTIFFs on disk.")
+    sub.add_argument("directory", help = "folder of per-year scene folders, e.g. LANDSAT_7_2005")
+    sub.add_argument("output_dir")
+    sub.add_argument("--sensor", default = "landsat7", choices = ["landsat7", "sentinel2"])
+    sub.add_argument("--workers", type = int, default = 1)
+    raster_options(sub)
+
+    sub = command("reproject", reproject, "Reproject every raster in a folder into <folder>/reprojected.")
+    sub.add_argument("input_dir")
+    sub.add_argument("--crs", required = True, help = "e.g. EPSG:27700")
+    sub.add_argument("--clip", default = None, help = "boundary to clip the reprojected rasters to")
+    sub.add_argument("--workers", type = int, default = 1)
+    raster_options(sub)
+
+    sub = command("merge", merge, "Median composite and NoData fill of every LANDSAT_<year> folder.")
+    sub.add_argument("directory")
+    sub.add_argument("--workers", type = int, default = 1, help = "years processed in parallel")
+    sub.add_argument("--fill-workers", type = int, default = 1, help = "fill threads per year")
+    raster_options(sub)
+
+    sub = command("fill", fill, "Interpolate the NoData gaps of one raster.")
+    sub.add_argument("input")
+    sub.add_argument("output")
+    sub.add_argument("--max-distance", type = float, default = 50)
+    sub.add_argument("--workers", type = int, default = 1)
+    sub.add_argument("--force", action = "store_true", help = "refill even if the output is up to date")
+    raster_options(sub, compact = False)
+
+    sub = command("zonal", zonal, "Per-zone NDVI statistics for yearly rasters.",
+                  zones = "interest_areas/bda.gpkg", output = "zonal_stats.csv")
+    sub.add_argument("rasters", nargs = "+")
+
+    sub = command("trend", trend, "Per-pixel NDVI trend rasters, summarised per zone if --zones is given.", zones = True)
+    sub.add_argument("source", nargs = "+", help = "yearly rasters, or one NDVI cube folder")
+    sub.add_argument("--output-dir", default = "trend")
+    sub.add_argument("--min-years", type = int, default = 3)
+    raster_options(sub, compact = False, block_size = 256)
+
+    sub = command("change", change, "NDVI gain/loss rasters between years, summarised per zone if --zones is given.", zones = True)
+    sub.add_argument("source", nargs = "+", help = "yearly rasters, or one NDVI cube folder")
+    sub.add_argument("--output-dir", default = "change")
+    sub.add_argument("--year-from", type = int, default = None)
+    sub.add_argument("--year-to", type = int, default = None)
+    sub.add_argument("--mode", default = "consecutive", choices = ["consecutive", "baseline"])
+    sub.add_argument("--gain-threshold", type = float, default = 0.1)
+    sub.add_argument("--loss-threshold", type = float, default = None)
+    raster_options(sub, block_size = 256)
+
+    sub = command("temporal-fill", temporal_fill, "Fill NoData pixels from the same pixel in neighbouring years.")
+    sub.add_argument("source", nargs = "+", help = "yearly rasters, or one NDVI cube folder")
+    sub.add_argument("--output-dir", default = "temporal_fill")
+    sub.add_argument("--method", default = "linear", choices = ["linear", "nearest"])
+    sub.add_argument("--max-gap", type = int, default = None, help = "only fill from years at most this many years away")
+    raster_options(sub, block_size = 256)
+
+    sub = command("land-cover", land_cover, "Zone x class x year land-cover areas from yearly class rasters.",
+                  zones = "interest_areas/bda.gpkg", output = "land_cover.csv")
+    sub.add_argument("rasters", nargs = "+")
+    sub.add_argument("--categories-output", default = None, help = "CSV of areas per value category")
+
+    sub = command("query", query, "Yearly NDVI series of points or polygons, read only where they fall.")
+    sub.add_argument("rasters", nargs = "+")
+    target = sub.add_mutually_exclusive_group(required = True)
+    target.add_argument("--point", type = float, nargs = 2, metavar = ("X", "Y"))
+    target.add_argument("--points", help = "CSV of points, see --x-column/--y-column/--id-column")
+    target.add_argument("--polygons", help = "vector file of polygons, one statistics table per feature")
+    sub.add_argument("--crs", default = None, help = "CRS of the points (default: the rasters'), e.g. EPSG:4326")
+    sub.add_argument("--x-column", default = "x")
+    sub.add_argument("--y-column", default = "y")
+    sub.add_argument("--id-column", default = "id")
+    sub.add_argument("--layer", default = None)
+    sub.add_argument("--output", default = None, help = "CSV to write (default: print)")
+
+    sub = command("regression", regression, "Per-BDA NDVI statistics, trends and a mean NDVI plot.")
+    sub.add_argument("input_dir", nargs = "?", default = "ndvi/SENTINEL2/reprojected")
+    sub.add_argument("--zones", default = "interest_areas/bda.gpkg")
+    sub.add_argument("--plot", default = None, help = "save the plot here instead of showing it")
+
+    sub = command("pipeline", pipeline, "Incrementally rebuild the NDVI pipeline outputs.", zones = "interest_areas/bda.gpkg")
+    sub.add_argument("directory", help = "folder holding the LANDSAT_<year> scene folders")
+    sub.add_argument("--crs", default = None, help = "reproject scenes to this CRS first, e.g. EPSG:27700")
+    sub.add_argument("--clip", default = None, help = "boundary to clip reprojected scenes to")
+    sub.add_argument("--max-distance", type = float, default = 50)
+    sub.add_argument("--workers", type = int, default = 1)
+    sub.add_argument("--dry-run", action = "store_true", help = "list what would be rebuilt without running it")
+    raster_options(sub)
+
+    sub = command("tiles", tiles, "Run composite, fill or zonal tile by tile from a job folder shared by any number of workers.")
+    actions = sub.add_subparsers(dest = "action", required = True)
+    create = actions.add_parser("create", help = "set up (or resume) a job folder", parents = [instrumentation])
+    create.add_argument("job_dir")
+    create.add_argument("op", choices = ["composite", "fill", "zonal"])
+    create.add_argument("output", help = "raster (composite, fill) or CSV (zonal) written by `finish`")
+    create.add_argument("inputs", nargs = "+", help = "scenes (composite), one raster (fill) or yearly rasters (zonal)")
+    create.add_argument("--tile-size", type = int, default = 1024)
+    create.add_argument("--halo", type = int, default = None, help = "default: what the op needs, e.g. the fill distance")
+    create.add_argument("--max-distance", type = float, default = 50)
+    create.add_argument("--zones", default = "interest_areas/bda.gpkg")
+    create.add_argument("--layer", default = "bdas")
+    create.add_argument("--id-column", default = "project_name")
+    raster_options(create)
+    for name, help in (("work", "claim and process tiles until none are left"),
+                       ("run", "work the job with local processes, then finish it")):
+        action = actions.add_parser(name, help = help, parents = [instrumentation])
+        action.add_argument("job_dir")
+        action.add_argument("--stale-after", type = float, default = None,
+                            help = "first hand back tiles claimed more than this many seconds ago")
+        if name == "run":
+            action.add_argument("--workers", type = int, default = os.cpu_count())
+    for name, help in (("finish", "mosaic or reduce the finished tiles into the output"), ("status", "count tiles per state")):
+        actions.add_parser(name, help = help, parents = [instrumentation]).add_argument("job_dir")
+    return parser
+
+
+def main(argv = None):
+    """
+    Entry point of the `policy-analysis` command. Per-stage metrics are reported at the end of every run that
+    recorded any (including worker processes, when --metrics is given, but not earlier runs in the same file).
+    """
+    args = build_parser().parse_args(argv)
+    for name, default in (("metrics", None), ("quiet", False), ("profile", None)):
+        setattr(args, name, getattr(args, name, default))
+    configure(metrics_path = args.metrics, quiet = args.quiet, profile_stage = args.profile)
+    args.handler(args)
+
+    # the metrics file is appended to by every run, so only this run's records are reported
+    metrics = recorder()
+    if args.metrics and os.path.exists(args.metrics):
+        metrics = Recorder.load(args.metrics, run_id = metrics.run_id)
+    if metrics.summary():
+        metrics.report()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,61 @@
+import math
+import os
+
+import numpy as np
+import rasterio
+import rasterio.shutil
+from rasterio.enums import Resampling
+
+from policy_analysis import ndvi_codec
+
+
+def predictor_for(dtype):
+    """
+    TIFF predictor for `dtype`: floating point (3) for float rasters, horizontal differencing (2) for integers.
+    """
+    return 3 if np.issubdtype(np.dtype(dtype), np.floating) else 2
+
+
+def tiled_profile(profile, block_size = 512):
+    """
+    A copy of a GTiff write profile switched to internal `block_size` tiles, LZW and the predictor suited to its dtype,
+    so windowed reads decode only the tiles they touch.
+    """
+    profile = dict(profile)
+    profile.update(driver = "GTiff", tiled = True, blockxsize = block_size, blockysize = block_size,
+                   compress = "lzw", predictor = predictor_for(profile["dtype"]))
+    return profile
+
+
+def staging_path(output_path, cog):
+    """
+    Where a writer should write: `output_path` itself, or a temporary GTiff next to it that `to_cog` converts.
+    """
+    return f"{output_path}.staging.tif" if cog else output_path
+
+
+def to_cog(staged_path, output_path, block_size = 512, resampling = "average"):
+    """
+    Copies a finished GTiff to a Cloud-Optimized GeoTIFF at `output_path` with `block_size` tiles, the predictor
+    for its dtype and overviews built with `resampling` (use "nearest" for class rasters), then removes the staged file.
+    Tags and band scale/offset are carried over.
+    """
+    with rasterio.open(staged_path) as src:
+        predictor = predictor_for(src.dtypes[0])
+    rasterio.shutil.copy(staged_path, output_path, driver = "COG", BLOCKSIZE = block_size, COMPRESS = "LZW",
+                         PREDICTOR = predictor, OVERVIEWS = "AUTO", OVERVIEW_RESAMPLING = resampling.upper())
+    os.remove(staged_path)
+    return output_path
+
+
+def read_overview(src, max_size = 2048, band = 1):
+    """
+    Reads a band as float32 NDVI (NaN for NoData) decimated so its longest side is at most `max_size` pixels.
+    GDAL serves the read from the closest overview, so a quick look over a COG only decodes that level.
+    Returns the array at full resolution if the raster is already small enough.
+    """
+    factor = max(1, math.ceil(max(src.width, src.height) / max_size))
+    out_shape = (math.ceil(src.height / factor), math.ceil(src.width / factor))
+    scale, offset = ndvi_codec.band_scaling(src, band)
+    data = src.read(band, out_shape = out_shape, resampling = Resampling.nearest)
+    return ndvi_codec.decode(data, scale = scale, offset = offset, nodata = src.nodata)
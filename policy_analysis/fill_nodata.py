@@ -0,0 +1,116 @@
+import math
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import rasterio
+from rasterio.fill import fillnodata
+
+from policy_analysis.cog import tiled_profile, to_cog
+from policy_analysis.instrument import log, stage
+from policy_analysis.utils import file_hash, iter_windows, pad_window
+
+SOURCE_HASH_TAG = "FILL_SOURCE_SHA256"
+MAX_DISTANCE_TAG = "FILL_MAX_DISTANCE"
+
+
+def max_distance_tag(max_distance):
+    """
+    The MAX_DISTANCE_TAG value for `max_distance`, the same for 50 and 50.0 so the CLI's floats match library ints.
+    """
+    return repr(float(max_distance))
+
+
+def fill_is_current(output_file_path, source_hash, max_distance):
+    """
+    Checks whether `output_file_path` was already filled from a source with `source_hash` using `max_distance`.
+    """
+    if not os.path.exists(output_file_path):
+        return False
+    try:
+        with rasterio.open(output_file_path) as dst:
+            tags = dst.tags()
+    except rasterio.errors.RasterioIOError:
+        return False
+    return tags.get(SOURCE_HASH_TAG) == source_hash and tags.get(MAX_DISTANCE_TAG) == max_distance_tag(max_distance)
+
+
+def fill_halo(max_distance, smoothing_iterations = 0):
+    """
+    Pixels of context a tile needs on every side for its fill to match a whole-raster fill.
+    """
+    return int(math.ceil(max_distance)) + smoothing_iterations
+
+
+def fill_window(src, window, halo, max_distance, smoothing_iterations = 0, timing = None):
+    """
+    Fills the NoData gaps of `window` of band 1 of the open raster `src`, reading it with `halo` pixels of context.
+    Returns the filled block, the size of `window`.
+    """
+    padded, inner = pad_window(window, halo, src.width, src.height)
+    data = src.read(1, window=padded)
+    if timing is not None:
+        timing.read(data)
+    valid = ~np.isnan(data) if np.issubdtype(data.dtype, np.floating) else np.ones(data.shape, dtype=bool)
+    if src.nodata is not None and not np.isnan(src.nodata):
+        valid &= data != src.nodata
+    if valid.all() or not valid.any():
+        return data[inner]
+    filled = fillnodata(data, mask=valid.astype(np.uint8), max_search_distance=max_distance,
+                        smoothing_iterations=smoothing_iterations)
+    return filled[inner]
+
+
+def fill_nodata(input_raster, output_file_path, max_distance = 50, smoothing_iterations = 0,
+                tile_size = 1024, workers = 1, force = False, cog = False, block_size = 512):
+    """
+    Interpolates NoData gaps in band 1 of `input_raster` with GDAL's fill algorithm, in-process.
+
+    `max_distance` is the maximum search distance in pixels, as with gdal_fillnodata.py -md.
+    The raster is filled in `tile_size` tiles, each read with a halo of `max_distance` (+ smoothing) pixels so
+    the result matches a whole-raster fill, and tiles are spread across `workers` threads.
+    The source hash and `max_distance` are stored as tags on the output, so re-running on an unchanged
+    median raster is skipped unless `force` is set. The output keeps the input's dtype and band scale/offset,
+    so a compact int16 composite (see `ndvi_codec`) is filled as int16. The output is tiled in `block_size` tiles,
+    and with `cog` written as a Cloud-Optimized GeoTIFF with overviews. Returns True once the output is up to date.
+    """
+    source_hash = file_hash(input_raster)
+    if not force and fill_is_current(output_file_path, source_hash, max_distance):
+        log(f"{output_file_path} is up to date with {input_raster}, skipping fill.", output = output_file_path, skipped = True)
+        return True
+
+    halo = fill_halo(max_distance, smoothing_iterations)
+    local = threading.local()
+    handles = []
+
+    def fill_tile(window):
+        # rasterio datasets are not thread-safe, so each worker thread reads through its own handle
+        if not hasattr(local, "src"):
+            local.src = rasterio.open(input_raster)
+            handles.append(local.src)
+        return window, fill_window(local.src, window, halo, max_distance, smoothing_iterations, timing)
+
+    with rasterio.open(input_raster) as src:
+        profile = tiled_profile(src.profile, block_size)
+        scales, offsets = src.scales, src.offsets
+        windows = list(iter_windows(src.width, src.height, tile_size))
+
+    tmp_path = f"{output_file_path}.tmp"
+    with stage("fill", output = output_file_path, max_distance = max_distance) as timing:
+        with rasterio.open(tmp_path, "w", **profile) as dst:
+            with ThreadPoolExecutor(max_workers = workers) as executor:
+                for window, block in executor.map(fill_tile, windows):
+                    dst.write(block, 1, window=window)
+                    timing.wrote(block)
+            dst.scales, dst.offsets = scales, offsets
+            dst.update_tags(**{SOURCE_HASH_TAG: source_hash, MAX_DISTANCE_TAG: max_distance_tag(max_distance)})
+        for handle in handles:
+            handle.close()
+        if cog:
+            to_cog(tmp_path, output_file_path, block_size)
+        else:
+            os.replace(tmp_path, output_file_path)
+
+    log(f"Filled NoData gaps in {input_raster}, output saved to {output_file_path}", output = output_file_path)
+    return True
@@ -1,18 +1,29 @@
 
 import ee 
-import geemap
-import geopandas as gpd
-import time
 import os
+
+from policy_analysis.gee_tasks import TaskMonitor, start_with_retry
+from policy_analysis.instrument import log
+
 #authenticate and initialise api
 # ee.Authenticate()
 
 class SentinelNDVI():
+    ROI_BOUNDS = [-2.8524, 51.7836, -1.5161, 52.5075]
+
     def __init__(self):
-        ee.Initialize()
-        self.roi = ee.Geometry.Rectangle([-2.8524, 51.7836, -1.5161, 52.5075])
+        self.roi = None
         self.folder_prefix = "SENTINEL2"
-        print("Region of Interest (ROI):", self.roi.getInfo())
+        self.submitted_task_ids = []
+        self.failed_exports = []
+
+    def initialize(self):
+        """ Initialises Earth Engine and builds the ROI on first use, so constructing the class does no network I/O. """
+        if self.roi is None:
+            ee.Initialize()
+            self.roi = ee.Geometry.Rectangle(self.ROI_BOUNDS)
+            log(f"Region of Interest (ROI): {self.ROI_BOUNDS}", bounds = self.ROI_BOUNDS)
+        return self
         
     def create_subfolder(self, folder_list):
         for folder in folder_list:
@@ -20,7 +31,7 @@ class SentinelNDVI():
             path = os.path.join(f'ndvi/SENTINEL2/{folder}')
             if not os.path.exists(path):
                 os.makedirs(path)
-                print(f"{folder} created at {path}")
+                log(f"{folder} created at {path}", path = path)
 
     def calculate_ndvi(self, image):
         ndvi = image.normalizedDifference(['B8', 'B4']).rename('NDVI')
@@ -32,7 +43,10 @@ class SentinelNDVI():
         cloud_mask = scl.neq(9).And(scl.neq(10))  # Mask clouds and cirrus
         return image.updateMask(cloud_mask).copyProperties(image, ['system:time_start'])
 
-    def sentinel2(self, year):
+    def sentinel2(self, years):
+        self.initialize()
+        region = self.roi.coordinates().getInfo()  # fetched once for every year's export
+        worcs_fc = ee.FeatureCollection('users/hularuns/worcs_boundary_4326')
         for year in years:
             sentinel2 = (
                 ee.ImageCollection("COPERNICUS/S2_SR_HARMONIZED")
@@ -45,7 +59,6 @@ class SentinelNDVI():
 
             #process and clip
             median_ndvi = sentinel2.select('NDVI').median()
-            worcs_fc = ee.FeatureCollection('users/hularuns/worcs_boundary_4326')
             median_ndvi = median_ndvi.clip(worcs_fc)
             #clip out the nonsense
             # no_data_val = -9999
@@ -58,36 +71,28 @@ class SentinelNDVI():
                 folder = F'{self.folder_prefix}',
                 description=f"MedianNDVI_{year}_no_mask",
                 scale=10,  
-                region=self.roi.coordinates().getInfo(),
+                region=region,
                 fileFormat='GeoTIFF',
                 maxPixels=1e13
             )
-            task.start()
+            # a failed export is reported after the others are submitted, so every started one is still monitored
+            try:
+                self.submitted_task_ids.append(start_with_retry(task).id)
+            except Exception as e:
+                self.failed_exports.append((task.config.get('description', year), e))
+                log(f"Export for {year} failed to start: {e}", year = year, error = repr(e))
 
     def run_gee_task(self, years):
+        self.initialize()
         self.create_subfolder(years)
-        # self.sentinel2(years)
-        
-        while True:
-            tasks = ee.batch.Task.list()
-            ongoing_tasks = [task for task in tasks if task.status().get('state') in ['RUNNING', 'READY']]
-
-            if len(ongoing_tasks) == 0:
-                print("No ongoing tasks. Shit's probably finished.")
-                break
-
-            for task in ongoing_tasks:
-                status = task.status()
-                print(status)
-                print(f"Task ID: {status['id']}")
-                print(f"Description: {status['description']}")
-                print(f"State: {status['state']}")
-                print(f"Creation Time: {status['creation_timestamp_ms']} ms")
-                print(f"Update Time: {status['update_timestamp_ms']} ms")
-                print('-' * 60)
-                
+        self.sentinel2(years)
 
-            time.sleep(10)
+        # only this run's tasks are tracked, with one batched status call per poll
+        statuses = TaskMonitor(self.submitted_task_ids, ee_module = ee).wait()
+        if self.failed_exports:
+            raise RuntimeError(f"{len(self.failed_exports)} exports failed to start: "
+                               + ", ".join(str(description) for description, _ in self.failed_exports))
+        return statuses
 
 if __name__ == "__main__":
     
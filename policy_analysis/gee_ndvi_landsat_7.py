@@ -1,16 +1,32 @@
 import ee
-import time
 import os
+from concurrent.futures import ThreadPoolExecutor
+
+from policy_analysis.gee_tasks import TaskMonitor, start_with_retry
+from policy_analysis.instrument import log
 
 # Authenticate and initialize API
 # ee.Authenticate()
 
 class LandsatNDVI():
+    MIN_VALID_PIXELS = 500  # scenes with this many valid NDVI pixels in the ROI or fewer are not exported
+
+    ROI_BOUNDS = [-2.8524, 51.7836, -1.5161, 52.5075]
+
     def __init__(self):
-        ee.Initialize()
-        self.roi = ee.Geometry.Rectangle([-2.8524, 51.7836, -1.5161, 52.5075])
+        self.roi = None
         self.folder_prefix = "LANDSAT_7_"
-        print("Region of Interest (ROI):", self.roi.getInfo())
+        self.submitted_task_ids = []
+        self.failed_exports = []
+        self._roi_coordinates = None
+
+    def initialize(self):
+        """ Initialises Earth Engine and builds the ROI on first use, so constructing the class does no network I/O. """
+        if self.roi is None:
+            ee.Initialize()
+            self.roi = ee.Geometry.Rectangle(self.ROI_BOUNDS)
+            log(f"Region of Interest (ROI): {self.ROI_BOUNDS}", bounds = self.ROI_BOUNDS)
+        return self
         
     def create_subfolder(self, folder_list):
         for folder in folder_list:
@@ -18,7 +34,7 @@ class LandsatNDVI():
             path = os.path.join(f'ndvi/LANDSAT7/{folder}')
             if not os.path.exists(path):
                 os.makedirs(path)
-                print(f"{folder} created at {path}")
+                log(f"{folder} created at {path}", path = path)
 
     def calculate_ndvi(self, image):
         # NDVI using Landsat 7 bands
@@ -43,8 +59,9 @@ class LandsatNDVI():
         return image.updateMask(final_mask).copyProperties(image, ['system:time_start'])
 
     def landsat7_median_ndvi(self, years):
+        self.initialize()
         for year in years:
-            print(f"Processing year: {year}")
+            log(f"Processing year: {year}", year = year)
 
             # Filter the Landsat 7 collection for the year
             landsat = (
@@ -66,15 +83,48 @@ class LandsatNDVI():
                 folder=f'{self.folder_prefix}{year}',
                 description=f"MedianNDVI_Landsat7_{year}",
                 scale=30,  # 30m resolution for Landsat 7
-                region=self.roi.coordinates().getInfo(),
+                region=self.roi_coordinates(),
                 fileFormat='GeoTIFF',
                 maxPixels=1e13
             )
             task.start()
+            self.submitted_task_ids.append(task.id)
             
-    def landsat7_export_individual_ndvi(self, years):
+    def roi_coordinates(self):
+        """ ROI coordinates for export regions, fetched from the server once and reused. """
+        if self._roi_coordinates is None:
+            self.initialize()
+            self._roi_coordinates = self.roi.coordinates().getInfo()
+        return self._roi_coordinates
+
+    def screen_scenes(self, landsat, worcs_fc):
+        """
+        Counts the valid NDVI pixels of every scene in `landsat` server-side in one mapped reduction and pulls
+        (system:index, LANDSAT_PRODUCT_ID, count) for all scenes down with a single getInfo call.
+        """
+        def add_valid_pixel_count(image):
+            # Calculate the count of valid NDVI pixels within the ROI
+            counts = image.select('NDVI').clip(worcs_fc).reduceRegion(
+                reducer=ee.Reducer.count(),
+                geometry=self.roi,
+                scale=30,
+                maxPixels=1e13
+            )
+            return image.set('VALID_PIXEL_COUNT', ee.Dictionary(counts).get('NDVI', 0))
+
+        screened = landsat.map(add_valid_pixel_count)
+        return screened.reduceColumns(
+            ee.Reducer.toList(3), ['system:index', 'LANDSAT_PRODUCT_ID', 'VALID_PIXEL_COUNT']
+        ).get('list').getInfo()
+
+    def landsat7_export_individual_ndvi(self, years, export_workers = 8):
+        self.initialize()
+        worcs_fc = ee.FeatureCollection('users/hularuns/worcs_boundary_4326')
+        region = self.roi_coordinates()
+        exports = []
+
         for year in years:
-            print(f"Processing year: {year}")
+            log(f"Processing year: {year}", year = year)
 
             # Filter the Landsat 7 collection for the year
             landsat = (
@@ -85,66 +135,54 @@ class LandsatNDVI():
                 .map(self.calculate_ndvi)  # Add NDVI band
             )
 
-            # Loop through each image in the collection
-            landsat_list = landsat.toList(landsat.size())
-            for i in range(landsat.size().getInfo()):
-                image = ee.Image(landsat_list.get(i))
-                image_id = image.get('LANDSAT_PRODUCT_ID').getInfo() 
+            # The threshold is applied locally to counts computed server-side for the whole year at once
+            for index, image_id, valid_pixel_count in self.screen_scenes(landsat, worcs_fc):
+                if valid_pixel_count is None or valid_pixel_count <= self.MIN_VALID_PIXELS:
+                    log(f"Skipping {image_id} (no or low valid pixels in ROI).", image_id = image_id, valid_pixels = valid_pixel_count)
+                    continue
+
+                log(f"Exporting {image_id} with {valid_pixel_count} valid pixels.", image_id = image_id, valid_pixels = valid_pixel_count)
 
                 # Clip the image to the Worcestershire boundary
-                worcs_fc = ee.FeatureCollection('users/hularuns/worcs_boundary_4326')
+                image = ee.Image(landsat.filter(ee.Filter.eq('system:index', index)).first())
                 final_image = image.select('NDVI').clip(worcs_fc)
 
-                # Calculate the count of valid NDVI pixels within the ROI
-                valid_pixel_count = final_image.reduceRegion(
-                    reducer=ee.Reducer.count(),
-                    geometry=self.roi,
-                    scale=30,
-                    maxPixels=1e13
-                ).get('NDVI').getInfo()
-
-                MIN_VALID_PIXELS = 5000
-                if valid_pixel_count is None or valid_pixel_count <= 500:
-                    print(f"Skipping {image_id} (no or low valid pixels in ROI).")
-                    continue
-
-                print(f"Exporting {image_id} with {valid_pixel_count} valid pixels.")
-
-                task = ee.batch.Export.image.toDrive(
+                exports.append(ee.batch.Export.image.toDrive(
                     image=final_image,
                     folder=f'{self.folder_prefix}{year}',
                     description=f"NDVI_Landsat7_{image_id}",
                     scale=30,  # 30m resolution for Landsat 7
-                    region=self.roi.coordinates().getInfo(),
+                    region=region,
                     fileFormat='GeoTIFF',
                     maxPixels=1e13
-                )
-                task.start()
+                ))
+
+        # Exports are submitted concurrently, backing off and retrying when rate limited. Every export that started
+        # is tracked even if others fail, so none runs unmonitored; the failures are reported afterwards.
+        with ThreadPoolExecutor(max_workers = export_workers) as executor:
+            futures = [executor.submit(start_with_retry, task) for task in exports]
+            for task, future in zip(exports, futures):
+                try:
+                    self.submitted_task_ids.append(future.result().id)
+                except Exception as e:
+                    description = getattr(task, 'config', {}).get('description', task)
+                    self.failed_exports.append((description, e))
+                    log(f"Export {description} failed to start: {e}", export = str(description), error = repr(e))
+        log(f"Submitted {len(exports) - len(self.failed_exports)} of {len(exports)} exports.",
+            exports = len(exports), failed = len(self.failed_exports))
 
 
     def run_gee_task(self, years):
+        self.initialize()
         self.create_subfolder(years)
         self.landsat7_export_individual_ndvi(years)
         
-        while True:
-            tasks = ee.batch.Task.list()
-            ongoing_tasks = [task for task in tasks if task.status().get('state') in ['RUNNING', 'READY']]
-
-            if len(ongoing_tasks) == 0:
-                print("No ongoing tasks. Processing probably finished.")
-                break
-
-            for task in ongoing_tasks:
-                status = task.status()
-                print(status)
-                print(f"Task ID: {status['id']}")
-                print(f"Description: {status['description']}")
-                print(f"State: {status['state']}")
-                print(f"Creation Time: {status['creation_timestamp_ms']} ms")
-                print(f"Update Time: {status['update_timestamp_ms']} ms")
-                print('-' * 60)
-
-            time.sleep(10)
+        # only this run's tasks are tracked, with one batched status call per poll
+        statuses = TaskMonitor(self.submitted_task_ids, ee_module = ee).wait()
+        if self.failed_exports:
+            raise RuntimeError(f"{len(self.failed_exports)} exports failed to start: "
+                               + ", ".join(str(description) for description, _ in self.failed_exports))
+        return statuses
 
 if __name__ == "__main__":
     landsat = LandsatNDVI()
@@ -0,0 +1,165 @@
+import time
+
+from policy_analysis.instrument import log
+
+# UNKNOWN is what Earth Engine reports for a task it cannot find, which will never finish either
+TERMINAL_STATES = {"COMPLETED", "FAILED", "CANCELLED", "UNKNOWN"}
+OPERATION_STATES = {"PENDING": "READY", "RUNNING": "RUNNING", "CANCELLING": "CANCEL_REQUESTED",
+                    "SUCCEEDED": "COMPLETED", "CANCELLED": "CANCELLED", "FAILED": "FAILED"}
+RATE_LIMIT_MARKERS = ("429", "too many requests", "rate limit", "quota exceeded", "resource exhausted")
+
+
+def format_seconds(seconds):
+    seconds = int(seconds)
+    return f"{seconds // 3600:02d}:{seconds % 3600 // 60:02d}:{seconds % 60:02d}"
+
+
+def is_rate_limit_error(error):
+    message = str(error).lower()
+    return any(marker in message for marker in RATE_LIMIT_MARKERS)
+
+
+def start_with_retry(task, retries = 5, base_delay = 2, sleep = time.sleep):
+    """
+    Starts an export task, retrying with exponential backoff when Earth Engine rejects it for rate limiting.
+    Other errors, and the last rate-limit error, are raised. Returns the task.
+    """
+    for attempt in range(retries + 1):
+        try:
+            task.start()
+            return task
+        except Exception as e:
+            if attempt == retries or not is_rate_limit_error(e):
+                raise
+            delay = base_delay * 2 ** attempt
+            log(f"Rate limited starting {getattr(task, 'config', {}).get('description', task)}, retrying in {delay}s", delay = delay)
+            sleep(delay)
+
+
+def operation_status(operation):
+    """
+    The legacy task status dict (id, state, description, error_message) of an `ee.data.listOperations()` entry.
+    """
+    metadata = operation.get("metadata", {})
+    status = {"id": operation["name"].rsplit("/", 1)[-1], "name": operation["name"],
+              "state": OPERATION_STATES.get(metadata.get("state"), "UNKNOWN"), "description": metadata.get("description")}
+    if operation.get("done") and "error" in operation:
+        status["error_message"] = operation["error"].get("message")
+    return status
+
+
+class TaskMonitor():
+    """
+    Waits for the Earth Engine export tasks this run submitted, and only those.
+
+    Each poll fetches the state of every tracked task with one `ee.data.listOperations()` call, instead of one
+    request per task, and only tasks that have not yet finished are updated. A tracked task missing from
+    `missing_polls` listings in a row is marked UNKNOWN, which like COMPLETED, FAILED and CANCELLED is final.
+    The poll interval starts at `min_interval`, grows by `backoff` while nothing changes (up to `max_interval`)
+    and resets whenever a task changes state. Progress is printed as one compact line per poll.
+    `ee_module`, `sleep` and `clock` can be swapped for fakes in tests.
+    """
+    def __init__(self, task_ids, ee_module = None, min_interval = 5, max_interval = 120, backoff = 1.5,
+                 missing_polls = 3, sleep = time.sleep, clock = time.monotonic):
+        if ee_module is None:
+            import ee as ee_module
+        self.ee = ee_module
+        self.task_ids = list(task_ids)
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.backoff = backoff
+        self.missing_polls = missing_polls
+        self.sleep = sleep
+        self.clock = clock
+        self.statuses = {}
+        self.missing = {}
+
+    def pending(self):
+        return [task_id for task_id in self.task_ids if self.statuses.get(task_id, {}).get("state") not in TERMINAL_STATES]
+
+    def poll(self):
+        """
+        Fetches the current status of every unfinished tracked task in one listing. Returns True if any task changed state.
+        """
+        pending = set(self.pending())
+        if not pending:
+            return False
+        listed = {}
+        for operation in self.ee.data.listOperations():
+            status = operation_status(operation)
+            if status["id"] in pending:
+                listed[status["id"]] = status
+
+        changed = False
+        for task_id in pending:
+            status = listed.get(task_id)
+            if status is None:
+                self.missing[task_id] = self.missing.get(task_id, 0) + 1
+                if self.missing[task_id] < self.missing_polls:
+                    continue
+                status = {"id": task_id, "state": "UNKNOWN"}
+            else:
+                self.missing.pop(task_id, None)
+            previous = self.statuses.get(task_id)
+            if previous is None or previous.get("state") != status.get("state"):
+                changed = True
+            self.statuses[task_id] = status
+        return changed
+
+    def counts(self):
+        counts = {}
+        for status in self.statuses.values():
+            counts[status.get("state", "UNKNOWN")] = counts.get(status.get("state", "UNKNOWN"), 0) + 1
+        return counts
+
+    def progress_line(self, elapsed, interval):
+        counts = self.counts()
+        done = sum(counts.get(state, 0) for state in TERMINAL_STATES)
+        total = len(self.task_ids)
+        parts = [f"[{format_seconds(elapsed)}] {done}/{total} done"]
+        if counts.get("FAILED") or counts.get("CANCELLED") or counts.get("UNKNOWN"):
+            parts[0] += f" ({counts.get('FAILED', 0)} failed, {counts.get('CANCELLED', 0)} cancelled"
+            parts[0] += f", {counts['UNKNOWN']} not found)" if counts.get("UNKNOWN") else ")"
+        parts += [f"{count} {state.lower()}" for state, count in sorted(counts.items()) if state not in TERMINAL_STATES]
+        if 0 < done < total:
+            parts.append(f"ETA ~{format_seconds(elapsed / done * (total - done))}")
+        parts.append(f"next poll {interval:.0f}s")
+        return " | ".join(parts)
+
+    def finished(self):
+        return not self.pending()
+
+    def wait(self, timeout = None):
+        """
+        Polls until every tracked task is COMPLETED, FAILED, CANCELLED or UNKNOWN (or `timeout` seconds pass).
+        Returns a dict of task id -> final status, and prints the error of any task that failed or was not found.
+        """
+        if not self.task_ids:
+            log("No tasks were submitted, nothing to monitor.")
+            return {}
+
+        start = self.clock()
+        interval = self.min_interval
+        while True:
+            changed = self.poll()
+            elapsed = self.clock() - start
+            if self.finished():
+                break
+            if timeout is not None and elapsed >= timeout:
+                log(f"Stopped waiting after {format_seconds(elapsed)}, tasks are still running.", elapsed = elapsed)
+                break
+
+            interval = self.min_interval if changed else min(interval * self.backoff, self.max_interval)
+            log(self.progress_line(elapsed, interval), elapsed = elapsed, counts = self.counts())
+            self.sleep(interval)
+
+        counts = self.counts()
+        log(f"[{format_seconds(self.clock() - start)}] {counts.get('COMPLETED', 0)}/{len(self.task_ids)} tasks completed",
+            elapsed = self.clock() - start, counts = counts)
+        for status in self.statuses.values():
+            if status.get("state") == "FAILED":
+                log(f"{status.get('description') or status['id']} failed: {status.get('error_message')}",
+                    task_id = status["id"], error = status.get("error_message"))
+            elif status.get("state") == "UNKNOWN":
+                log(f"{status['id']} was not found by Earth Engine", task_id = status["id"])
+        return dict(self.statuses)
@@ -0,0 +1,229 @@
+import contextlib
+import cProfile
+import json
+import os
+import sys
+import threading
+import time
+import uuid
+
+try:
+    import resource  # Unix
+except ImportError:
+    resource = None
+
+# Settings are passed through the environment so worker processes (including spawned ones on Windows) pick them up.
+METRICS_ENV = "POLICY_ANALYSIS_METRICS"
+QUIET_ENV = "POLICY_ANALYSIS_QUIET"
+PROFILE_ENV = "POLICY_ANALYSIS_PROFILE"
+PROFILE_DIR_ENV = "POLICY_ANALYSIS_PROFILE_DIR"
+RUN_ENV = "POLICY_ANALYSIS_RUN"
+
+
+def peak_rss_mb():
+    """
+    Peak resident set size of this process so far in MiB, or None where it cannot be measured.
+    """
+    if resource is not None:
+        max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return max_rss / 1024 ** 2 if sys.platform == "darwin" else max_rss / 1024  # bytes on macOS, KiB elsewhere
+    try:
+        import psutil
+    except ImportError:
+        return None
+    memory = psutil.Process().memory_info()
+    return getattr(memory, "peak_wset", memory.rss) / 1024 ** 2
+
+
+class Stage():
+    """
+    Counters for one timed stage. Call `read`/`wrote` with the arrays a stage reads and writes, or `add` for anything else.
+    """
+    def __init__(self, name, fields):
+        self.name = name
+        self.fields = fields
+        self.pixels = 0
+        self.bytes_read = 0
+        self.bytes_written = 0
+        self._lock = threading.Lock()
+
+    def read(self, array):
+        with self._lock:
+            self.bytes_read += array.nbytes
+
+    def wrote(self, array):
+        with self._lock:
+            self.bytes_written += array.nbytes
+            self.pixels += array.size
+
+    def add(self, pixels = 0, bytes_read = 0, bytes_written = 0):
+        with self._lock:
+            self.pixels += pixels
+            self.bytes_read += bytes_read
+            self.bytes_written += bytes_written
+
+
+class Recorder():
+    """
+    Collects structured progress and per-stage metrics: wall time, bytes read/written (decoded array bytes),
+    pixels processed, the process peak RSS so far (`peak_rss_mb`) and how much the stage raised it (`rss_growth_mb`).
+
+    Every record is kept in memory for `summary`/`report` and, if `metrics_path` is set, appended to it as a JSON line,
+    stamped with `run_id` so the records of one run can be told apart from earlier runs appending to the same file.
+    Messages from `log` are printed unless `quiet`. If `profile_stage` names a stage, each run of that stage is
+    profiled with cProfile and the stats saved to `profile_dir`.
+    """
+    def __init__(self, metrics_path = None, quiet = False, profile_stage = None, profile_dir = ".", run_id = None):
+        self.metrics_path = metrics_path
+        self.run_id = run_id
+        self.quiet = quiet
+        self.profile_stage = profile_stage
+        self.profile_dir = profile_dir
+        self.records = []
+        self._lock = threading.Lock()
+        self._profiling = False
+
+    @classmethod
+    def from_environment(cls):
+        return cls(metrics_path = os.environ.get(METRICS_ENV) or None, quiet = os.environ.get(QUIET_ENV) == "1",
+                   profile_stage = os.environ.get(PROFILE_ENV) or None, profile_dir = os.environ.get(PROFILE_DIR_ENV, "."),
+                   run_id = os.environ.get(RUN_ENV) or None)
+
+    @classmethod
+    def load(cls, metrics_path, run_id = None):
+        """
+        A quiet Recorder holding the records of a JSON-lines metrics file, e.g. to `report` on a run whose stages
+        ran in worker processes (their records only reach the file, not the parent's memory).
+        With `run_id` only that run's records are kept.
+        """
+        loaded = cls(quiet = True, run_id = run_id)
+        with open(metrics_path) as f:
+            records = (json.loads(line) for line in f if line.strip())
+            loaded.records = [record for record in records if run_id is None or record.get("run") == run_id]
+        return loaded
+
+    def emit(self, record):
+        record = {"time": round(time.time(), 3), "pid": os.getpid(), **({"run": self.run_id} if self.run_id else {}),
+                  **record}
+        with self._lock:
+            self.records.append(record)
+            if self.metrics_path:
+                with open(self.metrics_path, "a") as f:
+                    f.write(json.dumps(record, default = str) + "\n")
+        return record
+
+    def log(self, message, **fields):
+        """
+        A progress message: printed unless quiet, and recorded with its fields.
+        """
+        if not self.quiet:
+            print(message)
+        return self.emit({"event": "log", "message": message, **fields})
+
+    @contextlib.contextmanager
+    def stage(self, name, **fields):
+        """
+        Times the enclosed block as stage `name` and records it with `fields` (e.g. year, output path) and the
+        counters gathered on the yielded Stage. The record is written even if the block raises.
+        """
+        stage = Stage(name, fields)
+        profiler = None
+        if name == self.profile_stage and not self._profiling:
+            profiler = cProfile.Profile()
+            self._profiling = True
+            profiler.enable()
+        rss_before = peak_rss_mb()
+        start = time.perf_counter()
+        error = None
+        try:
+            yield stage
+        except BaseException as e:
+            error = repr(e)
+            raise
+        finally:
+            seconds = time.perf_counter() - start
+            if profiler is not None:
+                profiler.disable()
+                self._profiling = False
+                os.makedirs(self.profile_dir, exist_ok = True)
+                profile_path = os.path.join(self.profile_dir, f"{name}_{os.getpid()}_{int(time.time() * 1000)}.prof")
+                profiler.dump_stats(profile_path)
+                fields = {**fields, "profile": profile_path}
+            # the process peak only ever rises, so a stage after a heavy one would report the heavy one's peak;
+            # the growth during the stage is what this stage itself needed
+            peak = peak_rss_mb()
+            self.emit({"event": "stage", "stage": name, "seconds": round(seconds, 4), "pixels": stage.pixels,
+                       "bytes_read": stage.bytes_read, "bytes_written": stage.bytes_written,
+                       "peak_rss_mb": None if peak is None else round(peak, 1),
+                       "rss_growth_mb": None if peak is None else round(peak - rss_before, 1), "error": error, **fields})
+
+    def summary(self):
+        """
+        Per-stage totals over the recorded stages: runs, seconds, pixels, bytes, the highest process peak RSS and
+        the largest RSS growth during a run of the stage.
+        """
+        totals = {}
+        for record in self.records:
+            if record["event"] != "stage":
+                continue
+            total = totals.setdefault(record["stage"], {"stage": record["stage"], "runs": 0, "errors": 0, "seconds": 0.0,
+                                                        "pixels": 0, "bytes_read": 0, "bytes_written": 0, "peak_rss_mb": None,
+                                                        "rss_growth_mb": None})
+            total["runs"] += 1
+            total["errors"] += record["error"] is not None
+            for counter in ("seconds", "pixels", "bytes_read", "bytes_written"):
+                total[counter] += record[counter]
+            for memory in ("peak_rss_mb", "rss_growth_mb"):
+                if record.get(memory) is not None:
+                    total[memory] = max(total[memory] or 0, record[memory])
+        return list(totals.values())
+
+    def report(self):
+        """
+        Prints the per-stage summary as a table (even when quiet) and returns it.
+        Only this process's records are included; see `load` for runs with worker processes.
+        """
+        summary = self.summary()
+        print(f"{'stage':<22}{'runs':>6}{'seconds':>10}{'Mpixels':>10}{'MB read':>10}{'MB written':>12}{'peak RSS MB':>13}"
+              f"{'RSS growth MB':>15}")
+        for total in summary:
+            peak, growth = ("-" if total[memory] is None else f"{total[memory]:.0f}" for memory in ("peak_rss_mb", "rss_growth_mb"))
+            print(f"{total['stage']:<22}{total['runs']:>6}{total['seconds']:>10.2f}{total['pixels'] / 1e6:>10.1f}"
+                  f"{total['bytes_read'] / 1024 ** 2:>10.1f}{total['bytes_written'] / 1024 ** 2:>12.1f}{peak:>13}{growth:>15}")
+        return summary
+
+
+_recorder = None
+
+
+def recorder():
+    """
+    The process-wide Recorder, created from the environment on first use.
+    """
+    global _recorder
+    if _recorder is None:
+        _recorder = Recorder.from_environment()
+    return _recorder
+
+
+def configure(metrics_path = None, quiet = False, profile_stage = None, profile_dir = "."):
+    """
+    Sets up the process-wide Recorder. The settings are also exported to the environment so worker processes
+    started afterwards record to the same JSON-lines file with the same quiet/profiling behaviour and run id.
+    """
+    global _recorder
+    os.environ[METRICS_ENV] = os.path.abspath(metrics_path) if metrics_path else ""
+    os.environ[QUIET_ENV] = "1" if quiet else "0"
+    os.environ[PROFILE_ENV] = profile_stage or ""
+    os.environ[PROFILE_DIR_ENV] = profile_dir
+    os.environ[RUN_ENV] = uuid.uuid4().hex
+    _recorder = Recorder.from_environment()
+    return _recorder
+
+
+def log(message, **fields):
+    return recorder().log(message, **fields)
+
+
+def stage(name, **fields):
+    return recorder().stage(name, **fields)
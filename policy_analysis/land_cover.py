@@ -0,0 +1,138 @@
+import numpy as np
+import pandas as pd
+import rasterio
+
+from policy_analysis.instrument import log, stage
+from policy_analysis.utils import iter_row_strips, year_from_path
+from policy_analysis.zonal_stats import zone_index_for
+
+# UKCEH Land Cover Map classes (LCM2015 onwards, 21-class raster product)
+LCM_CLASSES = {
+    1: "Deciduous woodland",
+    2: "Coniferous woodland",
+    3: "Arable",
+    4: "Improved grassland",
+    5: "Neutral grassland",
+    6: "Calcareous grassland",
+    7: "Acid grassland",
+    8: "Fen, marsh and swamp",
+    9: "Heather",
+    10: "Heather grassland",
+    11: "Bog",
+    12: "Inland rock",
+    13: "Saltwater",
+    14: "Freshwater",
+    15: "Supralittoral rock",
+    16: "Supralittoral sediment",
+    17: "Littoral rock",
+    18: "Littoral sediment",
+    19: "Saltmarsh",
+    20: "Urban",
+    21: "Suburban",
+}
+
+VALUE_CATEGORIES = ["very high", "high", "moderate", "low"]
+
+# Default biodiversity value of each LCM class, loosely following habitat distinctiveness. Pass your own mapping
+# to the functions below to use a different scheme; classes missing from a mapping are reported as "unassigned".
+LCM_VALUE_CATEGORIES = {
+    8: "very high", 11: "very high", 19: "very high",
+    1: "high", 6: "high", 7: "high", 9: "high", 10: "high",
+    2: "moderate", 5: "moderate", 12: "moderate", 13: "moderate", 14: "moderate",
+    15: "moderate", 16: "moderate", 17: "moderate", 18: "moderate",
+    3: "low", 4: "low", 20: "low", 21: "low",
+}
+
+
+def zone_class_counts(src, index, block_rows = 1024, timing = None):
+    """
+    Pixel counts of every (zone, class) pair of band 1 of the open categorical raster `src` over a ZoneIndex.
+
+    The zones' rows are read in full-width strips of `block_rows` rows. Each indexed pixel contributes one count
+    at `zone * n_classes + class`, so a strip is a single np.bincount however many zones and classes there are;
+    pixels shared by overlapping zones count in each. NoData and negative values are skipped.
+    Returns a (n_zones, n_classes) int64 array, n_classes being the largest class value seen + 1.
+    """
+    width = src.width
+    counts = np.zeros((index.n_zones, 0), dtype = np.int64)
+    bounds = index.bounding_window()
+    for window in iter_row_strips(width, int(bounds.height), block_rows):
+        window = rasterio.windows.Window(0, window.row_off + bounds.row_off, width, window.height)
+        entries = index.rows_slice(window)
+        if entries.start == entries.stop:
+            continue
+        block = src.read(1, window = window)
+        values = block.ravel()[index.pixel_index[entries] - int(window.row_off) * width].astype(np.int64)
+        zones = index.zone_ids[entries]
+        valid = values >= 0
+        if src.nodata is not None:
+            valid &= values != src.nodata
+        values, zones = values[valid], zones[valid]
+        if timing is not None:
+            timing.read(block)
+            timing.add(pixels = len(values))
+        if len(values) == 0:
+            continue
+
+        n_classes = max(counts.shape[1], int(values.max()) + 1)
+        if n_classes > counts.shape[1]:
+            counts = np.pad(counts, ((0, 0), (0, n_classes - counts.shape[1])))
+        counts += np.bincount(zones * n_classes + values, minlength = index.n_zones * n_classes).reshape(index.n_zones, n_classes)
+    return counts
+
+
+def class_crosstab(raster_paths, zones, id_column = "project_name", class_names = LCM_CLASSES,
+                   value_categories = LCM_VALUE_CATEGORIES, all_touched = False, block_rows = 1024):
+    """
+    Zone x class x year land-cover table for a series of categorical rasters (e.g. yearly LCM GeoTIFFs, band 1).
+
+    `zones` is a ZoneLayer (e.g. the BDAs in interest_areas/bda.gpkg) or a GeoDataFrame, indexed once per distinct
+    raster grid; the year of each raster comes from its file name. Returns a tidy DataFrame with one row per zone,
+    year and class present: `id_column`, year, class_value, class_name, value_category, pixels, area_ha and
+    fraction (of the zone's classified pixels). Areas assume a grid in metres, e.g. EPSG:27700.
+    """
+    indexes = {}
+    frames = []
+    for path in raster_paths:
+        year = year_from_path(path)
+        with stage("land_cover", raster = path, year = year) as timing, rasterio.open(path) as src:
+            grid = (tuple(src.transform), src.shape, src.crs.to_wkt() if src.crs else None)
+            if grid not in indexes:
+                indexes[grid] = zone_index_for(zones, src, id_column = id_column, all_touched = all_touched)
+            index = indexes[grid]
+            counts = zone_class_counts(src, index, block_rows = block_rows, timing = timing)
+            hectares_per_pixel = abs(src.transform.a * src.transform.e) / 10000
+
+        zone_ids, class_values = np.nonzero(counts)
+        pixels = counts[zone_ids, class_values]
+        totals = counts.sum(axis = 1)
+        names = np.asarray(index.names if index.names is not None else np.arange(index.n_zones), dtype = object)
+        frames.append(pd.DataFrame({
+            id_column: names[zone_ids],
+            "year": year,
+            "class_value": class_values,
+            "class_name": [class_names.get(value, f"class {value}") for value in class_values],
+            "value_category": [value_categories.get(value, "unassigned") for value in class_values],
+            "pixels": pixels,
+            "area_ha": pixels * hectares_per_pixel,
+            "fraction": pixels / totals[zone_ids],
+        }))
+        log(f"Cross-tabulated {len(class_values)} zone/class pairs for {year} from {path}", year = year)
+
+    columns = [id_column, "year", "class_value", "class_name", "value_category", "pixels", "area_ha", "fraction"]
+    if not frames:
+        return pd.DataFrame(columns = columns)
+    return pd.concat(frames, ignore_index = True)[columns]
+
+
+def value_category_table(crosstab, id_column = "project_name", categories = VALUE_CATEGORIES):
+    """
+    Collapses a `class_crosstab` table to pixel/area/fraction per zone, year and value category, in `categories` order
+    (other categories, e.g. "unassigned", follow). Missing combinations are filled with zero.
+    """
+    totals = crosstab.groupby([id_column, "year", "value_category"])[["pixels", "area_ha", "fraction"]].sum()
+    order = list(categories) + sorted(set(crosstab["value_category"]) - set(categories))
+    keys = crosstab[[id_column, "year"]].drop_duplicates().itertuples(index = False)
+    full = pd.MultiIndex.from_tuples([(zone, year, category) for zone, year in keys for category in order],
+                                     names = [id_column, "year", "value_category"])
+    return totals.reindex(full, fill_value = 0).reset_index()
@@ -0,0 +1,175 @@
+import os
+import re
+import threading
+import warnings
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import rasterio
+from rasterio.enums import Resampling
+from rasterio.vrt import WarpedVRT
+
+from policy_analysis import ndvi_codec
+from policy_analysis.cog import staging_path, tiled_profile, to_cog
+from policy_analysis.instrument import log, stage
+from policy_analysis.utils import iter_windows, year_from_path
+
+# Band names as in the GEE collections used by SentinelNDVI / LandsatNDVI
+SENSORS = {
+    "sentinel2": {"nir": "B8", "red": "B4", "qa": "SCL"},
+    "landsat7": {"nir": "B4", "red": "B3", "qa": "QA_PIXEL"},
+}
+SENTINEL_CLOUD_CLASSES = (9, 10)  # SCL cloud high probability, thin cirrus
+LANDSAT_CLOUD_BIT = 1 << 3
+LANDSAT_SHADOW_BIT = 1 << 4
+BAND_FILE = re.compile(r"^(?P<scene>.+)_(?P<band>B\d+A?|SCL|QA_PIXEL)\.tif$", re.IGNORECASE)
+
+
+def normalized_difference(a, b, valid):
+    """
+    (a - b) / (a + b) as float32, like ee.Image.normalizedDifference. Pixels outside `valid`,
+    or with a zero denominator, are NaN.
+    """
+    a = a.astype(np.float32)
+    b = b.astype(np.float32)
+    total = a + b
+    with np.errstate(invalid = "ignore", divide = "ignore"):
+        ndvi = (a - b) / total
+    ndvi[~valid | (total == 0)] = np.nan
+    return ndvi
+
+
+def sentinel_cloud_mask(scl):
+    """ SentinelNDVI.mask_clouds: keep pixels whose SCL class is neither cloud (9) nor cirrus (10). """
+    return ~np.isin(scl, SENTINEL_CLOUD_CLASSES)
+
+
+def landsat_cloud_mask(qa):
+    """ LandsatNDVI.mask_clouds_and_gaps: keep pixels with QA_PIXEL bit 3 (cloud) and bit 4 (shadow) clear. """
+    return ((qa & LANDSAT_CLOUD_BIT) == 0) & ((qa & LANDSAT_SHADOW_BIT) == 0)
+
+
+def find_scenes(directory, sensor):
+    """
+    Groups the band GeoTIFFs under `directory` into scenes, e.g. LE07_..._B4.TIF + _B3.TIF + _QA_PIXEL.TIF.
+    Returns a dict of scene id -> {band: path}, keeping only scenes that have every band `sensor` needs.
+    """
+    needed = set(SENSORS[sensor].values())
+    scenes = {}
+    for subdir, dirs, files in os.walk(directory):
+        for file in files:
+            match = BAND_FILE.match(file)
+            if match and match.group("band").upper() in needed:
+                scenes.setdefault(match.group("scene"), {})[match.group("band").upper()] = os.path.join(subdir, file)
+    return {scene: bands for scene, bands in sorted(scenes.items()) if set(bands) == needed}
+
+
+def scene_ndvi(readers, window, sensor):
+    """
+    Cloud-masked NDVI of one scene over `window`. `readers` maps band name -> dataset on the output grid.
+    NIR/red NoData (0 when untagged, which also covers the Landsat 7 SLC-off gaps) is masked like GEE's band mask.
+    """
+    bands = SENSORS[sensor]
+    nir = readers[bands["nir"]].read(1, window = window, masked = True)
+    red = readers[bands["red"]].read(1, window = window, masked = True)
+    qa = readers[bands["qa"]].read(1, window = window)
+    valid = ~np.ma.getmaskarray(nir) & ~np.ma.getmaskarray(red)
+    valid &= sentinel_cloud_mask(qa) if sensor == "sentinel2" else landsat_cloud_mask(qa)
+    return normalized_difference(nir.data, red.data, valid)
+
+
+def composite_year(scenes, output_path, sensor, grid = None, block_size = 512, workers = 1, compact = False, cog = False):
+    """
+    Median NDVI composite of `scenes` (from `find_scenes`) written to `output_path`, mirroring
+    `.map(mask).map(calculate_ndvi).select('NDVI').median()` in GEE, without any network access.
+
+    Every band is warped on the fly (nearest neighbour) onto `grid` = (crs, transform, width, height), by default
+    the first scene's NIR grid, so scenes from different paths/tiles and 20 m SCL bands line up. The output is
+    processed in `block_size` windows spread over `workers` threads; memory is scenes x bands x block_size^2.
+    With `compact` the composite is written as scaled int16 (see `ndvi_codec`), with `cog` as a Cloud-Optimized GeoTIFF.
+    Returns False (and writes nothing) if no scene has a valid pixel.
+    """
+    if grid is None:
+        with rasterio.open(next(iter(scenes.values()))[SENSORS[sensor]["nir"]]) as src:
+            grid = (src.crs, src.transform, src.width, src.height)
+    crs, transform, width, height = grid
+    local = threading.local()
+    handles = []
+
+    def readers():
+        # datasets are not thread-safe, so each worker thread warps through its own handles
+        if not hasattr(local, "readers"):
+            local.readers = []
+            for bands in scenes.values():
+                scene_readers = {}
+                for band, path in bands.items():
+                    src = rasterio.open(path)
+                    nodata = src.nodata if src.nodata is not None else 0
+                    vrt = WarpedVRT(src, crs = crs, transform = transform, width = width, height = height,
+                                    resampling = Resampling.nearest, src_nodata = nodata, nodata = nodata)
+                    handles.extend([vrt, src])
+                    scene_readers[band] = vrt
+                local.readers.append(scene_readers)
+        return local.readers
+
+    def composite_block(window):
+        stack = np.stack([scene_ndvi(scene_readers, window, sensor) for scene_readers in readers()], axis = 0)
+        timing.read(stack)
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore", RuntimeWarning)  # all-NaN slices
+            return window, np.nanmedian(stack, axis = 0).astype(np.float32)
+
+    profile = {"driver": "GTiff", "count": 1, "dtype": "float32", "nodata": np.nan, "crs": crs,
+               "transform": transform, "width": width, "height": height}
+    if compact:
+        profile = ndvi_codec.compact_profile(profile)
+    profile = tiled_profile(profile, block_size)
+    with stage("local_composite", output = output_path, scenes = len(scenes)) as timing:
+        has_data = False
+        with rasterio.open(staging_path(output_path, cog), "w", **profile) as dst:
+            if compact:
+                ndvi_codec.set_scaling(dst)
+            with ThreadPoolExecutor(max_workers = workers) as executor:
+                for window, block in executor.map(composite_block, iter_windows(width, height, block_size)):
+                    has_data |= not np.all(np.isnan(block))
+                    timing.wrote(block)
+                    dst.write(ndvi_codec.encode(block) if compact else block, 1, window = window)
+    for handle in handles:
+        handle.close()
+
+    if not has_data:
+        os.remove(staging_path(output_path, cog))
+        log(f"No valid pixels in the {len(scenes)} scenes for {output_path}", output = output_path)
+        return False
+    if cog:
+        to_cog(staging_path(output_path, cog), output_path, block_size)
+    log(f"Composited {len(scenes)} scenes into {output_path}", output = output_path)
+    return True
+
+
+def composite_years(directory, output_dir, sensor, grid = None, block_size = 512, workers = os.cpu_count(),
+                    compact = False, cog = False):
+    """
+    Builds a median NDVI composite per year from band GeoTIFFs on disk. Each subdirectory of `directory` whose name
+    holds a year (e.g. LANDSAT_7_2005) is one year. Writes `<output_dir>/median_ndvi_<year>.tif`.
+    Returns a dict of year -> output path for the years that had valid pixels.
+    """
+    os.makedirs(output_dir, exist_ok = True)
+    outputs = {}
+    for name in sorted(os.listdir(directory)):
+        year_dir = os.path.join(directory, name)
+        if not os.path.isdir(year_dir):
+            continue
+        try:
+            year = year_from_path(name)
+        except ValueError:
+            continue
+        scenes = find_scenes(year_dir, sensor)
+        if not scenes:
+            log(f"No complete {sensor} scenes found in {year_dir}.", year = year)
+            continue
+        output_path = os.path.join(output_dir, f"median_ndvi_{year}.tif")
+        if composite_year(scenes, output_path, sensor, grid = grid, block_size = block_size, workers = workers,
+                          compact = compact, cog = cog):
+            outputs[year] = output_path
+    return outputs
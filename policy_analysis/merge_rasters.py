@@ -1,14 +1,59 @@
 import rasterio
 import numpy as np
 import os
-from scipy.interpolate import interp1d
-import subprocess
+import warnings
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from policy_analysis import ndvi_codec
+from policy_analysis.cog import staging_path, tiled_profile, to_cog
+from policy_analysis.fill_nodata import fill_nodata
+from policy_analysis.instrument import log, stage
+from policy_analysis.utils import iter_windows
 
 # Define directories
 
+def composite_profile(profile, compact = False, block_size = 512):
+    """
+    The output profile of a median composite of rasters with `profile`: float32 with NaN NoData, or scaled int16
+    with `compact`, tiled in `block_size` tiles.
+    """
+    profile = dict(profile)
+    profile.update(dtype=np.float32, count=1, nodata=np.nan)
+    if compact:
+        profile = ndvi_codec.compact_profile(profile)
+    return tiled_profile(profile, block_size)
+
+
+def median_window(sources, window, compact = False):
+    """
+    Per-pixel median of the open rasters `sources` over `window`, NaN (or the int16 NoData with `compact`) where
+    every input is NoData. Returns the median block, its valid mask and the stacked inputs.
+    """
+    if compact:
+        stack = np.stack([ndvi_codec.read_compact(src, window) for src in sources], axis=0)
+        median_block = ndvi_codec.median_int16(stack)
+        return median_block, median_block != ndvi_codec.NODATA, stack
+    stack = np.stack([ndvi_codec.read_ndvi(src, window) for src in sources], axis=0)
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", RuntimeWarning)  # all-NaN slices
+        median_block = np.nanmedian(stack, axis=0)
+    return median_block, ~np.isnan(median_block), stack
+
+
 class MergeMedianRasters():
-    def __init__(self, directory):
+    """
+    Median composites (and NoData fills) of the yearly LANDSAT_<year> scene folders under `directory`.
+    With `compact`, composites and fills are stored as scaled int16 (see `ndvi_codec`) and the median is taken on
+    the integers, which halves the output size and keeps the working set at 2 bytes per pixel per scene.
+    Outputs are tiled in `block_size` tiles; with `cog` they are Cloud-Optimized GeoTIFFs with overviews.
+    """
+    def __init__(self, directory, block_size = 512, fill_tile_size = 1024, fill_workers = 1, compact = False, cog = False):
         self.directory = directory
+        self.block_size = block_size
+        self.compact = compact
+        self.cog = cog
+        self.fill_tile_size = fill_tile_size
+        self.fill_workers = fill_workers
         self.output_dir = os.path.join(directory, "merged_outputs") 
         self.filled_dir = os.path.join(self.output_dir, "filled")
 
@@ -23,85 +68,136 @@ class MergeMedianRasters():
         raster_files = [f for f in os.listdir(subdir) if f.endswith(".tif")]
         return len(raster_files) > 0
     
-    def merge_median_rasters(self):
-        
+    def year_jobs(self):
+        """
+        Walks `self.directory` for LANDSAT_<year> subdirectories.
+        Returns a list of (year, raster_files) tuples, one per year with at least one .tif.
+        """
+        jobs = []
         for subdir, dirs, files in os.walk(self.directory):
+            # outputs (ours and reprojected scenes) live inside the tree, don't treat them as more years
+            dirs[:] = [d for d in dirs if d not in ("merged_outputs", "reprojected")]
             # if self.valid_subdirectory(subdir):
-            if "LANDSAT" in subdir:
+            if "LANDSAT" in os.path.split(subdir)[1]:
                 raster_files = [
                     os.path.join(subdir, file) 
                     for file in os.listdir(subdir) if file.endswith(".tif")
                 ]
                 
                 if len(raster_files) < 1:
-                    print(f"No raster files found in {subdir}.")
-                    continue
-                print(f"There are {len(raster_files)} being processed")
-                stack = []
-
-                # Read and stack rasters
-                for file in raster_files:
-                    with rasterio.open(file) as src:
-                        data = src.read(1)
-                        nodata = src.nodata
-                        if nodata is not None:
-                            data[data == nodata] = np.nan
-                        stack.append(data)
-
-                stack = np.stack(stack, axis=0)
-                print("Stack shape:", stack.shape)
-
-                if np.all(np.isnan(stack)):
-                    print("All input rasters contain only NoData values.")
+                    log(f"No raster files found in {subdir}.", directory = subdir)
                     continue
-                median_array = np.nanmedian(stack, axis=0)
-                print("Median array stats: Min =", np.nanmin(median_array), "Max =", np.nanmax(median_array))
 
                 subname = os.path.split(subdir)[1]
-                if 'LANDSAT' in subname:
-                    year = (subname.split("_")[-1])
-                
-                # Save median raster
-                median_raster = os.path.join(self.output_dir, f"median_raster_{year}.tif")
-                print(f"Median raster save location: {median_raster}")
-                
-                with rasterio.open(raster_files[0]) as src:
-                    profile = src.profile
-                    profile.update(dtype=np.float32, count=1, nodata=np.nan)
+                year = (subname.split("_")[-1])
+                jobs.append((year, raster_files))
+        return jobs
 
-                with rasterio.open(median_raster, "w", **profile) as dst:
-                    dst.write(np.nan_to_num(median_array, nan=profile['nodata']).astype(np.float32), 1)
-                
-                interpolated_output = os.path.join(self.filled_dir, f"ndvi_filled_{year}.tif")
-                self.fill_nodata_with_gdal(median_raster, interpolated_output, max_distance = 50)
-        
+    def merge_median_rasters(self, workers = 1):
+        """
+        Composites and fills every year directory. With `workers` > 1 the years are spread across a process pool.
+        A failing year is reported in the closing summary rather than stopping the batch.
+        Returns a dict of year -> status ("filled", "empty" or the error message).
+        """
+        jobs = self.year_jobs()
+        summary = {}
 
-    def fill_nodata_with_gdal(self, input_raster, output_file_path, max_distance = 50):
+        if workers > 1:
+            with ProcessPoolExecutor(max_workers = workers) as executor:
+                futures = {executor.submit(self.process_year, year, raster_files): year for year, raster_files in jobs}
+                for future in as_completed(futures):
+                    year = futures[future]
+                    try:
+                        summary[year] = future.result()
+                    except Exception as e:
+                        summary[year] = f"failed: {e!r}"
+        else:
+            for year, raster_files in jobs:
+                try:
+                    summary[year] = self.process_year(year, raster_files)
+                except Exception as e:
+                    summary[year] = f"failed: {e!r}"
+
+        log(f"Processed {len(summary)} years {'-'*40}")
+        for year in sorted(summary):
+            log(f"{year}: {summary[year]}", year = year, status = summary[year])
+        return summary
+
+    def process_year(self, year, raster_files):
+        """
+        Builds the median composite for one year and fills its NoData gaps.
+        """
+        # Save median raster
+        median_raster = os.path.join(self.output_dir, f"median_raster_{year}.tif")
+        with stage("year", year = year, scenes = len(raster_files)):
+            if not self.median_composite(raster_files, median_raster):
+                log("All input rasters contain only NoData values.", year = year)
+                return "empty"
+
+            interpolated_output = os.path.join(self.filled_dir, f"ndvi_filled_{year}.tif")
+            if not self.fill_nodata_with_gdal(median_raster, interpolated_output, max_distance = 50):
+                return "composited, fill failed"
+            return "filled"
+
+    def median_composite(self, raster_files, median_raster):
         """
-        Uses gdal_fillnodata.py to interpolate missing values in a raster.
+        Streams the per-pixel nanmedian of `raster_files` into `median_raster` one block window at a time,
+        so peak memory is scenes x block_size^2 rather than scenes x full raster.
+        Returns False (and removes the output) if every input pixel is NoData.
         """
+        with stage("composite", output = median_raster, scenes = len(raster_files)) as timing:
+            sources = [rasterio.open(file) for file in raster_files]
+            try:
+                shapes = {src.shape for src in sources}
+                if len(shapes) > 1:
+                    raise ValueError(f"Input rasters are not aligned, found shapes {shapes}")
+
+                profile = composite_profile(sources[0].profile, self.compact, self.block_size)
+                min_value, max_value = np.inf, -np.inf
+
+                with rasterio.open(staging_path(median_raster, self.cog), "w", **profile) as dst:
+                    if self.compact:
+                        ndvi_codec.set_scaling(dst)
+                    for window in iter_windows(dst.width, dst.height, self.block_size):
+                        median_block, valid, stack = median_window(sources, window, self.compact)
+                        timing.read(stack)
+                        timing.wrote(median_block)
+
+                        if valid.any():
+                            min_value = min(min_value, median_block[valid].min())
+                            max_value = max(max_value, median_block[valid].max())
+                        dst.write(median_block.astype(profile['dtype']), 1, window=window)
+            finally:
+                for src in sources:
+                    src.close()
 
-        cmd = [
-            r"C:\OSGeo4W\apps\Python312\python.exe",  # Path to Python interpreter
-            r"C:\OSGeo4W\apps\Python312\Scripts\gdal_fillnodata.py",  # Path to fillnodata py file
-            input_raster,          # Input raster file
-            output_file_path,         # Output raster file
-            "-md", str(max_distance),  # Maximum search distance for interpolation
-            "-b", "1",             # Band number to process
-            "-of", "GTiff"         # Output format
-        ]
+            if min_value > max_value:
+                os.remove(staging_path(median_raster, self.cog))
+                return False
+            if self.cog:
+                to_cog(staging_path(median_raster, self.cog), median_raster, self.block_size)
+            if self.compact:
+                min_value, max_value = ndvi_codec.decode([min_value, max_value])
+            log(f"Median array stats: Min = {min_value} Max = {max_value}", output = median_raster,
+                min = float(min_value), max = float(max_value))
+        return True
 
+    def fill_nodata_with_gdal(self, input_raster, output_file_path, max_distance = 50):
+        """
+        Interpolates missing values in a raster with GDAL's fill algorithm, in-process and tile by tile.
+        See `policy_analysis.fill_nodata.fill_nodata`. Returns True if the fill succeeded, otherwise False.
+        """
         try:
-            subprocess.run(cmd, check=True, shell=True) 
-            print(f"Filled NoData gaps in {input_raster}, output saved to {output_file_path}")
-        except FileNotFoundError:
-            print("Error: gdal_fillnodata.bat not found. Ensure the file exists and is in the specified path.")
-        except subprocess.CalledProcessError as e:
-            print(f"Error while running gdal_fillnodata: {e}")
+            return fill_nodata(input_raster, output_file_path, max_distance = max_distance,
+                               tile_size = self.fill_tile_size, workers = self.fill_workers,
+                               cog = self.cog, block_size = self.block_size)
+        except rasterio.errors.RasterioError as e:
+            log(f"Error while filling NoData in {input_raster}: {e}", input = input_raster, error = repr(e))
+            return False
 
 
 if __name__ == "__main__":
     directory = r"G:\My Drive\projects\policy_analysis\policy_analysis\ndvi\landsat7"
     merger = MergeMedianRasters(directory=directory)
-    merger.merge_median_rasters()
+    merger.merge_median_rasters(workers = os.cpu_count())
 
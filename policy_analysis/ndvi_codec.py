@@ -0,0 +1,94 @@
+import numpy as np
+
+# Compact NDVI storage: int16 counts of 1e-4 NDVI, so [-1, 1] maps to [-10000, 10000].
+# The scale/offset are written to the GeoTIFF band metadata, so GDAL/QGIS show the real values.
+SCALE = 1e-4
+OFFSET = 0.0
+NODATA = -32768
+DTYPE = "int16"
+
+
+def encode(ndvi):
+    """
+    Float NDVI (NaN = NoData) -> scaled int16, rounded to the nearest 1e-4.
+    """
+    ndvi = np.asarray(ndvi, dtype = np.float64)
+    valid = ~np.isnan(ndvi)
+    encoded = np.full(ndvi.shape, NODATA, dtype = np.int16)
+    encoded[valid] = np.clip(np.rint((ndvi[valid] - OFFSET) / SCALE), NODATA + 1, np.iinfo(np.int16).max)
+    return encoded
+
+
+def decode(values, scale = SCALE, offset = OFFSET, nodata = NODATA):
+    """
+    Scaled values -> float32 NDVI with NaN for NoData.
+    """
+    decoded = np.asarray(values).astype(np.float32)
+    if nodata is not None and not np.isnan(nodata):
+        decoded[np.asarray(values) == nodata] = np.nan
+    if scale != 1 or offset != 0:
+        decoded = decoded * np.float32(scale) + np.float32(offset)
+    return decoded
+
+
+def compact_profile(profile):
+    """
+    A copy of a rasterio write profile switched to the compact int16 format.
+    """
+    profile = dict(profile)
+    profile.update(dtype = DTYPE, nodata = NODATA)
+    return profile
+
+
+def set_scaling(dst):
+    """
+    Records the compact scale/offset on every band of an open output dataset.
+    """
+    dst.scales = (SCALE,) * dst.count
+    dst.offsets = (OFFSET,) * dst.count
+
+
+def band_scaling(src, band = 1):
+    return src.scales[band - 1], src.offsets[band - 1]
+
+
+def is_compact(src):
+    return src.dtypes[0] == DTYPE and src.nodata == NODATA and band_scaling(src) == (SCALE, OFFSET)
+
+
+def read_ndvi(src, window = None, band = 1):
+    """
+    Reads a band as float32 NDVI with NaN for NoData, applying the band scale/offset, whatever format it is stored in.
+    """
+    scale, offset = band_scaling(src, band)
+    return decode(src.read(band, window = window), scale = scale, offset = offset, nodata = src.nodata)
+
+
+def read_compact(src, window = None, band = 1):
+    """
+    Reads a band as compact int16 counts; compact sources are read as-is, anything else is decoded and re-encoded.
+    """
+    if is_compact(src):
+        return src.read(band, window = window)
+    return encode(read_ndvi(src, window, band))
+
+
+def median_int16(stack):
+    """
+    Per-pixel median over axis 0 of a compact (time, y, x) int16 stack, ignoring NODATA, without going through float.
+
+    NODATA is the smallest int16, so after an integer sort each pixel's valid values are the last `count` entries;
+    the two middle ones are picked with take_along_axis and averaged (rounded half to even, as `encode` would).
+    Pixels with no valid value stay NODATA.
+    """
+    n = stack.shape[0]
+    ordered = np.sort(stack, axis = 0)
+    count = (stack != NODATA).sum(axis = 0)
+    first = n - count
+    lower = np.minimum(first + (count - 1) // 2, n - 1)
+    upper = np.minimum(first + count // 2, n - 1)
+    total = (np.take_along_axis(ordered, lower[None], axis = 0)[0].astype(np.int32)
+             + np.take_along_axis(ordered, upper[None], axis = 0)[0])
+    median = np.rint(total / 2).astype(np.int16)
+    median[count == 0] = NODATA
+    return median
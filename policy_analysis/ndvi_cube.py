@@ -0,0 +1,206 @@
+import json
+import os
+
+import numpy as np
+import rasterio
+from affine import Affine
+from rasterio.crs import CRS
+from rasterio.windows import Window
+
+from policy_analysis import ndvi_codec
+from policy_analysis.instrument import log, stage
+from policy_analysis.utils import iter_windows, year_from_path
+
+METADATA_FILE = "cube.json"
+
+
+class NDVICube():
+    """
+    On-disk NDVI time-series cube (time x y x x) built from the yearly GeoTIFFs.
+
+    The cube is a directory holding `cube.json` (CRS, transform, shape and the year coordinate) and one
+    memory-mappable float32 `ndvi_<year>.npy` time slice per year, NoData stored as NaN. Reads only touch the
+    pages they need, so a per-pixel series costs one small read per year instead of one full GeoTIFF decode,
+    and appending a year writes a single new slice rather than rebuilding the cube.
+    """
+    def __init__(self, cube_dir):
+        self.cube_dir = cube_dir
+        with open(os.path.join(cube_dir, METADATA_FILE)) as f:
+            metadata = json.load(f)
+        self.crs = CRS.from_wkt(metadata["crs"]) if metadata["crs"] else None
+        self.transform = Affine(*metadata["transform"])
+        self.shape = tuple(metadata["shape"])
+        self.years = metadata["years"]
+        self._slices = {}
+
+    @classmethod
+    def create(cls, cube_dir, crs, transform, shape):
+        """
+        Creates an empty cube on the given grid.
+        """
+        os.makedirs(cube_dir, exist_ok = True)
+        write_metadata(cube_dir, {
+            "crs": crs.to_wkt() if crs else None,
+            "transform": list(transform)[:6],
+            "shape": list(shape),
+            "years": [],
+        })
+        return cls(cube_dir)
+
+    @classmethod
+    def build(cls, raster_paths, cube_dir, block_size = 512):
+        """
+        Builds a cube from yearly rasters on a shared grid; the year of each is taken from its file name.
+        An existing cube in `cube_dir` is extended, and years it already holds are skipped.
+        """
+        raster_paths = sorted(raster_paths, key = year_from_path)
+        if os.path.exists(os.path.join(cube_dir, METADATA_FILE)):
+            cube = cls(cube_dir)
+        else:
+            with rasterio.open(raster_paths[0]) as src:
+                cube = cls.create(cube_dir, src.crs, src.transform, src.shape)
+
+        for path in raster_paths:
+            if year_from_path(path) in cube.years:
+                log(f"{year_from_path(path)} is already in the cube, skipping {path}", year = year_from_path(path), skipped = True)
+                continue
+            cube.append(path, block_size = block_size)
+        return cube
+
+    def slice_path(self, year):
+        return os.path.join(self.cube_dir, f"ndvi_{year}.npy")
+
+    def append(self, raster_path, year = None, block_size = 512, overwrite = False):
+        """
+        Adds one yearly raster as a new time slice, copying it block by block so memory stays bounded.
+        The raster must be on the cube's grid.
+        """
+        year = year if year is not None else year_from_path(raster_path)
+        if year in self.years and not overwrite:
+            raise ValueError(f"{year} is already in the cube at {self.cube_dir}")
+
+        with stage("cube_append", year = year, raster = raster_path) as timing:
+            with rasterio.open(raster_path) as src:
+                if src.shape != self.shape or not src.transform.almost_equals(self.transform) or src.crs != self.crs:
+                    raise ValueError(f"{raster_path} is not on the cube grid {self.shape} {self.transform} {self.crs}")
+
+                tmp_path = self.slice_path(year) + ".tmp"
+                time_slice = np.lib.format.open_memmap(tmp_path, mode = "w+", dtype = np.float32, shape = self.shape)
+                for window in iter_windows(src.width, src.height, block_size):
+                    data = ndvi_codec.read_ndvi(src, window)
+                    timing.wrote(data)
+                    rows, cols = window.toslices()
+                    time_slice[rows, cols] = data
+                time_slice.flush()
+                del time_slice
+        os.replace(tmp_path, self.slice_path(year))
+
+        self._slices.pop(year, None)
+        self.years = sorted(set(self.years) | {year})
+        write_metadata(self.cube_dir, {
+            "crs": self.crs.to_wkt() if self.crs else None,
+            "transform": list(self.transform)[:6],
+            "shape": list(self.shape),
+            "years": self.years,
+        })
+        log(f"Added {year} from {raster_path} to the cube at {self.cube_dir}", year = year)
+
+    def time_slice(self, year):
+        """
+        Read-only memory map of one year's (y, x) slice.
+        """
+        if year not in self._slices:
+            self._slices[year] = np.load(self.slice_path(year), mmap_mode = "r")
+        return self._slices[year]
+
+    def read(self, window = None, years = None):
+        """
+        Returns a (time, y, x) float32 array for `window` (the full grid if None) and `years` (all if None).
+        """
+        years = self.years if years is None else years
+        window = window or Window(0, 0, self.shape[1], self.shape[0])
+        rows, cols = window.toslices()
+        return np.stack([self.time_slice(year)[rows, cols] for year in years], axis = 0)
+
+    def pixel_series(self, row, col, years = None):
+        """
+        The NDVI time series of one pixel, one value per year.
+        """
+        years = self.years if years is None else years
+        return np.array([self.time_slice(year)[row, col] for year in years], dtype = np.float32)
+
+    def to_xarray(self, window = None, years = None):
+        """
+        The cube (or a window of it) as an xarray DataArray with year/y/x coordinates and the CRS attached via rioxarray.
+        """
+        import rioxarray  # noqa: F401, registers the .rio accessor
+        import xarray as xr
+
+        years = self.years if years is None else years
+        window = window or Window(0, 0, self.shape[1], self.shape[0])
+        transform = rasterio.windows.transform(window, self.transform)
+        xs = transform.c + transform.a * (np.arange(int(window.width)) + 0.5)
+        ys = transform.f + transform.e * (np.arange(int(window.height)) + 0.5)
+
+        data = xr.DataArray(self.read(window, years), dims = ("year", "y", "x"),
+                            coords = {"year": years, "y": ys, "x": xs}, name = "ndvi")
+        data = data.rio.write_transform(transform)
+        if self.crs is not None:
+            data = data.rio.write_crs(self.crs)
+        return data
+
+    def close(self):
+        self._slices = {}
+
+
+class RasterStack():
+    """
+    The yearly GeoTIFFs themselves, read through the same interface as NDVICube (years, shape, transform, crs, read),
+    so engines can consume either. Every raster must share one grid. Compact int16 rasters are unscaled on read.
+    """
+    def __init__(self, raster_paths):
+        raster_paths = sorted(raster_paths, key = year_from_path)
+        self.paths = {year_from_path(path): path for path in raster_paths}
+        self.years = sorted(self.paths)
+        self._sources = {}
+        with rasterio.open(raster_paths[0]) as src:
+            self.crs, self.transform, self.shape = src.crs, src.transform, src.shape
+        for path in raster_paths[1:]:
+            with rasterio.open(path) as src:
+                if src.shape != self.shape or not src.transform.almost_equals(self.transform):
+                    raise ValueError(f"{path} is not on the grid of {raster_paths[0]}")
+
+    def source(self, year):
+        if year not in self._sources:
+            self._sources[year] = rasterio.open(self.paths[year])
+        return self._sources[year]
+
+    def read(self, window = None, years = None):
+        years = self.years if years is None else years
+        stack = []
+        for year in years:
+            stack.append(ndvi_codec.read_ndvi(self.source(year), window))
+        return np.stack(stack, axis = 0)
+
+    def close(self):
+        for src in self._sources.values():
+            src.close()
+        self._sources = {}
+
+
+def open_stack(source):
+    """
+    Opens a cube directory as an NDVICube, or a list of yearly raster paths as a RasterStack.
+    """
+    if isinstance(source, (NDVICube, RasterStack)):
+        return source
+    if isinstance(source, str) and os.path.exists(os.path.join(source, METADATA_FILE)):
+        return NDVICube(source)
+    return RasterStack(source)
+
+
+def write_metadata(cube_dir, metadata):
+    tmp_path = os.path.join(cube_dir, METADATA_FILE + ".tmp")
+    with open(tmp_path, "w") as f:
+        json.dump(metadata, f, indent = 2)
+    os.replace(tmp_path, os.path.join(cube_dir, METADATA_FILE))
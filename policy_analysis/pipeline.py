@@ -0,0 +1,244 @@
+import json
+import os
+import sys
+
+from policy_analysis.instrument import log, stage
+from policy_analysis.utils import SHAPEFILE_SIDECARS, file_hash, vector_hash, year_from_path
+
+MANIFEST_FILE = ".pipeline_manifest.json"
+
+
+class Task():
+    """
+    One unit of pipeline work: `action()` turns `inputs` into `outputs` under `params`.
+    Inputs and outputs are file paths; params must be JSON-serialisable (max_distance, CRS, resampling...).
+    An action that returns False produced nothing (e.g. a year whose scenes are all NoData): its outputs are recorded
+    as empty, and tasks reading an empty input are recorded empty without running, unless `accepts_empty` is set.
+    """
+    def __init__(self, stage, inputs, outputs, params, action, accepts_empty = False):
+        self.stage = stage
+        self.inputs = list(inputs)
+        self.outputs = list(outputs)
+        self.params = params
+        self.action = action
+        self.accepts_empty = accepts_empty
+
+    def __repr__(self):
+        return f"{self.stage}: {', '.join(self.outputs)}"
+
+
+class Manifest():
+    """
+    Records, per output file, the stage, params and content hashes of the inputs it was built from,
+    plus the hash of the output itself. Hashes are memoised by (size, mtime), of every sidecar for a shapefile,
+    so unchanged files are not re-read. Outputs a task did not produce are recorded as empty.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.records = {}
+        self.hashes = {}
+        if os.path.exists(path):
+            with open(path) as f:
+                manifest = json.load(f)
+            self.records = manifest.get("outputs", {})
+            self.hashes = manifest.get("hashes", {})
+
+    def stat_key(self, path):
+        """
+        [extension, size, mtime] of `path`, and of each of its sidecars for a shapefile, whose attributes and
+        projection can change without touching the .shp.
+        """
+        stem, ext = os.path.splitext(path)
+        if ext.lower() != ".shp":
+            return [[ext, os.stat(path).st_size, os.stat(path).st_mtime_ns]]
+        return [[sidecar, os.stat(stem + sidecar).st_size, os.stat(stem + sidecar).st_mtime_ns]
+                for sidecar in SHAPEFILE_SIDECARS if os.path.exists(stem + sidecar)]
+
+    def hash(self, path):
+        if self.is_empty(path):
+            return None
+        key = self.stat_key(path)
+        cached = self.hashes.get(path)
+        if cached and cached[0] == key:
+            return cached[1]
+        digest = vector_hash(path) if path.lower().endswith(".shp") else file_hash(path)
+        self.hashes[path] = [key, digest]
+        return digest
+
+    def is_empty(self, path):
+        return self.records.get(path, {}).get("empty", False)
+
+    def stale_reason(self, task, stale_inputs = ()):
+        """
+        Why `task` needs rebuilding, or None if every output is current.
+        `stale_inputs` are files an earlier task will rebuild in this run (used for dry runs).
+        """
+        for path in task.inputs:
+            if path in stale_inputs:
+                return f"input {path} is being rebuilt"
+            if not os.path.exists(path) and not self.is_empty(path):
+                return f"input {path} is missing"
+        for output in task.outputs:
+            record = self.records.get(output)
+            if record is None or not (record.get("empty") or os.path.exists(output)):
+                return f"{output} has not been built"
+            if record["stage"] != task.stage or record["params"] != task.params:
+                return f"params changed for {output}"
+            if record["inputs"] != {path: self.hash(path) for path in task.inputs}:
+                return f"inputs changed for {output}"
+            if not record.get("empty") and record["output_hash"] != self.hash(output):
+                return f"{output} was modified outside the pipeline"
+        return None
+
+    def record(self, task, empty = False):
+        inputs = {path: self.hash(path) for path in task.inputs}
+        for output in task.outputs:
+            self.records.pop(output, None)  # so a formerly empty output is hashed
+            self.records[output] = {"stage": task.stage, "params": task.params, "inputs": inputs,
+                                    "output_hash": None if empty else self.hash(output)}
+            if empty:
+                self.records[output]["empty"] = True
+
+    def save(self):
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"outputs": self.records, "hashes": self.hashes}, f, indent = 2)
+        os.replace(tmp_path, self.path)
+
+
+class Pipeline():
+    """
+    Runs tasks in the order they were added, rebuilding only those whose inputs, params or outputs changed.
+    Tasks must be added upstream first; a rebuilt output makes every downstream task that reads it stale.
+    """
+    def __init__(self, manifest_path):
+        self.manifest = Manifest(manifest_path)
+        self.tasks = []
+
+    def add(self, task):
+        self.tasks.append(task)
+        return task
+
+    def run(self, dry_run = False):
+        """
+        Rebuilds stale tasks and returns them. With `dry_run`, nothing is executed and the tasks that
+        would be rebuilt are listed instead.
+        """
+        rebuilt = []
+        empty = []
+        stale_outputs = set()
+        for task in self.tasks:
+            reason = self.manifest.stale_reason(task, stale_outputs if dry_run else ())
+            if reason is None:
+                continue
+            rebuilt.append(task)
+            if dry_run:
+                log(f"would rebuild {task} ({reason})", task = task.stage, outputs = task.outputs, reason = reason)
+                stale_outputs.update(task.outputs)
+                continue
+
+            if not task.accepts_empty and any(self.manifest.is_empty(path) for path in task.inputs):
+                log(f"skipping {task} (an input is empty)", task = task.stage, outputs = task.outputs)
+                for output in task.outputs:
+                    if os.path.exists(output):
+                        os.remove(output)  # left over from a run where the input had data
+                produced = False
+            else:
+                log(f"rebuilding {task} ({reason})", task = task.stage, outputs = task.outputs, reason = reason)
+                with stage(f"pipeline.{task.stage}", outputs = task.outputs, reason = reason):
+                    produced = task.action() is not False
+            if not produced:
+                empty.append(task)
+            self.manifest.record(task, empty = not produced)
+            self.manifest.save()  # saved per task so an interrupted run keeps its progress
+
+        log(f"{len(rebuilt)} of {len(self.tasks)} tasks {'would be ' if dry_run else ''}rebuilt"
+            + (f", {len(empty)} with empty outputs" if empty else ""),
+            rebuilt = len(rebuilt), tasks = len(self.tasks), empty = len(empty), dry_run = dry_run)
+        return rebuilt
+
+
+def ndvi_pipeline(directory, zones_path, zones_layer = "bdas", id_column = "project_name",
+                  crs = None, clip_path = None, max_distance = 50, workers = 1, compact = False, cog = False,
+                  block_size = 512):
+    """
+    The NDVI pipeline over GEE exports already synced into `directory` (LANDSAT_<year> scene folders):
+    reproject (if `crs` is given) -> median composite -> NoData fill -> per-year zonal statistics -> combined table.
+    The GEE export itself runs remotely and is not tracked; the synced scene files are the pipeline's roots.
+    `compact` stores every intermediate raster as scaled int16 (see `ndvi_codec`); the statistics are unscaled.
+    Rasters are tiled in `block_size` tiles, and with `cog` written as Cloud-Optimized GeoTIFFs with overviews.
+    """
+    from policy_analysis.fill_nodata import fill_nodata
+    from policy_analysis.merge_rasters import MergeMedianRasters
+    from policy_analysis.reproject import destination_grid, reproject_file
+    from policy_analysis.zonal_stats import ZoneLayer, zonal_stats_table
+
+    pipeline = Pipeline(os.path.join(directory, MANIFEST_FILE))
+    clip_layer = ZoneLayer(clip_path, all_touched = True) if clip_path else None
+    zones = ZoneLayer(zones_path, layer = zones_layer, id_column = id_column)
+    merger = MergeMedianRasters(directory, block_size = block_size, fill_workers = workers, compact = compact, cog = cog)
+
+    year_jobs = []
+    for year, raster_files in merger.year_jobs():
+        if crs is None:
+            year_jobs.append((year, sorted(raster_files)))
+            continue
+        reprojected = []
+        for raster_file in sorted(raster_files):
+            output = os.path.join(os.path.dirname(raster_file), "reprojected",
+                                  f"{os.path.basename(raster_file).split('.tif')[0]}_repro.tif")
+
+            def reproject(raster_file = raster_file, output = output):
+                os.makedirs(os.path.dirname(output), exist_ok = True)
+                transform, width, height = destination_grid(raster_file, crs)
+                reproject_file(raster_file, output, crs, transform, width, height, clip_layer = clip_layer,
+                               block_size = block_size, compact = compact, cog = cog)
+
+            inputs = [raster_file] + ([clip_path] if clip_path else [])
+            pipeline.add(Task("reproject", inputs, [output], {"crs": crs, "resampling": "nearest", "compact": compact, "cog": cog, "block_size": block_size}, reproject))
+            reprojected.append(output)
+        year_jobs.append((year, reprojected))
+
+    yearly_stats = []
+    for year, raster_files in year_jobs:
+        median_raster = os.path.join(merger.output_dir, f"median_raster_{year}.tif")
+        filled_raster = os.path.join(merger.filled_dir, f"ndvi_filled_{year}.tif")
+        stats_csv = os.path.join(merger.output_dir, "zonal", f"zonal_stats_{year}.csv")
+
+        def composite(raster_files = raster_files, median_raster = median_raster, year = year):
+            if not merger.median_composite(raster_files, median_raster):
+                log("All input rasters contain only NoData values.", year = year)
+                return False  # recorded as empty, so the year's fill and zonal tasks are skipped
+
+        def fill(median_raster = median_raster, filled_raster = filled_raster):
+            fill_nodata(median_raster, filled_raster, max_distance = max_distance, workers = workers, force = True, cog = cog,
+                        block_size = block_size)
+
+        def zonal(filled_raster = filled_raster, stats_csv = stats_csv):
+            os.makedirs(os.path.dirname(stats_csv), exist_ok = True)
+            zonal_stats_table([filled_raster], zones, id_column = id_column).to_csv(stats_csv, index = False)
+
+        pipeline.add(Task("composite", raster_files, [median_raster], {"compact": compact, "cog": cog, "block_size": block_size}, composite))
+        pipeline.add(Task("fill", [median_raster], [filled_raster], {"max_distance": max_distance, "cog": cog, "block_size": block_size}, fill))
+        pipeline.add(Task("zonal", [filled_raster, zones_path], [stats_csv], {"layer": zones_layer, "id_column": id_column}, zonal))
+        yearly_stats.append(stats_csv)
+
+    combined_csv = os.path.join(merger.output_dir, "zonal_stats.csv")
+
+    def combine():
+        import pandas as pd
+        tables = [pd.read_csv(path) for path in sorted(yearly_stats, key = year_from_path)
+                  if not pipeline.manifest.is_empty(path)]
+        if not tables:
+            return False
+        pd.concat(tables, ignore_index = True).to_csv(combined_csv, index = False)
+
+    if yearly_stats:
+        pipeline.add(Task("combine", yearly_stats, [combined_csv], {}, combine, accepts_empty = True))
+    return pipeline
+
+
+if __name__ == "__main__":
+    # same as `policy-analysis pipeline ...`
+    from policy_analysis.cli import main
+    sys.exit(main(["pipeline", *sys.argv[1:]]))
@@ -0,0 +1,190 @@
+import os
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+import rasterio
+from rasterio.warp import transform, transform_geom
+from rasterio.windows import Window
+
+from policy_analysis import ndvi_codec
+from policy_analysis.instrument import stage
+from policy_analysis.utils import year_from_path
+from policy_analysis.zonal_stats import STATISTICS, ZoneIndex, zonal_statistics
+
+
+class BlockCache():
+    """
+    Size-bounded LRU cache of decoded raster blocks (float32 NDVI, NaN for NoData), shared across queries.
+
+    Blocks are keyed by file path, modification time and block position, so a rewritten raster is never served
+    stale. Once the cached arrays exceed `max_bytes` the least recently used blocks are dropped. Thread-safe.
+    """
+    def __init__(self, max_bytes = 256 * 1024 ** 2):
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._blocks = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            block = self._blocks.get(key)
+            if block is None:
+                self.misses += 1
+                return None
+            self._blocks.move_to_end(key)
+            self.hits += 1
+            return block
+
+    def put(self, key, block):
+        with self._lock:
+            if key in self._blocks:
+                return
+            self._blocks[key] = block
+            self.nbytes += block.nbytes
+            while self.nbytes > self.max_bytes and len(self._blocks) > 1:
+                _, evicted = self._blocks.popitem(last = False)
+                self.nbytes -= evicted.nbytes
+
+    def clear(self):
+        with self._lock:
+            self._blocks.clear()
+            self.nbytes = 0
+
+
+class NDVIQuery():
+    """
+    Yearly NDVI series for points and polygons, read straight from the yearly GeoTIFFs (float or compact int16).
+
+    Only the internal blocks (tiles or strips) under the queried pixels are read, decoded once and kept in a
+    BlockCache, so repeated lookups in the same area cost no I/O. Batched point queries group the points by block and
+    resolve them in one pass per file. The rasters need not share a grid. Not thread-safe: give each thread its own
+    NDVIQuery, they can share one BlockCache.
+    """
+    def __init__(self, raster_paths, cache = None):
+        self.paths = {year_from_path(path): path for path in raster_paths}
+        self.years = sorted(self.paths)
+        self.cache = cache if cache is not None else BlockCache()
+        self._sources = {}
+
+    def source(self, year):
+        if year not in self._sources:
+            self._sources[year] = rasterio.open(self.paths[year])
+        return self._sources[year]
+
+    def block(self, year, block_row, block_col, timing = None):
+        """
+        The decoded block at (`block_row`, `block_col`) of the internal block grid of `year`'s raster.
+        """
+        src = self.source(year)
+        key = (src.name, os.stat(src.name).st_mtime_ns, block_row, block_col)
+        block = self.cache.get(key)
+        if block is None:
+            block_height, block_width = src.block_shapes[0]
+            window = Window(block_col * block_width, block_row * block_height,
+                            min(block_width, src.width - block_col * block_width),
+                            min(block_height, src.height - block_row * block_height))
+            block = ndvi_codec.read_ndvi(src, window)
+            block.flags.writeable = False
+            self.cache.put(key, block)
+            if timing is not None:
+                timing.read(block)
+        return block
+
+    def values(self, year, rows, cols, timing = None):
+        """
+        NDVI at pixel (`rows`, `cols`) of `year`'s raster (NaN outside it), reading every needed block once.
+        """
+        src = self.source(year)
+        rows, cols = np.asarray(rows, dtype = np.int64), np.asarray(cols, dtype = np.int64)
+        values = np.full(rows.shape, np.nan, dtype = np.float32)
+        inside = (rows >= 0) & (rows < src.height) & (cols >= 0) & (cols < src.width)
+        if not inside.any():
+            return values
+
+        block_height, block_width = src.block_shapes[0]
+        block_cols = -(-src.width // block_width)
+        positions = np.flatnonzero(inside)
+        block_rows_of, block_cols_of = rows[positions] // block_height, cols[positions] // block_width
+        blocks, which = np.unique(block_rows_of * block_cols + block_cols_of, return_inverse = True)
+        order = np.argsort(which, kind = "stable")
+        bounds = np.searchsorted(which[order], np.arange(len(blocks) + 1))
+        for i, key in enumerate(blocks):
+            block_row, block_col = divmod(int(key), block_cols)
+            members = positions[order[bounds[i]:bounds[i + 1]]]
+            block = self.block(year, block_row, block_col, timing)
+            values[members] = block[rows[members] - block_row * block_height, cols[members] - block_col * block_width]
+        return values
+
+    def pixels(self, year, xs, ys, crs = None):
+        """
+        The (rows, cols) of points `xs`, `ys` (in `crs`, default the raster's) on `year`'s raster.
+        """
+        src = self.source(year)
+        xs, ys = np.asarray(xs, dtype = np.float64), np.asarray(ys, dtype = np.float64)
+        if crs is not None and src.crs is not None and rasterio.crs.CRS.from_user_input(crs) != src.crs:
+            xs, ys = (np.asarray(v) for v in transform(crs, src.crs, xs, ys))
+        cols, rows = ~src.transform * (xs, ys)
+        return np.floor(rows).astype(np.int64), np.floor(cols).astype(np.int64)
+
+    def points(self, xs, ys, crs = None, ids = None, years = None):
+        """
+        NDVI of many points at once: a DataFrame with one row per point (indexed by `ids` if given) and one column
+        per year, NaN where a point is NoData or off the raster.
+        """
+        years = self.years if years is None else years
+        columns = {}
+        with stage("query", points = len(xs), years = len(years)) as timing:
+            for year in years:
+                rows, cols = self.pixels(year, xs, ys, crs)
+                columns[year] = self.values(year, rows, cols, timing)
+                timing.add(pixels = len(rows))
+        return pd.DataFrame(columns, index = pd.Index(ids if ids is not None else np.arange(len(xs)), name = "id"))
+
+    def point(self, x, y, crs = None, years = None):
+        """
+        The NDVI series of one point, as a Series indexed by year.
+        """
+        return self.points([x], [y], crs = crs, years = years).iloc[0].rename("ndvi").rename_axis("year")
+
+    def polygon(self, geometry, crs = None, all_touched = False, years = None):
+        """
+        Per-year NDVI statistics (count, mean, median, std, min, max) over a shapely polygon in `crs` (default the
+        rasters' CRS), counting the pixels whose centre it covers, or every touched pixel with `all_touched`.
+        """
+        years = self.years if years is None else years
+        rows = []
+        indexes = {}
+        with stage("query", polygons = 1, years = len(years)) as timing:
+            for year in years:
+                src = self.source(year)
+                grid = (tuple(src.transform), src.shape, src.crs.to_wkt() if src.crs else None)
+                if grid not in indexes:
+                    shape = geometry
+                    if crs is not None and src.crs is not None and rasterio.crs.CRS.from_user_input(crs) != src.crs:
+                        shape = transform_geom(crs, src.crs, getattr(geometry, "__geo_interface__", geometry))
+                    indexes[grid] = ZoneIndex.from_geometries([as_shape(shape)], src.transform, src.shape,
+                                                              all_touched = all_touched)
+                index = indexes[grid]
+                values = self.values(year, index.pixel_index // src.width, index.pixel_index % src.width, timing)
+                timing.add(pixels = len(values))
+                stats = zonal_statistics(values, index.zone_ids, 1)
+                rows.append({"year": year, **{name: stats[name][0] for name in STATISTICS}})
+        return pd.DataFrame(rows, columns = ["year"] + STATISTICS)
+
+    def close(self):
+        for src in self._sources.values():
+            src.close()
+        self._sources = {}
+
+
+def as_shape(geometry):
+    """
+    A shapely geometry from a shapely geometry or a GeoJSON-like mapping.
+    """
+    from shapely.geometry import shape
+
+    return geometry if hasattr(geometry, "bounds") else shape(geometry)
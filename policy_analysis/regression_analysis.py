@@ -1,93 +1,87 @@
-from sklearn.linear_model import LinearRegression
-import numpy as np
-import matplotlib.pyplot as plt
+import math
 import os
 import rasterio
-from rasterio.mask import mask
-import rioxarray as rxr
-import geopandas as gpd 
 from pprint import pprint
-from tqdm import tqdm
 
-input_dir = "ndvi/SENTINEL2/reprojected"
-file_paths = sorted([os.path.join(input_dir, f) for f in os.listdir(input_dir) if f.endswith(".tif")])
+from policy_analysis.cog import read_overview
+from policy_analysis.instrument import log
 
-def raster_difference(file_1, file_2):
-    """ Differences a raster and shows the plot. 
+
+def raster_difference(file_1, file_2, max_size = None, plot = False, output_path = None, plot_size = 2048):
+    """ Differences a raster for a quick look; nothing is rendered unless plot is True or output_path is given
+        (the figure is then saved there, or shown without blocking). For full-resolution change maps and per-BDA
+        gain/loss areas use change_detection.detect_change.
+        Both rasters are read at full resolution, or with max_size at the overview level whose longest side is at most
+        max_size pixels, so a quick look at a COG only decodes that level. The plot alone is decimated to at most
+        plot_size pixels a side.
         Returns the difference in a rasterio compliant array `nump.ndarray`"""
 
     with rasterio.open(file_1) as src1:
-        top_raster = src1.read(1)
+        top_raster = read_overview(src1, max_size or max(src1.shape))
     with rasterio.open(file_2) as bot_src:
-        bottom_raster = bot_src.read(1)
+        bottom_raster = read_overview(bot_src, max_size or max(bot_src.shape))
         
     if top_raster.shape == bottom_raster.shape:
         difference = bottom_raster - top_raster
         
-        plt.figure(figsize=(10, 6))
-        plt.imshow(difference, cmap='RdYlGn', interpolation='none')  # Plot using a color map
-        plt.title(f"Difference Between {file_1} and {file_2}")
-        plt.colorbar(label="NDVI Difference")
-        plt.show()
-        print(type(difference))
+        if plot or output_path:
+            import matplotlib.pyplot as plt
+
+            plt.figure(figsize=(10, 6))
+            step = max(1, math.ceil(max(difference.shape) / plot_size))
+            plt.imshow(difference[::step, ::step], cmap='RdYlGn', interpolation='none')  # Plot using a color map
+            plt.title(f"Difference Between {file_1} and {file_2}")
+            plt.colorbar(label="NDVI Difference")
+            if output_path:
+                plt.savefig(output_path, dpi = 150, bbox_inches = 'tight')
+                plt.close()
+            else:
+                plt.show(block = False)
         return difference
     else:    
-        print("The images have different shapes. Please ensure the rasters are aligned.")
-# raster_difference(file_paths[0], file_paths[-1])
-
-
-
-
-
-data = {}
-interest_areas = "interest_areas/bda.gpkg"
-
-for file in tqdm(file_paths):
-    image_year = (os.path.split(file))[-1].split("_")[1] # gets year value as it's second element in this split.
-    
-    with rasterio.open(file) as src:
-        image = src.read(1)
-
-        gdf = gpd.read_file(interest_areas, layer = 'bdas')
-        if gdf.crs != src.crs:
-            gdf = gdf.to_crs(src.crs)
-            print(f"gdf was in {gdf.crs} projection and has now been converted to {src.crs} in line with the raster")
-
-        gdf = gdf[gdf.is_valid]
-
-        for idx, row in gdf.iterrows():
-            # Extract the geometry (polygon) to use for clipping
-            geometry = [row['geometry']] 
-            out_image, out_transform = mask(src, geometry, crop=True)
-            poly_name = row['project_name'] 
-            mean_ndvi = np.nanmean(out_image)
-
-            if poly_name not in data:
-                data[poly_name] = {} 
-            data[poly_name][image_year] = mean_ndvi
-
-            # plt.figure(figsize=(10, 6))
-            # plt.imshow(out_image[0], cmap='RdYlGn')
-            # plt.title(f"Clipped Raster for Polygon {poly_name}")
-            # plt.colorbar(label="NDVI Values")
-            # plt.show()
-
-first_key = next(iter(data))
-key_years = data.get(first_key).keys()
-
-years = list(key_years)
-print(years)
-plt.figure(figsize = (10, 6))
+        log("The images have different shapes. Please ensure the rasters are aligned.", file_1 = file_1, file_2 = file_2)
+
+
+def main(input_dir = "ndvi/SENTINEL2/reprojected", interest_areas = "interest_areas/bda.gpkg", output_path = None):
+    """ Per-BDA NDVI statistics and trends for the yearly rasters in input_dir, then a plot of mean NDVI over time
+        (saved to output_path if given, otherwise shown). Returns the zonal statistics and trend summary tables. """
+    import matplotlib.pyplot as plt
+    from tqdm import tqdm
+
+    from policy_analysis.trend import trend_rasters
+    from policy_analysis.zonal_stats import ZoneLayer, zonal_stats_table
+
+    file_paths = sorted([os.path.join(input_dir, f) for f in os.listdir(input_dir) if f.endswith(".tif")])
+    # raster_difference(file_paths[0], file_paths[-1])
+
+    # polygon pixel indices are cached on disk per raster grid, then every year is one vectorized pass
+    zones = ZoneLayer(interest_areas, layer = 'bdas', id_column = 'project_name')
+    zonal_table = zonal_stats_table(file_paths, zones, id_column = 'project_name')
+    pprint(zonal_table)
+
+    # per-pixel NDVI ~ year regression, summarised per BDA
+    trend_summary = trend_rasters(file_paths, os.path.join(input_dir, "trend"), zone_layer = zones)
+    pprint(trend_summary)
+
+    years = sorted(zonal_table['year'].unique())
+    plt.figure(figsize = (10, 6))
+
+    for poly_name, poly_table in tqdm(zonal_table.groupby('project_name', sort = False)):
+        poly_table = poly_table.sort_values('year')
+        plt.plot(poly_table['year'], poly_table['mean'], label = poly_name)
+
+    plt.xlabel('Year')
+    plt.ylabel('Mean NDVI')
+    plt.title('Mean NDVI Over Time for Different Policy Areas')
+    plt.legend(title=f"NDVI over BDAs between {min(years)} - {max(years)}")
+    plt.grid(True)
+    if output_path:
+        plt.savefig(output_path, dpi = 150, bbox_inches = 'tight')
+        plt.close()
+    else:
+        plt.show()
+    return zonal_table, trend_summary
 
-for poly_name, year_data in tqdm(data.items()):
-    mean_ndvi_values = [year_data[str(year)] for year in years]
-    
-    plt.plot(years, mean_ndvi_values, label = poly_name)
 
-plt.xlabel('Year')
-plt.ylabel('Mean NDVI')
-plt.title('Mean NDVI Over Time for Different Policy Areas')
-plt.legend(title=f"NDVI over BDAs between {min(years)} - {max(years)}")
-plt.grid(True)
-plt.show()
-        
+if __name__ == "__main__":
+    main()
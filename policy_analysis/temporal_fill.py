@@ -0,0 +1,133 @@
+import os
+
+import numpy as np
+import pandas as pd
+import rasterio
+
+from policy_analysis import ndvi_codec
+from policy_analysis.cog import staging_path, tiled_profile, to_cog
+from policy_analysis.instrument import log, stage
+from policy_analysis.ndvi_cube import open_stack
+from policy_analysis.utils import iter_row_strips
+
+METHODS = ["linear", "nearest"]
+SOURCE_NODATA = 0
+
+
+def fill_gaps(stack, years, method = "linear", max_gap = None):
+    """
+    Fills NaN pixels of a (time, y, x) `stack` from the same pixel's nearest valid years before and after, in closed
+    form over the whole array (no per-pixel interpolators).
+
+    `linear` interpolates between the valid years either side in proportion to the year distance, and never
+    extrapolates past the first or last valid year. `nearest` copies the closer valid year (the earlier one on a tie).
+    With `max_gap` a pixel is only filled from years at most that many years away. Valid pixels are kept as they are.
+    Returns the filled float32 stack and int16 (time, y, x) `source_before` / `source_after` provenance arrays: the
+    years the value was taken from (both the pixel's own year if it was valid, both the source year for `nearest`),
+    SOURCE_NODATA where the pixel is still NaN.
+    """
+    if method not in METHODS:
+        raise ValueError(f"Unknown method {method!r}, expected one of {METHODS}")
+    years = np.asarray(years, dtype = np.int16)
+    n_years = len(years)
+    valid = ~np.isnan(stack)
+    steps = np.arange(n_years, dtype = np.int16)[:, None, None]
+
+    # index of the last valid year at or before / first valid year at or after each year
+    before = np.maximum.accumulate(np.where(valid, steps, -1), axis = 0)
+    after = np.flip(np.minimum.accumulate(np.flip(np.where(valid, steps, n_years), axis = 0), axis = 0), axis = 0)
+    has_before, has_after = before >= 0, after < n_years
+    before, after = np.clip(before, 0, n_years - 1), np.clip(after, 0, n_years - 1)
+
+    year_before, year_after = years[before], years[after]
+    distance_before = years[:, None, None] - year_before
+    distance_after = year_after - years[:, None, None]
+    if max_gap is not None:
+        has_before &= distance_before <= max_gap
+        has_after &= distance_after <= max_gap
+    value_before = np.take_along_axis(stack, before, axis = 0)
+    value_after = np.take_along_axis(stack, after, axis = 0)
+
+    if method == "linear":
+        use = has_before & has_after
+        span = (year_after - year_before).astype(np.float32)
+        with np.errstate(invalid = "ignore", divide = "ignore"):
+            weight = np.where(span > 0, distance_before / span, 0).astype(np.float32)
+        filled = np.where(use, value_before + (value_after - value_before) * weight, np.nan).astype(np.float32)
+        source_before = np.where(use, year_before, SOURCE_NODATA).astype(np.int16)
+        source_after = np.where(use, year_after, SOURCE_NODATA).astype(np.int16)
+    else:
+        take_before = has_before & (~has_after | (distance_before <= distance_after))
+        take_after = has_after & ~take_before
+        filled = np.where(take_before, value_before, np.where(take_after, value_after, np.nan)).astype(np.float32)
+        source_before = np.where(take_before, year_before, np.where(take_after, year_after, SOURCE_NODATA)).astype(np.int16)
+        source_after = source_before.copy()
+    return filled, source_before, source_after
+
+
+def temporal_fill(source, output_dir, method = "linear", max_gap = None, block_rows = 256, compact = False, cog = False,
+                  block_size = 256):
+    """
+    Fills the NoData gaps left after compositing (SLC-off stripes, persistent cloud) from each pixel's neighbouring
+    years, for a series of yearly rasters or an NDVICube. See `fill_gaps` for `method` and `max_gap` (in years).
+
+    For every year it writes ndvi_temporal_<year>.tif (NDVI, compact int16 with `compact`) and
+    ndvi_temporal_source_<year>.tif, an int16 provenance raster whose bands are the years the value was filled from
+    (band 1 `source_before`, band 2 `source_after`, 0 where unfilled). The grid is processed in full-width strips of
+    `block_rows` rows, so memory is years x block_rows x width (times a small constant for the index arrays).
+    The rasters are tiled in `block_size` tiles.
+    Returns a DataFrame with the missing, filled and remaining NoData pixel counts per year.
+    """
+    stack = open_stack(source)
+    years = stack.years
+    os.makedirs(output_dir, exist_ok = True)
+    height, width = stack.shape
+
+    base_profile = {"driver": "GTiff", "count": 1, "crs": stack.crs, "transform": stack.transform,
+                    "width": width, "height": height, "dtype": "float32", "nodata": np.nan}
+    ndvi_profile = tiled_profile(ndvi_codec.compact_profile(base_profile) if compact else base_profile, block_size)
+    source_profile = tiled_profile({**base_profile, "count": 2, "dtype": "int16", "nodata": SOURCE_NODATA}, block_size)
+    paths = {year: (os.path.join(output_dir, f"ndvi_temporal_{year}.tif"),
+                    os.path.join(output_dir, f"ndvi_temporal_source_{year}.tif")) for year in years}
+    missing = np.zeros(len(years), dtype = np.int64)
+    remaining = np.zeros(len(years), dtype = np.int64)
+
+    destinations = {}
+    with stage("temporal_fill", output_dir = output_dir, years = len(years), method = method) as timing:
+        try:
+            for year, (ndvi_path, source_path) in paths.items():
+                ndvi_dst = rasterio.open(staging_path(ndvi_path, cog), "w", **ndvi_profile)
+                source_dst = rasterio.open(staging_path(source_path, cog), "w", **source_profile)
+                if compact:
+                    ndvi_codec.set_scaling(ndvi_dst)
+                source_dst.descriptions = ("source_before", "source_after")
+                destinations[year] = (ndvi_dst, source_dst)
+
+            for window in iter_row_strips(width, height, block_rows):
+                block = stack.read(window, years = years)
+                timing.read(block)
+                filled, source_before, source_after = fill_gaps(block, years, method = method, max_gap = max_gap)
+                missing += np.isnan(block).sum(axis = (1, 2))
+                remaining += np.isnan(filled).sum(axis = (1, 2))
+                for i, (ndvi_dst, source_dst) in enumerate(destinations.values()):
+                    ndvi_dst.write(ndvi_codec.encode(filled[i]) if compact else filled[i], 1, window = window)
+                    source_dst.write(np.stack([source_before[i], source_after[i]]), window = window)
+                timing.wrote(filled)
+                timing.add(bytes_written = source_before.nbytes + source_after.nbytes)
+        finally:
+            for ndvi_dst, source_dst in destinations.values():
+                ndvi_dst.close()
+                source_dst.close()
+            stack.close()
+
+        if cog:
+            for ndvi_path, source_path in paths.values():
+                to_cog(staging_path(ndvi_path, cog), ndvi_path, block_size)
+                to_cog(staging_path(source_path, cog), source_path, block_size, resampling = "nearest")
+
+    summary = pd.DataFrame({"year": years, "missing": missing, "filled": missing - remaining, "remaining": remaining})
+    for row in summary.itertuples(index = False):
+        log(f"{row.year}: filled {row.filled} of {row.missing} NoData pixels from neighbouring years",
+            year = row.year, missing = int(row.missing), filled = int(row.filled))
+    log(f"Temporally filled rasters for {years[0]}-{years[-1]} written to {output_dir}", output_dir = output_dir)
+    return summary
@@ -0,0 +1,352 @@
+import glob
+import json
+import os
+import socket
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+import rasterio
+from rasterio.windows import Window
+
+from policy_analysis import ndvi_codec
+from policy_analysis.cog import staging_path, tiled_profile, to_cog
+from policy_analysis.fill_nodata import MAX_DISTANCE_TAG, SOURCE_HASH_TAG, fill_halo, fill_window, max_distance_tag
+from policy_analysis.instrument import log, stage
+from policy_analysis.merge_rasters import composite_profile, median_window
+from policy_analysis.utils import file_hash, iter_windows, year_from_path
+from policy_analysis.zonal_stats import STATISTICS, ZoneLayer, unscale_statistics, zonal_statistics
+
+JOB_FILE = "job.json"
+QUEUE_STATES = ("pending", "claimed", "done")
+
+
+class TiledJob():
+    """
+    One stage (see OPS) run tile by tile from a job folder, so the work can be spread over local processes or over
+    several machines that share the folder.
+
+    `job.json` holds the op, inputs, output and params. Each tile of the grid is a small JSON file that moves
+    pending/ -> claimed/ -> done/ by os.rename, which is atomic within a filesystem, so exactly one worker wins each
+    claim. A tile's result is saved to tiles/ before it is marked done, so a crashed or interrupted run resumes by
+    calling `work` again (`release_stale` hands tiles claimed by dead workers back). `finish` mosaics the tiles,
+    or reduces the zonal partials, into the same output the single-array stage writes.
+    """
+    def __init__(self, job_dir):
+        self.job_dir = job_dir
+        with open(os.path.join(job_dir, JOB_FILE)) as f:
+            self.spec = json.load(f)
+        self.params = self.spec["params"]
+        self._zone_index = None
+
+    @classmethod
+    def create(cls, job_dir, op, inputs, output, tile_size = 1024, halo = None, **params):
+        """
+        Sets up (or resumes) a job folder for `op` over the grid of `inputs`, which must all share one grid.
+        `halo` defaults to what the op needs: `fill_halo(max_distance)` for fill, 0 otherwise. Creating a job whose
+        folder already holds the same job keeps its progress; a different job in the same folder is an error.
+        """
+        if op not in OPS:
+            raise ValueError(f"Unknown op {op!r}, expected one of {sorted(OPS)}")
+        grids = set()
+        for path in inputs:
+            with rasterio.open(path) as src:
+                grids.add((tuple(src.transform), src.shape))
+        if len(grids) > 1:
+            raise ValueError(f"Input rasters are not aligned, found {len(grids)} grids")
+        (_, (height, width)), = grids
+        if halo is None:
+            halo = fill_halo(params.get("max_distance", 50), params.get("smoothing_iterations", 0)) if op == "fill" else 0
+
+        spec = {"op": op, "inputs": [os.path.abspath(path) for path in inputs], "output": os.path.abspath(output),
+                "width": width, "height": height, "tile_size": tile_size, "halo": halo, "params": params}
+        spec_path = os.path.join(job_dir, JOB_FILE)
+        if os.path.exists(spec_path):
+            with open(spec_path) as f:
+                if json.load(f) != json.loads(json.dumps(spec)):
+                    raise ValueError(f"{job_dir} already holds a different job")
+        for state in QUEUE_STATES + ("tiles",):
+            os.makedirs(os.path.join(job_dir, state), exist_ok = True)
+        with open(spec_path, "w") as f:
+            json.dump(spec, f, indent = 2)
+
+        queued = 0
+        for window in iter_windows(width, height, tile_size):
+            name = f"{int(window.row_off) // tile_size:04d}_{int(window.col_off) // tile_size:04d}"
+            if any(os.path.exists(os.path.join(job_dir, state, f"{name}.json")) for state in QUEUE_STATES):
+                continue
+            with open(os.path.join(job_dir, "pending", f"{name}.json"), "w") as f:
+                json.dump({"name": name, "col_off": window.col_off, "row_off": window.row_off,
+                           "width": window.width, "height": window.height}, f)
+            queued += 1
+
+        job = cls(job_dir)
+        if op == "zonal":
+            job.zone_index()  # built once here, so workers all load it from the cache
+        log(f"Tiled {op} job in {job_dir}: {queued} tiles queued, {job.progress()}", job_dir = job_dir, queued = queued)
+        return job
+
+    def tiles(self, state):
+        """
+        The tiles currently in `state` (pending, claimed or done), in row-major order.
+        """
+        tiles = []
+        for path in sorted(glob.glob(os.path.join(self.job_dir, state, "*.json"))):
+            try:
+                with open(path) as f:
+                    tiles.append(json.load(f))
+            except FileNotFoundError:
+                continue  # moved on by another worker
+        return tiles
+
+    def progress(self):
+        return {state: len(glob.glob(os.path.join(self.job_dir, state, "*.json"))) for state in QUEUE_STATES}
+
+    def claim(self, worker):
+        """
+        Moves the first pending tile to claimed/ and returns it, or None once nothing is pending.
+        """
+        for path in sorted(glob.glob(os.path.join(self.job_dir, "pending", "*.json"))):
+            claimed = os.path.join(self.job_dir, "claimed", os.path.basename(path))
+            try:
+                os.rename(path, claimed)
+            except (FileNotFoundError, FileExistsError):
+                continue  # another worker got there first
+            with open(claimed) as f:
+                tile = json.load(f)
+            tile["worker"] = worker
+            with open(claimed, "w") as f:  # also stamps the claim time used by release_stale
+                json.dump(tile, f)
+            return tile
+        return None
+
+    def complete(self, tile):
+        try:
+            os.replace(os.path.join(self.job_dir, "claimed", f"{tile['name']}.json"),
+                       os.path.join(self.job_dir, "done", f"{tile['name']}.json"))
+        except FileNotFoundError:
+            pass  # released as stale and finished by another worker; the results are identical
+
+    def release_stale(self, max_age):
+        """
+        Returns tiles claimed more than `max_age` seconds ago (their worker presumably died) to pending.
+        """
+        released = 0
+        for path in glob.glob(os.path.join(self.job_dir, "claimed", "*.json")):
+            try:
+                if os.path.getmtime(path) < time.time() - max_age:
+                    os.rename(path, os.path.join(self.job_dir, "pending", os.path.basename(path)))
+                    released += 1
+            except FileNotFoundError:
+                continue
+        if released:
+            log(f"Released {released} stale tiles in {self.job_dir}", job_dir = self.job_dir, released = released)
+        return released
+
+    def result_path(self, tile):
+        return os.path.join(self.job_dir, "tiles", f"{tile['name']}.npz")
+
+    def window(self, tile):
+        return Window(tile["col_off"], tile["row_off"], tile["width"], tile["height"])
+
+    def zone_index(self):
+        """
+        The ZoneIndex of the job's zone layer on the input grid, from the ZoneLayer cache.
+        """
+        if self._zone_index is None:
+            layer = ZoneLayer(self.params["zones"], layer = self.params.get("layer"),
+                              id_column = self.params.get("id_column"), all_touched = self.params.get("all_touched", False))
+            with rasterio.open(self.spec["inputs"][0]) as src:
+                self._zone_index = layer.index_for(src.transform, src.shape, src.crs)
+        return self._zone_index
+
+    def work(self, worker = None, max_tiles = None, stale_after = None):
+        """
+        Claims and processes tiles until none are pending (or `max_tiles` are done). Safe to run from any number of
+        processes or machines at once. Returns the number of tiles this call processed.
+        """
+        worker = worker or f"{socket.gethostname()}:{os.getpid()}"
+        if stale_after is not None:
+            self.release_stale(stale_after)
+        process_tile = OPS[self.spec["op"]][0]
+        processed = 0
+        with stage("tiles", op = self.spec["op"], job_dir = self.job_dir, worker = worker) as timing:
+            sources = [rasterio.open(path) for path in self.spec["inputs"]]
+            try:
+                while max_tiles is None or processed < max_tiles:
+                    tile = self.claim(worker)
+                    if tile is None:
+                        break
+                    result = process_tile(self, sources, self.window(tile), timing)
+                    tmp_path = self.result_path(tile) + ".tmp.npz"
+                    np.savez(tmp_path, **result)
+                    os.replace(tmp_path, self.result_path(tile))
+                    self.complete(tile)
+                    processed += 1
+            finally:
+                for src in sources:
+                    src.close()
+        log(f"{worker} processed {processed} tiles of {self.job_dir}", worker = worker, tiles = processed)
+        return processed
+
+    def finish(self):
+        """
+        Mosaics or reduces the tile results into the job's output once every tile is done. Returns the op's result,
+        False for a composite of inputs that are NoData everywhere (no output is written).
+        """
+        progress = self.progress()
+        if progress["pending"] or progress["claimed"]:
+            raise RuntimeError(f"{self.job_dir} is not complete yet: {progress}")
+        with stage("tiles_finish", op = self.spec["op"], output = self.spec["output"]):
+            result = OPS[self.spec["op"]][1](self)
+        if result is not False:
+            log(f"Tiled {self.spec['op']} output saved to {self.spec['output']}", output = self.spec["output"])
+        return result
+
+
+def mosaic(job, profile, scales = None, offsets = None, tags = None):
+    """
+    Writes every tile result's `data` into the job's output raster at its window.
+    """
+    output = job.spec["output"]
+    cog = job.params.get("cog", False)
+    with rasterio.open(staging_path(output, cog), "w", **profile) as dst:
+        if scales is not None:
+            dst.scales, dst.offsets = scales, offsets
+        for tile in job.tiles("done"):
+            with np.load(job.result_path(tile)) as result:
+                dst.write(result["data"], 1, window = job.window(tile))
+        if tags:
+            dst.update_tags(**tags)
+    if cog:
+        to_cog(staging_path(output, cog), output, job.params.get("block_size", 512))
+    return output
+
+
+def composite_tile(job, sources, window, timing):
+    median_block, valid, stack = median_window(sources, window, job.params.get("compact", False))
+    timing.read(stack)
+    timing.wrote(median_block)
+    return {"data": median_block, "valid": np.array(valid.any())}
+
+
+def mosaic_composite(job):
+    """
+    Same output as `MergeMedianRasters.median_composite`, including returning False and writing nothing (removing
+    any earlier output) if every input pixel is NoData.
+    """
+    valid = False
+    for tile in job.tiles("done"):
+        with np.load(job.result_path(tile)) as result:
+            valid = bool(result["valid"])
+        if valid:
+            break
+    if not valid:
+        output = job.spec["output"]
+        if os.path.exists(output):
+            os.remove(output)
+        log("All input rasters contain only NoData values.", output = output)
+        return False
+
+    compact = job.params.get("compact", False)
+    with rasterio.open(job.spec["inputs"][0]) as src:
+        profile = composite_profile(src.profile, compact, job.params.get("block_size", 512))
+    if compact:
+        return mosaic(job, profile, scales = (ndvi_codec.SCALE,), offsets = (ndvi_codec.OFFSET,))
+    return mosaic(job, profile)
+
+
+def fill_tile(job, sources, window, timing):
+    block = fill_window(sources[0], window, job.spec["halo"], job.params.get("max_distance", 50),
+                        job.params.get("smoothing_iterations", 0), timing)
+    timing.wrote(block)
+    return {"data": block}
+
+
+def mosaic_fill(job):
+    """
+    Same output as `fill_nodata` (given the same tile size), tags included, so it counts as an up to date fill.
+    """
+    input_raster = job.spec["inputs"][0]
+    with rasterio.open(input_raster) as src:
+        profile = tiled_profile(src.profile, job.params.get("block_size", 512))
+        scales, offsets = src.scales, src.offsets
+    tags = {SOURCE_HASH_TAG: file_hash(input_raster), MAX_DISTANCE_TAG: max_distance_tag(job.params.get("max_distance", 50))}
+    return mosaic(job, profile, scales = scales, offsets = offsets, tags = tags)
+
+
+def zonal_tile(job, sources, window, timing):
+    """
+    The zone index entries whose pixel falls in `window` (their positions in the index) and each input's values there.
+    """
+    index = job.zone_index()
+    width = index.shape[1]
+    entries = index.rows_slice(Window(0, window.row_off, width, window.height))
+    pixels = index.pixel_index[entries]
+    cols = pixels % width
+    inside = (cols >= window.col_off) & (cols < window.col_off + window.width)
+    positions = np.arange(entries.start, entries.stop)[inside]
+    local = (pixels[inside] // width - int(window.row_off)) * int(window.width) + cols[inside] - int(window.col_off)
+
+    result = {"positions": positions}
+    for i, src in enumerate(sources):
+        if len(positions) == 0:
+            result[f"values_{i}"] = np.empty(0, dtype = src.dtypes[0])
+            continue
+        block = src.read(1, window = window)
+        timing.read(block)
+        result[f"values_{i}"] = block.ravel()[local]
+        timing.add(pixels = len(positions))
+    return result
+
+
+def reduce_zonal(job):
+    """
+    Reassembles each input's values in zone index order and summarises them, giving the same table as
+    `zonal_stats_table`, which is also written to the job's output CSV.
+    """
+    index = job.zone_index()
+    tiles = job.tiles("done")
+    frames = []
+    for i, path in enumerate(job.spec["inputs"]):
+        values = None
+        for tile in tiles:
+            with np.load(job.result_path(tile)) as result:
+                if values is None:
+                    values = np.empty(len(index.pixel_index), dtype = result[f"values_{i}"].dtype)
+                values[result["positions"]] = result[f"values_{i}"]
+        with rasterio.open(path) as src:
+            stats = zonal_statistics(values, index.zone_ids, index.n_zones, nodata = src.nodata)
+            stats = unscale_statistics(stats, *src.scales[:1], *src.offsets[:1])
+        frame = pd.DataFrame(stats)
+        frame.insert(0, "year", year_from_path(path))
+        frame.insert(0, job.params.get("id_column") or "zone", index.names if index.names is not None else np.arange(index.n_zones))
+        frames.append(frame)
+
+    table = pd.concat(frames, ignore_index = True) if frames else pd.DataFrame(columns = ["year"] + STATISTICS)
+    table.to_csv(job.spec["output"], index = False)
+    return table
+
+
+# op -> (process one tile into a dict of arrays, combine the saved tile results)
+OPS = {
+    "composite": (composite_tile, mosaic_composite),
+    "fill": (fill_tile, mosaic_fill),
+    "zonal": (zonal_tile, reduce_zonal),
+}
+
+
+def work_tiles(job_dir, worker = None, max_tiles = None, stale_after = None):
+    return TiledJob(job_dir).work(worker = worker, max_tiles = max_tiles, stale_after = stale_after)
+
+
+def run_tiles(job_dir, workers = os.cpu_count(), stale_after = None):
+    """
+    Works a job with `workers` local processes and finishes it. Workers on other machines can share the same job.
+    """
+    with ProcessPoolExecutor(max_workers = workers) as executor:
+        futures = [executor.submit(work_tiles, job_dir, stale_after = stale_after if i == 0 else None) for i in range(workers)]
+        processed = sum(future.result() for future in futures)
+    log(f"{processed} tiles processed by {workers} workers", job_dir = job_dir, tiles = processed)
+    return TiledJob(job_dir).finish()
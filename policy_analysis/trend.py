@@ -0,0 +1,125 @@
+import os
+
+import numpy as np
+import pandas as pd
+import rasterio
+
+from policy_analysis.cog import staging_path, tiled_profile, to_cog
+from policy_analysis.instrument import log, stage
+from policy_analysis.ndvi_cube import open_stack
+from policy_analysis.utils import iter_row_strips
+from policy_analysis.zonal_stats import zonal_statistics
+
+TREND_METRICS = ["slope", "intercept", "r2", "p_value", "n_years"]
+
+
+def pixel_trends(stack, years, reference_year = None, min_years = 3):
+    """
+    Ordinary least squares NDVI ~ year for every pixel of a (time, y, x) `stack`, in closed form.
+
+    NaN years are dropped per pixel. `slope` is NDVI change per year and `intercept` the fitted NDVI at
+    `reference_year` (default: the first year). `p_value` is the two-sided t-test of slope != 0 (1 for a flat series).
+    Pixels with fewer than `min_years` valid years (at least 3, so the test has a degree of freedom) are NaN.
+    Returns a dict of metric name -> (y, x) float32 array.
+    """
+    from scipy import stats
+
+    years = np.asarray(years, dtype = np.float64)
+    reference_year = years[0] if reference_year is None else reference_year
+    x = (years - reference_year)[:, None, None]
+
+    valid = ~np.isnan(stack)
+    n = valid.sum(axis = 0)
+    with np.errstate(invalid = "ignore", divide = "ignore"):
+        mean_x = np.where(valid, x, 0).sum(axis = 0) / n
+        mean_y = np.where(valid, stack, 0).sum(axis = 0, dtype = np.float64) / n
+        dx = np.where(valid, x - mean_x, 0)
+        dy = np.where(valid, stack - mean_y, 0)
+        sxx = (dx * dx).sum(axis = 0)
+        sxy = (dx * dy).sum(axis = 0)
+        syy = (dy * dy).sum(axis = 0)
+
+        slope = sxy / sxx
+        intercept = mean_y - slope * mean_x
+        r2 = np.where(syy > 0, sxy * sxy / (sxx * syy), 0.0)
+        dof = n - 2
+        residual_variance = np.maximum(syy - slope * sxy, 0) / dof
+        t_stat = slope / np.sqrt(residual_variance / sxx)
+        p_value = np.where(residual_variance > 0, 2 * stats.t.sf(np.abs(t_stat), dof), 0.0)
+        # a flat series has no trend at all (p = 1, as in scipy.stats.linregress); only an exact fit with a slope is p = 0
+        p_value = np.where(syy > 0, p_value, 1.0)
+
+    enough = (n >= max(min_years, 3)) & (sxx > 0)
+    metrics = {"slope": slope, "intercept": intercept, "r2": r2, "p_value": p_value, "n_years": n}
+    return {name: np.where(enough, values, np.nan).astype(np.float32) for name, values in metrics.items()}
+
+
+def trend_rasters(source, output_dir, zone_layer = None, id_column = "project_name",
+                  block_rows = 256, reference_year = None, min_years = 3, alpha = 0.05, cog = False, block_size = 256):
+    """
+    Writes per-pixel NDVI trend rasters (ndvi_trend_<metric>.tif) for a series of yearly rasters or an NDVICube.
+
+    The grid is processed in full-width strips of `block_rows` rows, so memory is years x block_rows x width.
+    If `zone_layer` (a `zonal_stats.ZoneLayer`, e.g. the BDAs) is given, the slopes and p-values at zone pixels are
+    gathered in the same pass and summarised per zone: slope statistics plus the fraction of pixels with a
+    significant (p < `alpha`) increase or decrease. The summary is also saved as ndvi_trend_summary.csv.
+    The rasters are tiled in `block_size` tiles, and with `cog` written as Cloud-Optimized GeoTIFFs with overviews.
+    Returns the summary DataFrame, or None without a zone layer.
+    """
+    stack = open_stack(source)
+    os.makedirs(output_dir, exist_ok = True)
+    height, width = stack.shape
+    profile = tiled_profile({
+        "driver": "GTiff", "count": 1, "dtype": "float32", "nodata": np.nan,
+        "crs": stack.crs, "transform": stack.transform, "width": width, "height": height,
+    }, block_size)
+    paths = {metric: os.path.join(output_dir, f"ndvi_trend_{metric}.tif") for metric in TREND_METRICS}
+    index = zone_layer.index_for(stack.transform, stack.shape, stack.crs) if zone_layer is not None else None
+    zone_slopes, zone_p_values, zone_ids = [], [], []
+
+    with stage("trend", output_dir = output_dir) as timing:
+        destinations = {metric: rasterio.open(staging_path(path, cog), "w", **profile) for metric, path in paths.items()}
+        try:
+            for window in iter_row_strips(width, height, block_rows):
+                block = stack.read(window)
+                timing.read(block)
+                metrics = pixel_trends(block, stack.years, reference_year = reference_year, min_years = min_years)
+                for metric, dst in destinations.items():
+                    dst.write(metrics[metric], 1, window = window)
+                    timing.add(bytes_written = metrics[metric].nbytes)
+                timing.add(pixels = metrics["slope"].size)
+
+                if index is not None:
+                    entries = index.rows_slice(window)
+                    local = index.pixel_index[entries] - int(window.row_off) * width
+                    zone_slopes.append(metrics["slope"].ravel()[local])
+                    zone_p_values.append(metrics["p_value"].ravel()[local])
+                    zone_ids.append(index.zone_ids[entries])
+        finally:
+            for dst in destinations.values():
+                dst.close()
+            stack.close()
+        if cog:
+            for path in paths.values():
+                to_cog(staging_path(path, cog), path, block_size)
+    log(f"Trend rasters for {stack.years[0]}-{stack.years[-1]} written to {output_dir}", output_dir = output_dir)
+
+    if index is None:
+        return None
+
+    slopes = np.concatenate(zone_slopes)
+    p_values = np.concatenate(zone_p_values)
+    zones = np.concatenate(zone_ids)
+    summary = pd.DataFrame({f"slope_{name}": values for name, values in
+                            zonal_statistics(slopes, zones, index.n_zones).items()})
+    summary = summary.rename(columns = {"slope_count": "pixels"})
+    significant = ~np.isnan(p_values) & (p_values < alpha)
+    with np.errstate(invalid = "ignore", divide = "ignore"):
+        summary["improving_fraction"] = np.bincount(zones, weights = significant & (slopes > 0), minlength = index.n_zones) / summary["pixels"]
+        summary["declining_fraction"] = np.bincount(zones, weights = significant & (slopes < 0), minlength = index.n_zones) / summary["pixels"]
+    summary.insert(0, id_column, index.names if index.names is not None else np.arange(index.n_zones))
+
+    summary_path = os.path.join(output_dir, "ndvi_trend_summary.csv")
+    summary.to_csv(summary_path, index = False)
+    log(f"Per-zone trend summary saved to {summary_path}", output = summary_path)
+    return summary
@@ -0,0 +1,80 @@
+import hashlib
+import os
+import re
+
+from rasterio.windows import Window
+
+
+def iter_windows(width, height, block_size = 512):
+    """
+    Yields row-major `rasterio.windows.Window` blocks of at most `block_size` x `block_size`
+    covering a `width` x `height` raster.
+    """
+    for row_off in range(0, height, block_size):
+        for col_off in range(0, width, block_size):
+            yield Window(col_off, row_off,
+                         min(block_size, width - col_off),
+                         min(block_size, height - row_off))
+
+
+def iter_row_strips(width, height, rows = 256):
+    """
+    Yields full-width windows of at most `rows` rows. Flat pixel indices inside a strip are contiguous,
+    which lets sorted pixel indexes (see `zonal_stats.ZoneIndex`) be sliced per strip with a binary search.
+    """
+    for row_off in range(0, height, rows):
+        yield Window(0, row_off, width, min(rows, height - row_off))
+
+
+def file_hash(path, chunk_size = 1 << 20):
+    """
+    Returns the sha256 hex digest of a file's contents, read in `chunk_size` chunks.
+    """
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def pad_window(window, halo, width, height):
+    """
+    Grows `window` by `halo` pixels on every side, clipped to a `width` x `height` raster.
+    Returns the padded window and the slice of it that covers the original window.
+    """
+    col_start = max(0, window.col_off - halo)
+    row_start = max(0, window.row_off - halo)
+    col_stop = min(width, window.col_off + window.width + halo)
+    row_stop = min(height, window.row_off + window.height + halo)
+    padded = Window(col_start, row_start, col_stop - col_start, row_stop - row_start)
+    inner = (slice(window.row_off - row_start, window.row_off - row_start + window.height),
+             slice(window.col_off - col_start, window.col_off - col_start + window.width))
+    return padded, inner
+
+
+SHAPEFILE_SIDECARS = (".shp", ".shx", ".dbf", ".prj", ".cpg")
+
+
+def vector_hash(path):
+    """
+    Content hash of a vector dataset. For shapefiles the .shx/.dbf/.prj/.cpg sidecars are included,
+    since editing attributes or the projection does not touch the .shp itself.
+    """
+    stem, ext = os.path.splitext(path)
+    if ext.lower() != ".shp":
+        return file_hash(path)
+    digest = hashlib.sha256()
+    for sidecar in SHAPEFILE_SIDECARS:
+        if os.path.exists(stem + sidecar):
+            digest.update(file_hash(stem + sidecar).encode())
+    return digest.hexdigest()
+
+
+def year_from_path(path):
+    """
+    Extracts the first four-digit year (19xx/20xx) from a raster's file name, e.g. MedianNDVI_2016_no_mask_repro.tif -> 2016.
+    """
+    match = re.search(r"(?<!\d)(19|20)\d{2}(?!\d)", os.path.basename(path))
+    if match is None:
+        raise ValueError(f"No year found in {path}")
+    return int(match.group(0))
@@ -0,0 +1,60 @@
+import numpy as np
+import pandas as pd
+import pytest
+import rasterio
+from rasterio.features import geometry_mask
+
+from policy_analysis.benchmark import synthetic_stack, synthetic_zones
+from policy_analysis.change_detection import CHANGE_CLASSES, CLASS_NODATA, detect_change
+from policy_analysis.zonal_stats import ZoneLayer, load_zones
+
+HEIGHT, WIDTH = 45, 52
+YEARS = (2016, 2017, 2019)
+PAIRS = {"consecutive": [(2016, 2017), (2017, 2019)], "baseline": [(2016, 2017), (2016, 2019)]}
+
+
+def reference_classes(difference, gain_threshold, loss_threshold):
+    return np.select([np.isnan(difference), difference >= gain_threshold, difference <= loss_threshold],
+                     [CLASS_NODATA, CHANGE_CLASSES["gain"], CHANGE_CLASSES["loss"]],
+                     CHANGE_CLASSES["stable"]).astype(np.uint8)
+
+
+@pytest.mark.parametrize("mode", ["consecutive", "baseline"])
+def test_detect_change_matches_per_polygon_masks(tmp_path, mode):
+    rasters = [path for year in YEARS for path in synthetic_stack(str(tmp_path), year, 1, HEIGHT, WIDTH, seed = year)]
+    ndvi, transform = {}, None
+    for year, path in zip(YEARS, rasters):
+        with rasterio.open(path) as src:
+            ndvi[year], transform = src.read(1), src.transform
+    zones_path = synthetic_zones(str(tmp_path / "zones.gpkg"), 6, HEIGHT, WIDTH)
+    zone_layer = ZoneLayer(zones_path, layer = "bdas", id_column = "project_name", cache_dir = str(tmp_path / "cache"))
+    zones = load_zones(zones_path, layer = "bdas")
+
+    output_dir = tmp_path / "change"
+    summary = detect_change(rasters, str(output_dir), zone_layer = zone_layer, mode = mode, gain_threshold = 0.05,
+                            loss_threshold = -0.08, block_rows = 7)  # 7 does not divide the 45 rows
+
+    rows = []
+    for first, last in PAIRS[mode]:
+        difference = ndvi[last] - ndvi[first]
+        classes = reference_classes(difference, 0.05, -0.08)
+        with rasterio.open(output_dir / f"ndvi_change_{first}_{last}.tif") as src:
+            np.testing.assert_array_equal(src.read(1), difference)
+        with rasterio.open(output_dir / f"ndvi_change_class_{first}_{last}.tif") as src:
+            np.testing.assert_array_equal(src.read(1), classes)
+
+        for name, geometry in zip(zones["project_name"], zones.geometry):
+            inside = geometry_mask([geometry], difference.shape, transform, invert = True) & ~np.isnan(difference)
+            pixels = inside.sum()
+            row = {"project_name": name, "year_from": first, "year_to": last, "pixels": pixels,
+                   "mean_difference": difference[inside].astype(np.float64).mean() if pixels else np.nan}
+            for class_name, value in CHANGE_CLASSES.items():
+                count = (classes[inside] == value).sum()
+                row[f"{class_name}_area_ha"] = count * 30 * 30 / 10000
+                row[f"{class_name}_fraction"] = count / pixels if pixels else np.nan
+            rows.append(row)
+    expected = pd.DataFrame(rows)
+
+    assert (expected["pixels"] > 0).any() and expected["gain_area_ha"].gt(0).any() and expected["loss_area_ha"].gt(0).any()
+    pd.testing.assert_frame_equal(summary, expected, check_dtype = False, rtol = 1e-9)
+    pd.testing.assert_frame_equal(pd.read_csv(output_dir / "ndvi_change_summary.csv"), summary, check_dtype = False)
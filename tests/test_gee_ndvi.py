@@ -0,0 +1,41 @@
+import functools
+import importlib
+import sys
+
+import pytest
+
+from policy_analysis import cli, gee_tasks
+from tests.test_gee_ndvi_landsat_7 import fake_ee
+
+
+@pytest.fixture
+def sentinel(monkeypatch, tmp_path):
+    """
+    Imports gee_ndvi against a fake `ee` (set on the returned module as `module.ee = fake_ee(...)`).
+    """
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setitem(sys.modules, "ee", fake_ee({}))
+    sys.modules.pop("policy_analysis.gee_ndvi", None)
+    module = importlib.import_module("policy_analysis.gee_ndvi")
+    monkeypatch.setattr(module, "start_with_retry", functools.partial(gee_tasks.start_with_retry, sleep = lambda seconds: None))
+    yield module
+    sys.modules.pop("policy_analysis.gee_ndvi", None)
+
+
+def test_export_sentinel_submits_and_monitors_one_export_per_year(sentinel):
+    sentinel.ee = fake_ee({}, failures = {"MedianNDVI_2017_no_mask": [Exception("429 Too Many Requests")]})
+    assert cli.main(["--quiet", "export-sentinel", "2016", "2017"]) == 0
+
+    assert [task.config["description"] for task in sentinel.ee.exports] == \
+        ["MedianNDVI_2016_no_mask", "MedianNDVI_2017_no_mask"]
+    assert sentinel.ee.start_calls == 3  # the rate-limited export is retried
+    assert sentinel.ee.get_info_calls == 1  # the ROI coordinates are fetched once for every year
+
+
+def test_started_exports_are_monitored_when_another_fails(sentinel):
+    sentinel.ee = fake_ee({}, failures = {"MedianNDVI_2016_no_mask": [ValueError("bad region")]})
+    exporter = sentinel.SentinelNDVI()
+
+    with pytest.raises(RuntimeError, match = "1 exports failed to start: MedianNDVI_2016_no_mask"):
+        exporter.run_gee_task([2016, 2017])
+    assert exporter.submitted_task_ids == ["TASK_MedianNDVI_2017_no_mask"]
@@ -0,0 +1,137 @@
+import functools
+import importlib
+import sys
+import types
+
+import pytest
+
+from policy_analysis import gee_tasks
+
+
+class Computed():
+    """
+    A server-side value: every method returns another one, and getInfo returns `value` and counts the round trip.
+    """
+    def __init__(self, ee, value = None):
+        self.ee = ee
+        self.value = value
+
+    def __getattr__(self, name):
+        return lambda *args, **kwargs: Computed(self.ee, self.value)
+
+    def getInfo(self):
+        self.ee.get_info_calls += 1
+        return self.value
+
+
+class ImageCollection(Computed):
+    def __getattr__(self, name):
+        return lambda *args, **kwargs: self
+
+    def map(self, function):
+        function(Computed(self.ee))  # builds the server-side expression, as Earth Engine would
+        return self
+
+    def reduceColumns(self, reducer, selectors):
+        return Computed(self.ee, self.ee.scenes[self.year])
+
+    def filterDate(self, start, end):
+        self.year = int(start[:4])
+        return self
+
+
+class Task():
+    def __init__(self, ee, description, failures):
+        self.ee = ee
+        self.id = f"TASK_{description}"
+        self.config = {"description": description}
+        self.failures = list(failures)
+
+    def start(self):
+        self.ee.start_calls += 1
+        if self.failures:
+            raise self.failures.pop(0)
+
+
+def fake_ee(scenes, failures = None):
+    """
+    A stand-in `ee` module. `scenes` maps year -> [(system:index, product id, valid pixel count)], `failures`
+    maps an export description to the errors its first start() calls raise.
+    """
+    ee = types.ModuleType("ee")
+    ee.scenes = scenes
+    ee.get_info_calls = 0
+    ee.start_calls = 0
+    ee.exports = []
+
+    def to_drive(**kwargs):
+        task = Task(ee, kwargs["description"], (failures or {}).get(kwargs["description"], []))
+        ee.exports.append(task)
+        return task
+
+    def list_operations():
+        return [{"name": f"projects/p/operations/{task.id}", "done": True, "metadata": {"state": "SUCCEEDED"}}
+                for task in ee.exports]
+
+    ee.Initialize = lambda: None
+    ee.ImageCollection = lambda name: ImageCollection(ee)
+    for name in ("Geometry", "Reducer", "Filter"):
+        setattr(ee, name, types.SimpleNamespace(Rectangle = lambda bounds: Computed(ee, [bounds]),
+                                                count = lambda: Computed(ee), toList = lambda n: Computed(ee),
+                                                eq = lambda *args: Computed(ee), lt = lambda *args: Computed(ee)))
+    ee.FeatureCollection = ee.Image = ee.Dictionary = ee.Number = lambda *args: Computed(ee)
+    ee.batch = types.SimpleNamespace(Export = types.SimpleNamespace(image = types.SimpleNamespace(toDrive = to_drive)))
+    ee.data = types.SimpleNamespace(listOperations = list_operations)
+    return ee
+
+
+@pytest.fixture
+def landsat(monkeypatch, tmp_path):
+    """
+    Imports gee_ndvi_landsat_7 against a fake `ee` (set on the returned module as `module.ee = fake_ee(...)`).
+    """
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setitem(sys.modules, "ee", fake_ee({}))
+    sys.modules.pop("policy_analysis.gee_ndvi_landsat_7", None)
+    module = importlib.import_module("policy_analysis.gee_ndvi_landsat_7")
+    monkeypatch.setattr(module, "start_with_retry", functools.partial(gee_tasks.start_with_retry, sleep = lambda seconds: None))
+    yield module
+    sys.modules.pop("policy_analysis.gee_ndvi_landsat_7", None)
+
+
+SCENES = {
+    2005: [("A", "LE07_A", 20000), ("B", "LE07_B", 500), ("C", "LE07_C", None), ("D", "LE07_D", 501)],
+    2006: [("E", "LE07_E", 0), ("F", "LE07_F", 9000)],
+}
+
+
+def test_screening_is_one_round_trip_per_year_and_applies_the_threshold(landsat):
+    landsat.ee = fake_ee(SCENES)
+    exporter = landsat.LandsatNDVI()
+    exporter.landsat7_export_individual_ndvi([2005, 2006])
+
+    # one getInfo for the ROI coordinates (cached), one screening call per year
+    assert landsat.ee.get_info_calls == 1 + 2
+    assert sorted(task.config["description"] for task in landsat.ee.exports) == \
+        ["NDVI_Landsat7_LE07_A", "NDVI_Landsat7_LE07_D", "NDVI_Landsat7_LE07_F"]
+    assert sorted(exporter.submitted_task_ids) == sorted(task.id for task in landsat.ee.exports)
+
+
+def test_rate_limited_exports_are_retried(landsat):
+    landsat.ee = fake_ee(SCENES, failures = {"NDVI_Landsat7_LE07_A": [Exception("429 Too Many Requests")] * 2})
+    exporter = landsat.LandsatNDVI()
+    exporter.landsat7_export_individual_ndvi([2005])
+
+    assert landsat.ee.start_calls == 2 + 2
+    assert len(exporter.submitted_task_ids) == 2
+    assert exporter.failed_exports == []
+
+
+def test_started_exports_are_monitored_when_another_fails(landsat):
+    landsat.ee = fake_ee(SCENES, failures = {"NDVI_Landsat7_LE07_D": [ValueError("bad region")]})
+    exporter = landsat.LandsatNDVI()
+
+    with pytest.raises(RuntimeError, match = "1 exports failed to start"):
+        exporter.run_gee_task([2005, 2006])
+    assert sorted(exporter.submitted_task_ids) == ["TASK_NDVI_Landsat7_LE07_A", "TASK_NDVI_Landsat7_LE07_F"]
+    assert [description for description, _ in exporter.failed_exports] == ["NDVI_Landsat7_LE07_D"]
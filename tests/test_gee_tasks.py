@@ -0,0 +1,87 @@
+from types import SimpleNamespace
+
+from policy_analysis.gee_tasks import TaskMonitor, operation_status
+
+
+def operation(task_id, state, error = None):
+    operation = {"name": f"projects/earthengine-legacy/operations/{task_id}",
+                 "metadata": {"state": state, "description": f"export {task_id}"},
+                 "done": state in ("SUCCEEDED", "FAILED", "CANCELLED")}
+    if error:
+        operation["error"] = {"message": error}
+    return operation
+
+
+class FakeEE():
+    """
+    Stands in for the `ee` module: each listOperations call returns the next listing of `listings` (the last repeats).
+    """
+    def __init__(self, listings):
+        self.listings = listings
+        self.calls = 0
+        self.data = SimpleNamespace(listOperations = self.list_operations)
+
+    def list_operations(self):
+        listing = self.listings[min(self.calls, len(self.listings) - 1)]
+        self.calls += 1
+        return listing
+
+
+def monitor(task_ids, fake, **kwargs):
+    clock = iter(range(0, 10 ** 6, 5))
+    return TaskMonitor(task_ids, ee_module = fake, sleep = lambda seconds: None, clock = lambda: next(clock), **kwargs)
+
+
+def test_operation_status():
+    status = operation_status(operation("A", "FAILED", error = "boom"))
+    assert status["id"] == "A"
+    assert status["state"] == "FAILED"
+    assert status["error_message"] == "boom"
+    assert operation_status(operation("B", "PENDING"))["state"] == "READY"
+
+
+def test_wait_uses_one_listing_per_poll_and_ignores_other_tasks():
+    other = operation("OTHER", "RUNNING")
+    fake = FakeEE([
+        [operation("A", "RUNNING"), operation("B", "PENDING"), other],
+        [operation("A", "SUCCEEDED"), operation("B", "RUNNING"), other],
+        [operation("A", "SUCCEEDED"), operation("B", "FAILED", error = "no quota"), other],
+    ])
+    statuses = monitor(["A", "B"], fake).wait()
+
+    assert fake.calls == 3
+    assert set(statuses) == {"A", "B"}
+    assert statuses["A"]["state"] == "COMPLETED"
+    assert statuses["B"]["state"] == "FAILED"
+    assert statuses["B"]["error_message"] == "no quota"
+
+
+def test_finished_tasks_are_not_updated_again():
+    fake = FakeEE([
+        [operation("A", "SUCCEEDED"), operation("B", "RUNNING")],
+        [operation("A", "FAILED"), operation("B", "SUCCEEDED")],
+    ])
+    statuses = monitor(["A", "B"], fake).wait()
+    assert statuses["A"]["state"] == "COMPLETED"
+    assert statuses["B"]["state"] == "COMPLETED"
+
+
+def test_missing_task_becomes_unknown_and_stops_the_wait():
+    fake = FakeEE([[]])
+    statuses = monitor(["GONE"], fake, missing_polls = 3).wait()
+    assert statuses["GONE"]["state"] == "UNKNOWN"
+    assert fake.calls == 3
+
+
+def test_timeout_stops_polling():
+    fake = FakeEE([[operation("A", "RUNNING")]])
+    task_monitor = monitor(["A"], fake)
+    statuses = task_monitor.wait(timeout = 60)
+    assert statuses["A"]["state"] == "RUNNING"
+    assert not task_monitor.finished()
+
+
+def test_no_tasks():
+    fake = FakeEE([[]])
+    assert monitor([], fake).wait() == {}
+    assert fake.calls == 0
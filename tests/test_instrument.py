@@ -0,0 +1,36 @@
+import json
+
+from policy_analysis import cli, instrument
+from policy_analysis.benchmark import synthetic_stack
+from policy_analysis.instrument import Recorder
+
+HEIGHT, WIDTH = 60, 70
+
+
+def test_report_only_counts_this_runs_records(tmp_path, capsys):
+    scene, = synthetic_stack(str(tmp_path), 2016, 1, HEIGHT, WIDTH)
+    metrics = str(tmp_path / "metrics.jsonl")
+    for _ in range(3):
+        assert cli.main(["--quiet", "--metrics", metrics, "fill", scene, str(tmp_path / "filled.tif"), "--force"]) == 0
+
+    report = capsys.readouterr().out.splitlines()
+    assert report[-1].split()[:2] == ["fill", "1"]
+    with open(metrics) as f:
+        runs = [json.loads(line)["run"] for line in f if '"stage"' in line]
+    assert len(runs) == 3 and len(set(runs)) == 3  # the file still holds every run's records
+    assert [total["runs"] for total in Recorder.load(metrics, run_id = runs[-1]).summary()] == [1]
+
+
+def test_stage_records_its_own_rss_growth(monkeypatch):
+    peaks = iter([100.0, 900.0, 900.0, 905.0])  # process peak before and after each stage
+    monkeypatch.setattr(instrument, "peak_rss_mb", lambda: next(peaks))
+    metrics = Recorder(quiet = True)
+    with metrics.stage("heavy"):
+        pass
+    with metrics.stage("light"):
+        pass
+
+    heavy, light = metrics.records
+    assert (heavy["peak_rss_mb"], heavy["rss_growth_mb"]) == (900.0, 800.0)
+    assert (light["peak_rss_mb"], light["rss_growth_mb"]) == (905.0, 5.0)
+    assert [total["rss_growth_mb"] for total in metrics.summary()] == [800.0, 5.0]
@@ -0,0 +1,78 @@
+import numpy as np
+import pandas as pd
+import rasterio
+from rasterio.features import geometry_mask
+from rasterio.transform import from_origin
+
+from policy_analysis.benchmark import ORIGIN, PIXEL_SIZE, synthetic_zones
+from policy_analysis.land_cover import (LCM_CLASSES, LCM_VALUE_CATEGORIES, VALUE_CATEGORIES, class_crosstab,
+                                        value_category_table, zone_class_counts)
+from policy_analysis.zonal_stats import ZoneIndex, load_zones
+
+HEIGHT, WIDTH = 60, 70
+TRANSFORM = from_origin(*ORIGIN, PIXEL_SIZE, PIXEL_SIZE)
+
+
+def land_cover_raster(path, seed):
+    """
+    A categorical uint8 raster of LCM classes in patches, with NoData 0 and an unmapped class 30.
+    """
+    rng = np.random.default_rng(seed)
+    data = np.kron(rng.integers(1, 22, (HEIGHT // 5, WIDTH // 5)), np.ones((5, 5))).astype(np.uint8)
+    data[rng.random(data.shape) < 0.15] = 0
+    data[rng.random(data.shape) < 0.03] = 30
+    with rasterio.open(path, "w", driver = "GTiff", count = 1, dtype = "uint8", nodata = 0, crs = "EPSG:27700",
+                       transform = TRANSFORM, width = WIDTH, height = HEIGHT) as dst:
+        dst.write(data, 1)
+    return data
+
+
+def reference_counts(data, zones):
+    counts = []
+    for geometry in zones.geometry:
+        values = data[geometry_mask([geometry], data.shape, TRANSFORM, invert = True)]
+        counts.append(np.bincount(values[values != 0], minlength = 31))
+    return np.array(counts)
+
+
+def test_zone_class_counts_match_per_polygon_bincount(tmp_path):
+    zones = load_zones(synthetic_zones(str(tmp_path / "zones.gpkg"), 7, HEIGHT, WIDTH), layer = "bdas")
+    data = land_cover_raster(str(tmp_path / "lcm_2019.tif"), seed = 0)
+    index = ZoneIndex.from_geometries(zones.geometry, TRANSFORM, (HEIGHT, WIDTH))
+    with rasterio.open(tmp_path / "lcm_2019.tif") as src:
+        counts = zone_class_counts(src, index, block_rows = 3)  # far fewer rows than the zones span
+
+    assert index.bounding_window().height > 3
+    expected = reference_counts(data, zones)
+    assert counts.shape == (len(zones), 31) and expected[:, 30].sum() > 0
+    np.testing.assert_array_equal(counts, expected)
+
+
+def test_class_crosstab_and_value_category_table(tmp_path):
+    zones = load_zones(synthetic_zones(str(tmp_path / "zones.gpkg"), 7, HEIGHT, WIDTH), layer = "bdas")
+    rasters, rows = [], []
+    for year in (2017, 2019):
+        path = str(tmp_path / f"lcm_{year}.tif")
+        counts = reference_counts(land_cover_raster(path, seed = year), zones)
+        rasters.append(path)
+        for zone, class_value in zip(*np.nonzero(counts)):
+            pixels = counts[zone, class_value]
+            rows.append({"project_name": zones["project_name"][zone], "year": year, "class_value": class_value,
+                         "class_name": LCM_CLASSES.get(class_value, f"class {class_value}"),
+                         "value_category": LCM_VALUE_CATEGORIES.get(class_value, "unassigned"), "pixels": pixels,
+                         "area_ha": pixels * 0.09, "fraction": pixels / counts[zone].sum()})
+    expected = pd.DataFrame(rows)
+
+    crosstab = class_crosstab(rasters, zones, block_rows = 4)
+    pd.testing.assert_frame_equal(crosstab, expected, check_dtype = False)
+
+    categories = value_category_table(crosstab)
+    zone_years = expected[["project_name", "year"]].drop_duplicates()
+    assert len(categories) == len(zone_years) * (len(VALUE_CATEGORIES) + 1)  # + "unassigned"
+    assert list(categories["value_category"][:5]) == VALUE_CATEGORIES + ["unassigned"]
+    totals = expected.groupby(["project_name", "year", "value_category"])["pixels"].sum()
+    merged = categories.join(totals.rename("expected"), on = ["project_name", "year", "value_category"])
+    assert (merged["expected"].isna() == (merged["pixels"] == 0)).all()  # missing combinations are zero-filled
+    assert (merged["pixels"] == 0).any()
+    np.testing.assert_array_equal(merged["pixels"], merged["expected"].fillna(0))
+    np.testing.assert_allclose(categories.groupby(["project_name", "year"])["fraction"].sum(), 1)
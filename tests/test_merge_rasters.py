@@ -0,0 +1,39 @@
+import os
+
+import numpy as np
+import pytest
+import rasterio
+
+from policy_analysis.benchmark import synthetic_stack
+from policy_analysis.merge_rasters import MergeMedianRasters
+
+HEIGHT, WIDTH = 150, 170
+
+
+def read_stack(paths):
+    stack = []
+    for path in paths:
+        with rasterio.open(path) as src:
+            stack.append(src.read(1))
+    return np.stack(stack)
+
+
+@pytest.mark.parametrize("block_size, cog", [(64, False), (48, True), (512, False)])
+def test_streaming_median_matches_nanmedian(tmp_path, block_size, cog):
+    scenes = synthetic_stack(str(tmp_path), 2016, 5, HEIGHT, WIDTH, cloud_fraction = 0.5)
+    stack = read_stack(scenes)
+    with pytest.warns(RuntimeWarning):
+        expected = np.nanmedian(stack, axis = 0)
+    assert np.isnan(expected).any()  # some pixels are NoData in every scene
+
+    output = str(tmp_path / "median.tif")
+    assert MergeMedianRasters(str(tmp_path), block_size = block_size, cog = cog).median_composite(scenes, output)
+    with rasterio.open(output) as src:
+        np.testing.assert_array_equal(src.read(1), expected.astype(np.float32))
+
+
+def test_all_nodata_composite_is_not_written(tmp_path):
+    scenes = synthetic_stack(str(tmp_path), 2016, 2, HEIGHT, WIDTH, nan_fraction = 1.0)
+    output = str(tmp_path / "median.tif")
+    assert not MergeMedianRasters(str(tmp_path), block_size = 64).median_composite(scenes, output)
+    assert not os.path.exists(output)
@@ -0,0 +1,33 @@
+import warnings
+
+import numpy as np
+
+from policy_analysis import ndvi_codec
+
+
+def test_median_int16_matches_nanmedian_of_decoded_stack():
+    rng = np.random.default_rng(0)
+    scenes, height, width = 6, 20, 21
+    stack = rng.integers(-10000, 10001, (scenes, height, width)).astype(np.int16)
+    # every pixel has a valid count from 0 to `scenes` (zero, one, even and odd), in random years
+    counts = np.arange(height * width).reshape(height, width) % (scenes + 1)
+    ranks = rng.random(stack.shape).argsort(axis = 0).argsort(axis = 0)
+    stack[ranks >= counts] = ndvi_codec.NODATA
+    stack[:, 0, 2] = [ndvi_codec.NODATA, -32767, 32767, 32767, -32767, ndvi_codec.NODATA]  # int16 extremes
+
+    median = ndvi_codec.median_int16(stack)
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", RuntimeWarning)  # all-NaN slices
+        expected = np.nanmedian(ndvi_codec.decode(stack).astype(np.float64), axis = 0)
+
+    assert set(np.unique((stack != ndvi_codec.NODATA).sum(axis = 0))) == set(range(scenes + 1))
+    assert median.dtype == np.int16
+    np.testing.assert_array_equal(median == ndvi_codec.NODATA, np.isnan(expected))
+    np.testing.assert_allclose(ndvi_codec.decode(median), expected, atol = 1e-4)
+
+
+def test_encode_round_trips_to_the_nearest_step():
+    ndvi = np.array([-1.0, -0.12345, 0.0, 0.56789, 1.0, np.nan])
+    decoded = ndvi_codec.decode(ndvi_codec.encode(ndvi))
+    assert np.isnan(decoded[-1])
+    np.testing.assert_allclose(decoded[:-1], ndvi[:-1], atol = ndvi_codec.SCALE / 2 + 1e-7)
@@ -0,0 +1,77 @@
+import json
+
+import numpy as np
+import pytest
+import rasterio
+from rasterio.windows import Window
+
+from policy_analysis import ndvi_codec
+from policy_analysis.benchmark import synthetic_stack
+from policy_analysis.ndvi_cube import METADATA_FILE, NDVICube, RasterStack, open_stack
+
+HEIGHT, WIDTH = 50, 61
+
+
+def yearly_rasters(directory, years, height = HEIGHT, width = WIDTH, seed = 0):
+    return [path for year in years for path in synthetic_stack(str(directory), year, 1, height, width, seed = seed + year)]
+
+
+def compact_copy(path, output):
+    with rasterio.open(path) as src:
+        profile = ndvi_codec.compact_profile(src.profile)
+        data = src.read(1)
+    with rasterio.open(output, "w", **profile) as dst:
+        ndvi_codec.set_scaling(dst)
+        dst.write(ndvi_codec.encode(data), 1)
+    return output
+
+
+def test_cube_reads_like_the_rasters(tmp_path):
+    rasters = yearly_rasters(tmp_path, (2016, 2017))
+    rasters[1] = compact_copy(rasters[1], str(tmp_path / "ndvi_compact_2017.tif"))  # unscaled on read
+    cube = NDVICube.build(rasters, str(tmp_path / "cube"), block_size = 16)
+    stack = RasterStack(rasters)
+
+    assert cube.years == stack.years == [2016, 2017]
+    np.testing.assert_array_equal(cube.read(), stack.read())
+    window = Window(7, 11, 30, 20)
+    np.testing.assert_array_equal(cube.read(window, years = [2017]), stack.read(window, years = [2017]))
+    np.testing.assert_array_equal(cube.pixel_series(12, 40), stack.read()[:, 12, 40])
+    assert isinstance(open_stack(str(tmp_path / "cube")), NDVICube)
+    assert isinstance(open_stack(rasters), RasterStack)
+    stack.close()
+
+
+def test_build_appends_new_years_and_skips_existing_ones(tmp_path):
+    first = yearly_rasters(tmp_path / "first", (2016, 2017))
+    cube_dir = str(tmp_path / "cube")
+    original = NDVICube.build(first, cube_dir).read()
+
+    # 2017 again, with different data, plus a new year 2019
+    later = yearly_rasters(tmp_path / "later", (2017, 2019), seed = 100)
+    cube = NDVICube.build(later, cube_dir)
+
+    with open(tmp_path / "cube" / METADATA_FILE) as f:
+        assert json.load(f)["years"] == [2016, 2017, 2019]
+    assert cube.years == NDVICube(cube_dir).years == [2016, 2017, 2019]
+    np.testing.assert_array_equal(cube.read(years = [2016, 2017]), original)  # the existing 2017 slice is kept
+    np.testing.assert_array_equal(cube.read(years = [2019]), RasterStack(later[1:]).read())
+
+    with pytest.raises(ValueError, match = "already in the cube"):
+        cube.append(later[0])
+    cube.append(later[0], overwrite = True)
+    np.testing.assert_array_equal(cube.read(years = [2017]), RasterStack(later[:1]).read())
+
+
+def test_append_rejects_another_grid(tmp_path):
+    cube = NDVICube.build(yearly_rasters(tmp_path / "first", (2016,)), str(tmp_path / "cube"))
+    smaller, = yearly_rasters(tmp_path / "smaller", (2017,), height = HEIGHT - 1)
+    with pytest.raises(ValueError, match = "is not on the cube grid"):
+        cube.append(smaller)
+
+    shifted, = yearly_rasters(tmp_path / "shifted", (2018,))
+    with rasterio.open(shifted, "r+") as dst:
+        dst.transform = dst.transform * dst.transform.translation(1, 0)
+    with pytest.raises(ValueError, match = "is not on the cube grid"):
+        cube.append(shifted)
+    assert NDVICube(str(tmp_path / "cube")).years == [2016]
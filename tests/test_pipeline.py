@@ -0,0 +1,61 @@
+import os
+import shutil
+
+import numpy as np
+import pandas as pd
+import rasterio
+
+from policy_analysis.benchmark import synthetic_stack, synthetic_zones
+from policy_analysis.pipeline import ndvi_pipeline
+from policy_analysis.zonal_stats import load_zones
+
+
+def shapefile_zones(tmp_path, name = "zones"):
+    zones = load_zones(synthetic_zones(str(tmp_path / "zones.gpkg"), 3, 64, 64), layer = "bdas")
+    zones = zones.rename(columns = {"project_name": "name"})  # shapefile field names are cut at 10 characters
+    path = str(tmp_path / f"{name}.shp")
+    zones.to_file(path)
+    return path, zones
+
+
+def test_shapefile_attribute_edit_rebuilds_zonal_tasks(tmp_path):
+    synthetic_stack(str(tmp_path / "scenes"), 2016, 2, 64, 64)
+    zones_path, zones = shapefile_zones(tmp_path)
+
+    def pipeline():
+        return ndvi_pipeline(str(tmp_path / "scenes"), zones_path, zones_layer = None, id_column = "name")
+
+    assert len(pipeline().run()) == 4
+    assert pipeline().run(dry_run = True) == []
+
+    # rewrite only the .dbf, as an attribute edit in a GIS would
+    os.makedirs(tmp_path / "edited")
+    zones.assign(name = zones["name"] + "_renamed").to_file(str(tmp_path / "edited" / "zones.shp"))
+    shutil.copy(tmp_path / "edited" / "zones.dbf", tmp_path / "zones.dbf")
+
+    assert [task.stage for task in pipeline().run(dry_run = True)] == ["zonal", "combine"]
+    pipeline().run()
+    table = pd.read_csv(tmp_path / "scenes" / "merged_outputs" / "zonal_stats.csv")
+    assert table["name"].str.endswith("_renamed").all()
+
+
+def test_all_nodata_year_is_recorded_empty(tmp_path):
+    directory = str(tmp_path / "scenes")
+    synthetic_stack(directory, 2016, 2, 64, 64)
+    for path in synthetic_stack(directory, 2017, 2, 64, 64, seed = 1):
+        with rasterio.open(path, "r+") as dst:
+            dst.write(np.full((64, 64), np.nan, dtype = np.float32), 1)
+    synthetic_stack(directory, 2018, 2, 64, 64, seed = 2)
+    zones_path, _ = shapefile_zones(tmp_path)
+
+    rebuilt = ndvi_pipeline(directory, zones_path, zones_layer = None, id_column = "name").run()
+    assert len(rebuilt) == 10
+
+    merged = os.path.join(directory, "merged_outputs")
+    assert not os.path.exists(os.path.join(merged, "median_raster_2017.tif"))
+    assert not os.path.exists(os.path.join(merged, "zonal", "zonal_stats_2017.csv"))
+    table = pd.read_csv(os.path.join(merged, "zonal_stats.csv"))
+    assert sorted(table["year"].unique()) == [2016, 2018]
+
+    # the empty year is current too, so nothing is rebuilt
+    assert ndvi_pipeline(directory, zones_path, zones_layer = None, id_column = "name").run(dry_run = True) == []
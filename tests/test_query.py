@@ -0,0 +1,112 @@
+import numpy as np
+import pandas as pd
+import pytest
+import rasterio
+from rasterio.transform import rowcol
+from rasterio.warp import transform
+
+from policy_analysis.benchmark import synthetic_stack, synthetic_zones
+from policy_analysis.query import BlockCache, NDVIQuery
+from policy_analysis.zonal_stats import load_zones, zonal_stats_table
+
+HEIGHT, WIDTH = 90, 110
+YEARS = (2016, 2017)
+
+
+def yearly_rasters(tmp_path, layout):
+    """
+    One synthetic raster per year, rewritten as 32x32 tiles or 5-row strips.
+    """
+    paths = []
+    for year in YEARS:
+        scene, = synthetic_stack(str(tmp_path / "scenes"), year, 1, HEIGHT, WIDTH, seed = year)
+        with rasterio.open(scene) as src:
+            data, profile = src.read(1), src.profile
+        if layout == "tiled":
+            profile.update(tiled = True, blockxsize = 32, blockysize = 32)
+        else:
+            profile.update(tiled = False, blockysize = 5)
+            profile.pop("blockxsize")
+        path = str(tmp_path / f"ndvi_{layout}_{year}.tif")
+        with rasterio.open(path, "w", **profile) as dst:
+            dst.write(data, 1)
+        paths.append(path)
+    return paths
+
+
+def expected_values(path, xs, ys):
+    with rasterio.open(path) as src:
+        data = src.read(1)
+        rows, cols = (np.asarray(v) for v in rowcol(src.transform, xs, ys))
+    inside = (rows >= 0) & (rows < HEIGHT) & (cols >= 0) & (cols < WIDTH)
+    values = np.full(len(xs), np.nan, dtype = np.float32)
+    values[inside] = data[rows[inside], cols[inside]]
+    return values
+
+
+@pytest.mark.parametrize("layout", ["tiled", "striped"])
+def test_points_match_rowcol_indexing(tmp_path, layout):
+    paths = yearly_rasters(tmp_path, layout)
+    with rasterio.open(paths[0]) as src:
+        assert src.block_shapes[0] == ((32, 32) if layout == "tiled" else (5, WIDTH))
+        origin_x, origin_y, size = src.transform.c, src.transform.f, src.transform.a
+    rng = np.random.default_rng(0)
+    rows = np.concatenate([rng.integers(0, HEIGHT, 200), [-1, 3, HEIGHT, 10]])
+    cols = np.concatenate([rng.integers(0, WIDTH, 200), [4, -3, 5, WIDTH + 2]])  # the last four are off the raster
+    xs, ys = origin_x + (cols + 0.5) * size, origin_y - (rows + 0.5) * size  # pixel centres
+
+    query = NDVIQuery(paths)
+    table = query.points(xs, ys)
+    lon, lat = transform("EPSG:27700", "EPSG:4326", xs, ys)
+    reprojected = query.points(lon, lat, crs = "EPSG:4326")
+    for year, path in zip(YEARS, paths):
+        expected = expected_values(path, xs, ys)
+        assert np.isnan(expected[-4:]).all()
+        np.testing.assert_array_equal(table[year].to_numpy(), expected)
+        np.testing.assert_array_equal(reprojected[year].to_numpy(), expected)
+    np.testing.assert_array_equal(query.point(xs[0], ys[0]).to_numpy(), table.iloc[0].to_numpy())
+    query.close()
+
+
+def test_block_cache_evicts_least_recently_used_within_max_bytes():
+    block = np.zeros((16, 16), dtype = np.float32)  # 1 KiB
+    cache = BlockCache(max_bytes = 3 * block.nbytes)
+    for key in range(3):
+        cache.put(key, block.copy())
+    assert cache.get(0) is not None  # 0 is now the most recently used
+    cache.put(3, block.copy())
+
+    assert cache.nbytes == 3 * block.nbytes <= cache.max_bytes
+    assert cache.get(1) is None  # evicted
+    assert all(cache.get(key) is not None for key in (0, 2, 3))
+    assert (cache.hits, cache.misses) == (4, 1)
+    for key in range(4, 20):
+        cache.put(key, block.copy())
+        assert cache.nbytes <= cache.max_bytes
+
+
+def test_repeated_points_are_served_from_the_cache(tmp_path):
+    paths = yearly_rasters(tmp_path, "tiled")
+    with rasterio.open(paths[0]) as src:
+        xs, ys = src.xy([1, 2, 40], [1, 3, 70])
+    query = NDVIQuery(paths)
+    query.points(xs, ys)
+    misses = query.cache.misses
+    query.points(xs, ys)
+    assert query.cache.misses == misses
+    query.close()
+
+
+@pytest.mark.parametrize("all_touched", [False, True])
+def test_polygon_matches_zonal_stats_table(tmp_path, all_touched):
+    paths = yearly_rasters(tmp_path, "tiled")
+    zones = load_zones(synthetic_zones(str(tmp_path / "zones.gpkg"), 4, HEIGHT, WIDTH), layer = "bdas")
+    table = zonal_stats_table(paths, zones, all_touched = all_touched)
+
+    query = NDVIQuery(paths)
+    for name, geometry in zip(zones["project_name"], zones.geometry):
+        expected = table[table["project_name"] == name].drop(columns = "project_name").reset_index(drop = True)
+        pd.testing.assert_frame_equal(query.polygon(geometry, all_touched = all_touched), expected, check_dtype = False)
+    reprojected = zones.to_crs("EPSG:4326").geometry.iloc[0]
+    assert query.polygon(reprojected, crs = "EPSG:4326")["count"].sum() > 0
+    query.close()
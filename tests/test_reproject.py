@@ -0,0 +1,50 @@
+import os
+
+import numpy as np
+import pytest
+import rasterio
+
+from policy_analysis import cli
+from policy_analysis.benchmark import synthetic_stack, synthetic_zones
+from policy_analysis.reproject import parse_epsg
+from policy_analysis.zonal_stats import ZoneIndex, load_zones
+
+
+def test_parse_epsg_from_string():
+    assert parse_epsg("EPSG:27700") == 27700
+    with pytest.raises(ValueError):
+        parse_epsg("not a crs")
+
+
+def test_reproject_command(tmp_path):
+    path, = synthetic_stack(str(tmp_path), 2016, 1, 96, 128)
+    input_dir = os.path.dirname(path)
+
+    assert cli.main(["--quiet", "reproject", input_dir, "--crs", "EPSG:4326", "--block-size", "64"]) == 0
+
+    output = os.path.join(input_dir, "reprojected", "NDVI_2016_000_repro.tif")
+    with rasterio.open(output) as dst, rasterio.open(path) as src:
+        assert dst.crs.to_epsg() == 4326
+        reprojected = dst.read(1)
+        source = src.read(1)
+    valid = reprojected[~np.isnan(reprojected)]
+    assert valid.size > 0.5 * reprojected.size
+    # nearest neighbour only ever picks source values
+    assert np.isin(valid, source[~np.isnan(source)]).all()
+
+
+def test_reproject_command_clips_like_a_full_grid_mask(tmp_path):
+    path, = synthetic_stack(str(tmp_path), 2016, 1, 96, 128)
+    input_dir = os.path.dirname(path)
+    zones_path = synthetic_zones(str(tmp_path / "zones.gpkg"), 3, 96, 128)
+
+    cli.main(["--quiet", "reproject", input_dir, "--crs", "EPSG:27700", "--clip", zones_path, "--block-size", "32"])
+
+    with rasterio.open(os.path.join(input_dir, "reprojected", "NDVI_2016_000_repro.tif")) as dst:
+        clipped = dst.read(1)
+        zones = load_zones(zones_path)
+        mask = ZoneIndex.from_geometries(zones.geometry, dst.transform, dst.shape, all_touched = True).mask()
+    with rasterio.open(path) as src:
+        source = src.read(1)
+    assert np.isnan(clipped[~mask]).all()
+    np.testing.assert_array_equal(clipped[mask], source[mask])
@@ -0,0 +1,95 @@
+import numpy as np
+import pytest
+import rasterio
+
+from policy_analysis.benchmark import synthetic_stack
+from policy_analysis.temporal_fill import SOURCE_NODATA, fill_gaps, temporal_fill
+
+YEARS = np.array([2005, 2006, 2009, 2010, 2014, 2015, 2020])
+
+
+def reference(series, years, method, max_gap):
+    """
+    Fills one pixel's series year by year from its nearest valid years, as a per-pixel loop.
+    """
+    filled = np.full(len(years), np.nan, dtype = np.float32)
+    sources = np.full((2, len(years)), SOURCE_NODATA, dtype = np.int16)
+    valid = np.flatnonzero(~np.isnan(series))
+    for i, year in enumerate(years):
+        before = [j for j in valid if j <= i and (max_gap is None or year - years[j] <= max_gap)]
+        after = [j for j in valid if j >= i and (max_gap is None or years[j] - year <= max_gap)]
+        before, after = (before[-1] if before else None), (after[0] if after else None)
+        if method == "linear":
+            if before is None or after is None:
+                continue
+            weight = 0 if before == after else (year - years[before]) / (years[after] - years[before])
+            filled[i] = series[before] + (series[after] - series[before]) * weight
+            sources[:, i] = years[before], years[after]
+        else:
+            if before is None and after is None:
+                continue
+            if after is None or (before is not None and year - years[before] <= years[after] - year):
+                source = before
+            else:
+                source = after
+            filled[i] = series[source]
+            sources[:, i] = years[source]
+    return filled, sources
+
+
+def gappy_stack(shape, seed = 0):
+    rng = np.random.default_rng(seed)
+    stack = rng.uniform(-0.2, 0.9, (len(YEARS), *shape)).astype(np.float32)
+    stack[rng.random(stack.shape) < 0.45] = np.nan
+    stack[:, 0, 0] = np.nan  # never valid
+    stack[:, 0, 1] = np.nan
+    stack[3, 0, 1] = 0.5  # valid in a single year
+    return stack
+
+
+@pytest.mark.parametrize("method", ["linear", "nearest"])
+@pytest.mark.parametrize("max_gap", [None, 1, 3])
+def test_fill_gaps_matches_per_pixel_reference(method, max_gap):
+    stack = gappy_stack((9, 11))
+    filled, source_before, source_after = fill_gaps(stack, YEARS, method = method, max_gap = max_gap)
+
+    for row in range(stack.shape[1]):
+        for col in range(stack.shape[2]):
+            expected, sources = reference(stack[:, row, col], YEARS, method, max_gap)
+            np.testing.assert_allclose(filled[:, row, col], expected, rtol = 1e-6, atol = 1e-7,
+                                       err_msg = f"{method} at {row}, {col}")
+            np.testing.assert_array_equal(source_before[:, row, col], sources[0])
+            np.testing.assert_array_equal(source_after[:, row, col], sources[1])
+    valid = ~np.isnan(stack)
+    np.testing.assert_array_equal(filled[valid], stack[valid])  # valid pixels are kept as they are
+
+
+def test_unknown_method_is_rejected():
+    with pytest.raises(ValueError, match = "Unknown method"):
+        fill_gaps(gappy_stack((2, 2)), YEARS, method = "cubic")
+
+
+def test_temporal_fill_writes_filled_and_source_rasters(tmp_path):
+    height, width = 45, 38
+    rasters = [path for year in YEARS for path in
+               synthetic_stack(str(tmp_path), int(year), 1, height, width, nan_fraction = 0.3, seed = int(year))]
+    stack = []
+    for path in rasters:
+        with rasterio.open(path) as src:
+            stack.append(src.read(1))
+    stack = np.stack(stack)
+    expected, expected_before, expected_after = fill_gaps(stack, YEARS, method = "nearest", max_gap = 4)
+
+    output_dir = tmp_path / "temporal"
+    summary = temporal_fill(rasters, str(output_dir), method = "nearest", max_gap = 4, block_rows = 16, block_size = 16)
+    for i, year in enumerate(YEARS):
+        with rasterio.open(output_dir / f"ndvi_temporal_{year}.tif") as src:
+            np.testing.assert_array_equal(src.read(1), expected[i])
+        with rasterio.open(output_dir / f"ndvi_temporal_source_{year}.tif") as src:
+            assert src.descriptions == ("source_before", "source_after")
+            np.testing.assert_array_equal(src.read(), np.stack([expected_before[i], expected_after[i]]))
+
+    assert summary["year"].tolist() == YEARS.tolist()
+    assert summary["missing"].tolist() == np.isnan(stack).sum(axis = (1, 2)).tolist()
+    assert summary["remaining"].tolist() == np.isnan(expected).sum(axis = (1, 2)).tolist()
+    assert summary["filled"].iloc[:-1].gt(0).all() and summary["filled"].iloc[-1] == 0  # 2020 is 5 years from 2015
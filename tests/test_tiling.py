@@ -0,0 +1,92 @@
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+import rasterio
+
+from policy_analysis import cli
+from policy_analysis.benchmark import synthetic_stack, synthetic_zones
+from policy_analysis.fill_nodata import fill_is_current, fill_nodata
+from policy_analysis.merge_rasters import MergeMedianRasters
+from policy_analysis.tiling import TiledJob
+from policy_analysis.utils import file_hash
+from policy_analysis.zonal_stats import ZoneLayer, zonal_stats_table
+
+HEIGHT, WIDTH = 150, 170
+
+
+def read(path):
+    with rasterio.open(path) as src:
+        return src.read(1), src.profile, src.tags(), src.scales, src.offsets
+
+
+def assert_same_raster(path, expected_path):
+    data, profile, tags, scales, offsets = read(path)
+    expected_data, expected_profile, expected_tags, expected_scales, expected_offsets = read(expected_path)
+    np.testing.assert_array_equal(data, expected_data)
+    assert str(profile) == str(expected_profile)  # nodata is NaN, which never compares equal
+    assert tags == expected_tags
+    assert (scales, offsets) == (expected_scales, expected_offsets)
+
+
+def tiles(*argv):
+    assert cli.main(["--quiet", "tiles", *argv]) == 0
+
+
+@pytest.mark.parametrize("compact", [False, True])
+def test_tiled_composite_matches_single_array(tmp_path, compact):
+    scenes = synthetic_stack(str(tmp_path), 2016, 4, HEIGHT, WIDTH)
+    expected = str(tmp_path / "median.tif")
+    MergeMedianRasters(str(tmp_path), block_size = 64, compact = compact).median_composite(scenes, expected)
+
+    output = str(tmp_path / "tiled_median.tif")
+    tiles("create", str(tmp_path / "job"), "composite", output, *scenes, "--tile-size", "64", "--block-size", "64",
+          *(["--compact"] if compact else []))
+    tiles("work", str(tmp_path / "job"))
+    tiles("finish", str(tmp_path / "job"))
+    assert_same_raster(output, expected)
+
+
+def test_tiled_fill_matches_single_array_and_is_current(tmp_path):
+    scenes = synthetic_stack(str(tmp_path), 2016, 2, HEIGHT, WIDTH, cloud_fraction = 0.4)
+    median = str(tmp_path / "median.tif")
+    MergeMedianRasters(str(tmp_path), block_size = 64).median_composite(scenes, median)
+    expected = str(tmp_path / "filled.tif")
+    fill_nodata(median, expected, max_distance = 50, tile_size = 64, block_size = 64)
+
+    output = str(tmp_path / "tiled_filled.tif")
+    tiles("create", str(tmp_path / "job"), "fill", output, median, "--tile-size", "64", "--block-size", "64",
+          "--max-distance", "50")
+    tiles("work", str(tmp_path / "job"))
+    tiles("finish", str(tmp_path / "job"))
+
+    assert_same_raster(output, expected)
+    assert fill_is_current(output, file_hash(median), 50)
+
+
+def test_tiled_zonal_matches_zonal_stats_table(tmp_path):
+    rasters = [path for year in (2016, 2017) for path in synthetic_stack(str(tmp_path), year, 1, HEIGHT, WIDTH, seed = year)]
+    zones_path = synthetic_zones(str(tmp_path / "zones.gpkg"), 6, HEIGHT, WIDTH)
+    expected = zonal_stats_table(rasters, ZoneLayer(zones_path, layer = "bdas", id_column = "project_name"))
+
+    output = str(tmp_path / "zonal.csv")
+    tiles("create", str(tmp_path / "job"), "zonal", output, *rasters, "--tile-size", "64",
+          "--zones", zones_path, "--layer", "bdas", "--id-column", "project_name")
+    tiles("work", str(tmp_path / "job"))
+    tiles("finish", str(tmp_path / "job"))
+
+    expected.to_csv(tmp_path / "expected.csv", index = False)
+    pd.testing.assert_frame_equal(pd.read_csv(output), pd.read_csv(tmp_path / "expected.csv"))
+
+
+def test_tiled_composite_of_nodata_is_not_written(tmp_path):
+    scenes = synthetic_stack(str(tmp_path), 2016, 2, HEIGHT, WIDTH, nan_fraction = 1.0)
+    output = str(tmp_path / "tiled_median.tif")
+    assert not MergeMedianRasters(str(tmp_path), block_size = 64).median_composite(scenes, output)
+
+    open(output, "wb").close()  # an earlier output is removed, as by the single-array path
+    job = TiledJob.create(str(tmp_path / "job"), "composite", scenes, output, tile_size = 64)
+    job.work()
+    assert job.finish() is False
+    assert not os.path.exists(output)
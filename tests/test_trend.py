@@ -0,0 +1,52 @@
+import numpy as np
+from scipy import stats
+
+from policy_analysis.trend import pixel_trends
+
+YEARS = np.arange(2010, 2020)
+
+
+def reference(series, years):
+    valid = ~np.isnan(series)
+    result = stats.linregress(years[valid] - years[0], series[valid].astype(np.float64))
+    expected = {"slope": result.slope, "intercept": result.intercept, "r2": result.rvalue ** 2,
+                "p_value": result.pvalue, "n_years": valid.sum()}
+    if np.ptp(series[valid]) == 0:
+        # linregress leaves r and p undefined (NaN) for a flat series; pixel_trends reports no trend: r2 0, p 1
+        expected.update(r2 = 0.0, p_value = 1.0)
+    return expected
+
+
+def test_pixel_trends_match_linregress():
+    rng = np.random.default_rng(0)
+    stack = (0.4 + 0.01 * rng.normal(size = (1, 6, 7)) * (YEARS - 2010)[:, None, None]
+             + rng.normal(0, 0.05, (len(YEARS), 6, 7))).astype(np.float32)
+    stack[rng.random(stack.shape) < 0.2] = np.nan  # NaN years, dropped per pixel
+    stack[:, 0, 0] = 0.5  # flat
+    stack[:, 0, 1] = 0.3 + 0.02 * (YEARS - 2010)  # exact fit
+    stack[:, 0, 2] = np.where(YEARS % 2, np.nan, 0.6)  # flat with gaps
+
+    trends = pixel_trends(stack, YEARS)
+    for row in range(stack.shape[1]):
+        for col in range(stack.shape[2]):
+            expected = reference(stack[:, row, col], YEARS)
+            if expected["n_years"] < 3:
+                assert np.isnan(trends["slope"][row, col])
+                continue
+            for name, value in expected.items():
+                np.testing.assert_allclose(trends[name][row, col], value, rtol = 1e-4, atol = 1e-5,
+                                           err_msg = f"{name} at {row}, {col}")
+
+
+def test_flat_series_is_not_significant():
+    stack = np.full((len(YEARS), 2, 2), 0.42, dtype = np.float32)
+    trends = pixel_trends(stack, YEARS)
+    assert (trends["slope"] == 0).all()
+    assert (trends["r2"] == 0).all()
+    assert (trends["p_value"] == 1).all()
+
+
+def test_too_few_years_is_nan():
+    stack = np.full((len(YEARS), 1, 1), np.nan, dtype = np.float32)
+    stack[:2, 0, 0] = [0.1, 0.2]
+    assert all(np.isnan(values).all() for values in pixel_trends(stack, YEARS).values())
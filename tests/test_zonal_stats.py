@@ -0,0 +1,94 @@
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+import rasterio
+from rasterio.crs import CRS
+from rasterio.features import geometry_mask
+from rasterio.transform import from_origin
+
+from policy_analysis.benchmark import ORIGIN, PIXEL_SIZE, synthetic_stack, synthetic_zones
+from policy_analysis.utils import year_from_path
+from policy_analysis.zonal_stats import ZoneLayer, load_zones, sort_by_zone, zonal_statistics, zonal_stats_table
+
+HEIGHT, WIDTH = 80, 90
+GRID = (from_origin(*ORIGIN, PIXEL_SIZE, PIXEL_SIZE), (HEIGHT, WIDTH), CRS.from_epsg(27700))
+COARSE_GRID = (from_origin(*ORIGIN, 2 * PIXEL_SIZE, 2 * PIXEL_SIZE), (HEIGHT // 2, WIDTH // 2), CRS.from_epsg(27700))
+
+
+def cached(cache_dir):
+    return sorted(os.listdir(cache_dir))
+
+
+def test_index_cache_is_reused_and_written_atomically(tmp_path):
+    zones_path = synthetic_zones(str(tmp_path / "zones.gpkg"), 5, HEIGHT, WIDTH)
+    cache_dir = str(tmp_path / "cache")
+    index = ZoneLayer(zones_path, layer = "bdas", id_column = "project_name", cache_dir = cache_dir).index_for(*GRID)
+
+    assert len(cached(cache_dir)) == 1 and cached(cache_dir)[0].endswith(".npz")  # no temporary file left behind
+    layer = ZoneLayer(zones_path, layer = "bdas", id_column = "project_name", cache_dir = cache_dir)
+    layer._gdf = False  # a cache hit must not read the geometries
+    reloaded = layer.index_for(*GRID)
+    np.testing.assert_array_equal(reloaded.pixel_index, index.pixel_index)
+    assert reloaded.names == index.names
+
+
+def test_changed_vector_evicts_entries_on_every_grid(tmp_path):
+    zones_path = synthetic_zones(str(tmp_path / "zones.gpkg"), 5, HEIGHT, WIDTH)
+    cache_dir = str(tmp_path / "cache")
+    ZoneLayer(zones_path, layer = "bdas", cache_dir = cache_dir).index_for(*GRID)
+    ZoneLayer(zones_path, layer = "bdas", cache_dir = cache_dir).index_for(*COARSE_GRID)
+    other_layer = ZoneLayer(zones_path, layer = "other", cache_dir = cache_dir).cache_path(*GRID)
+    open(other_layer, "wb").close()
+    assert len(cached(cache_dir)) == 3
+
+    os.remove(zones_path)
+    synthetic_zones(zones_path, 5, HEIGHT, WIDTH, seed = 1)
+    layer = ZoneLayer(zones_path, layer = "bdas", cache_dir = cache_dir)
+    layer.index_for(*GRID)
+
+    # the coarse grid's entry was built from the old polygons and is gone; other layers are left alone
+    assert cached(cache_dir) == sorted([os.path.basename(layer.cache_path(*GRID)), os.path.basename(other_layer)])
+
+
+def polygon_stats(values):
+    if len(values) == 0:
+        return {"count": 0, "mean": np.nan, "median": np.nan, "std": np.nan, "min": np.nan, "max": np.nan}
+    return {"count": len(values), "mean": values.mean(), "median": np.median(values), "std": values.std(),
+            "min": values.min(), "max": values.max()}
+
+
+@pytest.mark.parametrize("all_touched", [False, True])
+def test_zonal_stats_match_per_polygon_masks(tmp_path, all_touched):
+    rasters = [path for year in (2016, 2017) for path in synthetic_stack(str(tmp_path), year, 1, HEIGHT, WIDTH, seed = year)]
+    zones_path = synthetic_zones(str(tmp_path / "zones.gpkg"), 8, HEIGHT, WIDTH)
+    zones = load_zones(zones_path, layer = "bdas")
+    table = zonal_stats_table(rasters, zones, all_touched = all_touched)
+
+    rows = []
+    for path in rasters:
+        with rasterio.open(path) as src:
+            data = src.read(1)
+            for name, geometry in zip(zones["project_name"], zones.geometry):
+                inside = geometry_mask([geometry], data.shape, src.transform, all_touched = all_touched, invert = True)
+                values = data[inside & ~np.isnan(data)].astype(np.float64)
+                rows.append({"project_name": name, "year": year_from_path(path), **polygon_stats(values)})
+    expected = pd.DataFrame(rows)
+
+    pd.testing.assert_frame_equal(table[expected.columns], expected, check_dtype = False, rtol = 1e-9)
+
+
+@pytest.mark.parametrize("dtype", [np.float32, np.float64, np.int8, np.uint8, np.int16, np.uint16, np.int32, np.uint32])
+def test_sort_by_zone_is_exact_for_every_dtype(dtype):
+    rng = np.random.default_rng(0)
+    info = np.finfo(dtype) if np.issubdtype(dtype, np.floating) else np.iinfo(dtype)
+    values = rng.uniform(max(info.min, -2.0 ** 40), min(info.max, 2.0 ** 40), 5000).astype(dtype)
+    values[:3] = [info.max, info.max - 1, 0] if np.issubdtype(dtype, np.integer) else [1.5, -0.0, 0.0]
+    zones = rng.integers(0, 7, len(values)).astype(np.int32)
+    np.testing.assert_array_equal(sort_by_zone(values, zones), values[np.lexsort((values, zones))])
+
+
+def test_int32_statistics_above_float32_precision():
+    stats = zonal_statistics(np.array([16777217, 16777216, 16777218], np.int32), np.zeros(3, np.int32), 1)
+    assert (stats["median"][0], stats["min"][0], stats["max"][0]) == (16777217, 16777216, 16777218)